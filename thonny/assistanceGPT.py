@@ -8,8 +8,9 @@ import shutil
 import subprocess
 import sys
 import textwrap
+import time
 import tkinter as tk
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from logging import getLogger
 from tkinter import PhotoImage, messagebox, ttk
 from typing import Dict  # pylint disable=unused-import
@@ -30,6 +31,16 @@ from thonny.common import (
     ToplevelResponse,
     read_source,
 )
+from thonny.gpt_utils import (
+    ChatHistoryLog,
+    LatencyStats,
+    ResponseCache,
+    build_chat_messages,
+    call_with_retries,
+    get_history_log_path,
+    get_pooled_openai_client,
+    parse_request_settings,
+)
 from thonny.languages import tr
 from thonny.misc_utils import levenshtein_damerau_distance, running_on_mac_os
 from thonny.ui_utils import CommonDialog, get_hyperlink_cursor, scrollbar_style
@@ -52,6 +63,7 @@ class AssistantViewGPT(tk.Frame):
 
         self.GPT_USER_DIR = os.path.join(THONNY_USER_DIR, "gpt_files")
         self.ACTUAL_GPT_USER_FILE = ""
+        self._history_log = None  # type: Optional[ChatHistoryLog]
 
         if not os.path.exists(self.GPT_USER_DIR):
             os.makedirs(self.GPT_USER_DIR, mode=0o700, exist_ok=True)
@@ -72,6 +84,19 @@ class AssistantViewGPT(tk.Frame):
         self.last_file_tab = ""
         self.last_apikey = ""
 
+        # rendered conversations of recently visited files, most recent last
+        self._conversations = OrderedDict()  # type: OrderedDict[str, _Conversation]
+        self._conversation = None  # type: Optional[_Conversation]
+        self._rendering_older_bubbles = False
+        self._relayout_after_id = None
+        self._relayout_scheduled = False
+
+        self._request_executor = None
+        self._pending_request = None  # type: Optional[_PendingGPTRequest]
+        self._response_cache = None  # type: Optional[ResponseCache]
+        self._latency_stats = LatencyStats()
+        self._prompt_status = ""
+
         self.main_frame = tk.Frame.__init__(self, master, bg="#E0E0E0")
         self.setup_ui()
         self.bind("<Configure>", self.on_window_configure)
@@ -85,74 +110,51 @@ class AssistantViewGPT(tk.Frame):
         self.dummy.config(width=(self.winfo_width() - self.scrollbar.winfo_width() * 2))
         if bubble_width != self.last_bubble_width:
             self.last_bubble_width = bubble_width
-            self.adjust_bubble_size(bubble_width)
-
-    def adjust_bubble_size(self, bubble_width):
-        self.bind_config_event = False
-        code_bubble_width = int(bubble_width / 10)
-        for bubble in self.bubbles:
-            for textblock in bubble.textblocks:
-                textblock.config(wraplength=bubble_width)
-            for codeblock in bubble.codeblocks:
-                """lines = 0
-                chars = 0
-                line_chars = 0
-                for char in codeblock.get("1.0", "end-1c"):
-                    if char == "\n":
-                        lines += 1
-                        line_chars = 0
-                    elif line_chars >= code_bubble_width:
-                        lines += 1
-                        line_chars = 1
-                    else:
-                        line_chars += 1
-                    chars += 1
-                lines += 1"""
-
-                lines = self._get_height_of_codeblock(
-                    codeblock.get("1.0", "end-1c"), code_bubble_width
-                )
+            # dragging the sash gives a stream of events, relayout when it calms down
+            if self._relayout_after_id is not None:
+                self.after_cancel(self._relayout_after_id)
+            self._relayout_after_id = self.after(100, self._relayout_after_resize)
 
-                width = min(
-                    code_bubble_width,
-                    max(len(line) for line in codeblock.get("1.0", "end-1c").split("\n")) + 1,
-                )
+    def _relayout_after_resize(self):
+        self._relayout_after_id = None
+        self.adjust_bubble_size(self.last_bubble_width)
 
-                codeblock.config(width=width, height=lines)
-        self.scrollable_frame.update_idletasks()
-        self.canvas.yview_moveto(1)
-        self.bind_config_event = True
-
-    def _get_height_of_codeblock(self, codeblock, code_bubble_width):
-        lines_count = 0
-        current_line_length = 0
-
-        for line in codeblock.splitlines():
-            words = line.split()
-            for word in words:
-                if len(word) > code_bubble_width:
-                    # Wort ist länger als 100 Zeichen, setze es auf eine neue Zeile
-                    lines_count += 1 + (len(word) // code_bubble_width)
-                    current_line_length = len(word) % code_bubble_width
-                elif current_line_length == 0:
-                    # Start einer neuen Zeile
-                    lines_count += 1
-                    current_line_length = len(word)
-                elif current_line_length + len(word) + 1 <= code_bubble_width:
-                    # Platz für Wort und mindestens ein Leerzeichen ist vorhanden
-                    current_line_length += len(word) + 1
-                else:
-                    # Wort passt nicht in die aktuelle Zeile, starte eine neue Zeile
-                    lines_count += 1
-                    current_line_length = len(word)
-
-                current_line_length += 1  # Für das Leerzeichen nach jedem Wort
-
-            # Neue Zeile durch Zeilenumbruch
-            lines_count += 1
-            current_line_length = 0
-
-        return lines_count - 1
+    def adjust_bubble_size(self, bubble_width):
+        """Only the bubbles near the viewport get the new size right away,
+        others are updated when they get scrolled into view."""
+        self._conversation.bubble_width = bubble_width
+        at_bottom = self.canvas.yview()[1] >= 1.0
+        self._relayout_visible_bubbles()
+        if at_bottom:
+            self.canvas.yview_moveto(1)
+
+    def _relayout_visible_bubbles(self):
+        self._relayout_scheduled = False
+        bubble_width = self._conversation.bubble_width
+        stale_bubbles = [
+            bubble for bubble in self._get_visible_bubbles() if bubble.layout_width != bubble_width
+        ]
+        for bubble in stale_bubbles:
+            bubble.relayout(bubble_width)
+        if stale_bubbles:
+            self.scrollable_frame.update_idletasks()
+
+    def _get_visible_bubbles(self):
+        frame_height = self.scrollable_frame.winfo_height()
+        if frame_height <= 1:
+            # not laid out yet
+            return list(self.bubbles)
+
+        first, last = self.canvas.yview()
+        margin = self.canvas.winfo_height()
+        top = first * frame_height - margin
+        bottom = last * frame_height + margin
+        return [
+            bubble
+            for bubble in self.bubbles
+            if bubble.frame.winfo_y() + bubble.frame.winfo_height() >= top
+            and bubble.frame.winfo_y() <= bottom
+        ]
 
     def update_assistant_gpt_viewer(self, event=None):
         actual_file_tab = self.get_actual_file_tab()
@@ -180,29 +182,117 @@ class AssistantViewGPT(tk.Frame):
         _, actual_code_file_name_and_type = os.path.split(actual_code_file_tab)
         actual_code_file_name, _ = os.path.splitext(actual_code_file_name_and_type)
         # create specific gpt-folder for file
-        self.ACTUAL_GPT_USER_FILE = os.path.join(
-            self.GPT_USER_DIR, actual_code_file_name, (actual_code_file_name + ".json")
-        )
+        self.ACTUAL_GPT_USER_FILE = get_history_log_path(self.GPT_USER_DIR, actual_code_file_name)
         os.makedirs(os.path.dirname(self.ACTUAL_GPT_USER_FILE), mode=0o700, exist_ok=True)
-        self.clear_canvas(triggered_from_user=False)
-        self.canvas.yview_moveto(0)
-        if not os.path.exists(self.ACTUAL_GPT_USER_FILE):
-            with open(self.ACTUAL_GPT_USER_FILE, "w") as file:
-                file.write("{}")
-        else:
-            # show old message from logfile on screen
-            all_bubbles = self.read_bubbles_from_logfile()
-            for key, element in all_bubbles.items():
-                self.display_message(
-                    element["header"],
-                    element["message"],
-                    element["color"],
-                    element["anchor_orientation"],
-                    save_to_log=False,
-                    date_time=element["date_time"],
+        self._cancel_pending_request()
+        if self._history_log is not None:
+            self._history_log.close()
+        self._history_log = ChatHistoryLog(self.ACTUAL_GPT_USER_FILE)
+
+        conversation = self._conversations.pop(self.ACTUAL_GPT_USER_FILE, None)
+        if conversation is None:
+            conversation = self._create_conversation()
+            # old messages from logfile get bubbles only when they are scrolled into view
+            for element in self.read_bubbles_from_logfile():
+                conversation.records.append(
+                    {
+                        "header": element["header"],
+                        "message": element["message"].replace("\n\n", "\n"),
+                        "color": element["color"],
+                        "anchor_orientation": element["anchor_orientation"],
+                        "date_time": element["date_time"],
+                    }
                 )
+
+        if (
+            self._conversation is not conversation
+            and self._conversation not in self._conversations.values()
+        ):
+            # the conversation shown before any file tab was known
+            self._conversation.frame.destroy()
+
+        self._conversations[self.ACTUAL_GPT_USER_FILE] = conversation
+        while len(self._conversations) > max(
+            1, get_workbench().get_option("assistanceGPT.cached_conversations")
+        ):
+            _, evicted = self._conversations.popitem(last=False)
+            evicted.frame.destroy()
+
+        self._show_conversation(conversation)
+        self._render_older_bubbles()
         self.canvas.update_idletasks()
         self.scrollable_frame.update_idletasks()
+        self.canvas.yview_moveto(1)
+
+    def _create_conversation(self):
+        conversation = _Conversation(self.canvas)
+        conversation.frame.bind(
+            "<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        )
+        conversation.bubble_width = self.last_bubble_width
+        return conversation
+
+    def _show_conversation(self, conversation):
+        self._conversation = conversation
+        self.scrollable_frame = conversation.frame
+        self.dummy = conversation.dummy
+        self.bubbles = conversation.bubbles
+        self.canvas.itemconfigure(self._canvas_window, window=conversation.frame)
+        self.dummy.config(width=(self.winfo_width() - self.scrollbar.winfo_width() * 2))
+        if conversation.bubble_width != self.last_bubble_width:
+            self.adjust_bubble_size(self.last_bubble_width)
+
+    def _render_older_bubbles(self):
+        conversation = self._conversation
+        end = len(conversation.records) - len(conversation.bubbles)
+        start = max(0, end - get_workbench().get_option("assistanceGPT.bubble_render_batch"))
+        if start == end:
+            return
+
+        before = conversation.bubbles[0].frame if conversation.bubbles else None
+        older_bubbles = [
+            BotBubble(
+                conversation.frame,
+                record["header"],
+                record["message"],
+                record["color"],
+                self.last_bubble_width,
+                record["date_time"],
+                record["anchor_orientation"],
+                before=before,
+            )
+            for record in conversation.records[start:end]
+        ]
+        conversation.bubbles[:0] = older_bubbles
+
+    def _on_canvas_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if not self._relayout_scheduled:
+            # bubbles coming into view may still have the layout for an old width
+            self._relayout_scheduled = True
+            self.after_idle(self._relayout_visible_bubbles)
+        if (
+            float(first) <= 0.0
+            and not self._rendering_older_bubbles
+            and self._conversation is not None
+            and len(self._conversation.records) > len(self._conversation.bubbles)
+        ):
+            # reached the top, create the bubbles of the next older messages
+            self._rendering_older_bubbles = True
+            self.after_idle(self._render_older_bubbles_at_top)
+
+    def _render_older_bubbles_at_top(self):
+        try:
+            old_height = self.scrollable_frame.winfo_reqheight()
+            self._render_older_bubbles()
+            self.scrollable_frame.update_idletasks()
+            new_height = self.scrollable_frame.winfo_reqheight()
+            self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+            # keep the previously topmost bubble in place
+            if new_height > 0:
+                self.canvas.yview_moveto((new_height - old_height) / new_height)
+        finally:
+            self._rendering_older_bubbles = False
 
     def setup_ui(self):
         self.grid(row=0, column=0, sticky="nsew")
@@ -235,25 +325,22 @@ class AssistantViewGPT(tk.Frame):
         # Creating the chat canvas with scrollbar
         self.canvas = tk.Canvas(self.chat_frame, bg="white")
         self.scrollbar = tk.Scrollbar(self.chat_frame, orient="vertical", command=self.canvas.yview)
-        self.scrollable_frame = tk.Frame(self.canvas, bg="white")
-
-        self.scrollable_frame.bind(
-            "<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-        )
         # self.canvas.bind("<MouseWheel>", self.on_canvas_mousewheel)
         # self.canvas.bind("<Enter>", self.on_canvas_enter)
         self.chat_frame.grid(
             row=1, column=0, columnspan=2, sticky="nsew", pady=self.ipady, padx=self.ipadx
         )
 
-        # dummy element
-        self.dummy = tk.Frame(
-            self.scrollable_frame, width=self.canvas.winfo_width(), height=0, bg="white"
-        )
-        self.dummy.pack(anchor="n")
+        # conversation of the current file tab, replaced in update_assistant_gpt_messages
+        self._conversation = self._create_conversation()
+        self.scrollable_frame = self._conversation.frame
+        self.dummy = self._conversation.dummy
+        self.bubbles = self._conversation.bubbles
 
-        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self._canvas_window = self.canvas.create_window(
+            (0, 0), window=self.scrollable_frame, anchor="nw"
+        )
+        self.canvas.configure(yscrollcommand=self._on_canvas_yscroll)
 
         self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -277,6 +364,31 @@ class AssistantViewGPT(tk.Frame):
         )
         self.send_button.grid(row=0, column=1, sticky="nsew")
 
+        self.status_label = tk.Label(
+            self.input_frame, text="", font=("Helvetica", 7), bg="#E0E0E0", anchor="w"
+        )
+        self.status_label.grid(row=1, column=0, columnspan=2, sticky="ew")
+
+    def set_status(self, text):
+        self.status_label.config(text=text)
+
+    def _update_request_status(self):
+        parts = [self._prompt_status]
+        if self._latency_stats.get_count():
+            parts.append(
+                f"Antwortzeit: {self._latency_stats.get_last():.1f} s "
+                f"(Ø {self._latency_stats.get_average():.1f} s)"
+            )
+
+        cache = self._response_cache
+        if cache is not None and cache.hits + cache.misses:
+            parts.append(
+                f"Cache: {cache.hits} von {cache.hits + cache.misses} "
+                f"Anfragen ({cache.get_hit_rate():.0%}), {cache.saved_seconds:.1f} s gespart"
+            )
+
+        self.set_status(" | ".join(parts))
+
     '''def _find_api_key_file(self, directory):
         for filename in os.listdir(directory):
             if not os.path.splitext(filename)[1]:
@@ -316,7 +428,8 @@ class AssistantViewGPT(tk.Frame):
         self._API_KEY = get_workbench().get_option("assistanceGPT.gpt_api_key")
         return self._API_KEY
 
-    def get_response_from_openai(self, user_prompt):
+    def _prepare_request(self, user_prompt):
+        """Collects everything the request needs. Must be called in the UI thread."""
         api_key = self.get_api_key()
         system_prompt = get_workbench().get_option("assistanceGPT.system_prompt")
         if system_prompt == "" or system_prompt is None:
@@ -363,59 +476,210 @@ Dein Ziel: Unterstütze den Schüler so, dass er selbst auf die Lösung kommt, a
 
 Antworte immer auf deutsch und antworte niemals mit der Lösung der Aufgabe oder des Problems! Hier ist das Format, das du für die Fragen des Schülers erwarten kannst: ```# Aufgabenstellung: [Hier steht die Aufgabenstellung][Programmcode]```\nFrage des Schülers: [Hier steht die explizite Frage des Schülers]. Die Antwort muss nicht dieses Format haben!"""
         editor_content = get_workbench().get_editor_notebook().get_current_editor_content()
-        code_lines = editor_content.splitlines()
-        code_lines = [
-            code_line
-            for code_line in code_lines
-            if not code_line.startswith(("#^^", "#vv", "__import__"))
-        ]
-        extracted_student_code = "\n".join(code_lines).strip()
-        modified_prompt = f"```{extracted_student_code}```\n\nFrage des Schülers: {user_prompt}"
-        try:
-            old_messages = self.get_old_messages_for_api()
-            all_messages = []
-            all_messages.append({"role": "system", "content": system_prompt})
-            for message in old_messages:
-                all_messages.append(message)
-            all_messages.append({"role": "user", "content": modified_prompt})
-            client = openai.OpenAI(api_key=api_key)
-            print(all_messages)
-            response = client.chat.completions.create(
-                model="gpt-4o-mini-2024-07-18",
-                messages=all_messages,
-                temperature=0.7,
-                max_tokens=150,
-                top_p=0.7,
-                frequency_penalty=0.6,
+        editor = get_workbench().get_editor_notebook().get_current_editor()
+        cursor_line = None
+        if editor is not None:
+            cursor_line = int(editor.get_text_widget().index("insert").split(".")[0])
+
+        code_lines = []
+        focus_line = None
+        for line_number, code_line in enumerate(editor_content.splitlines(), 1):
+            if not code_line.startswith(("#^^", "#vv", "__import__")):
+                code_lines.append(code_line)
+            if line_number == cursor_line:
+                focus_line = len(code_lines)
+        joined_code = "\n".join(code_lines)
+        extracted_student_code = joined_code.strip()
+        if focus_line is not None:
+            stripped_lines = joined_code[: len(joined_code) - len(joined_code.lstrip())]
+            focus_line = max(1, focus_line - stripped_lines.count("\n"))
+
+        token_budget = get_workbench().get_option("assistanceGPT.context_token_budget")
+        all_messages, prompt_tokens = build_chat_messages(
+            system_prompt,
+            extracted_student_code,
+            user_prompt,
+            self.get_old_messages_for_api(),
+            token_budget,
+            focus_line,
+        )
+        logger.info("GPT prompt uses ~%d tokens (budget %d)", prompt_tokens, token_budget)
+        self._prompt_status = f"Anfrage: ca. {prompt_tokens} von {token_budget} Tokens"
+        self.set_status(self._prompt_status)
+        return api_key, all_messages
+
+    def get_response_from_openai(self, api_key, all_messages, settings, request=None, cache=None):
+        # Runs in a worker thread, so it must not touch any widgets or options.
+        # When a request is given, the answer is streamed into request.chunks
+        params = settings["params"]
+
+        if cache is not None:
+            cache_key = ResponseCache.make_key(all_messages, params)
+            cached_response = cache.get(cache_key)
+            if cached_response is not None:
+                if request is not None:
+                    request.chunks.append(cached_response)
+                return cached_response
+
+        start_time = time.time()
+        client = get_pooled_openai_client(api_key, settings["base_url"])
+        print(all_messages)
+        response = call_with_retries(
+            lambda: client.chat.completions.create(
+                messages=all_messages, stream=request is not None, **params
+            ),
+            _is_retryable_openai_error,
+            settings["max_retries"],
+            get_retry_after=_get_retry_after,
+        )
+        if request is None:
+            result = response.choices[0].message.content
+        else:
+            for chunk in response:
+                if request.cancelled:
+                    response.close()
+                    return "".join(request.chunks)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    # list.append is atomic, the UI thread may read the list meanwhile
+                    request.chunks.append(chunk.choices[0].delta.content)
+            result = "".join(request.chunks)
+
+        latency = time.time() - start_time
+        self._latency_stats.add(latency)
+        if cache is not None and result:
+            cache.put(cache_key, result, latency)
+
+        return result
+
+    def _get_request_settings(self):
+        return parse_request_settings(get_workbench().get_option)
+
+    def _get_response_cache(self):
+        if not get_workbench().get_option("assistanceGPT.response_cache_enabled"):
+            return None
+
+        cache_dir = get_workbench().get_option("assistanceGPT.response_cache_dir") or os.path.join(
+            self.GPT_USER_DIR, "response_cache"
+        )
+        ttl_seconds = get_workbench().get_option("assistanceGPT.response_cache_ttl_hours") * 3600
+        max_bytes = get_workbench().get_option("assistanceGPT.response_cache_max_mb") * 1024 * 1024
+        if self._response_cache is None or self._response_cache.directory != cache_dir:
+            self._response_cache = ResponseCache(cache_dir, ttl_seconds, max_bytes)
+        else:
+            self._response_cache.ttl_seconds = ttl_seconds
+            self._response_cache.max_bytes = max_bytes
+        return self._response_cache
+
+    def _start_request(self, user_prompt, settings):
+        if self._request_executor is None:
+            from concurrent.futures.thread import ThreadPoolExecutor
+
+            self._request_executor = ThreadPoolExecutor(max_workers=1)
+
+        api_key, all_messages = self._prepare_request(user_prompt)
+        date_time = self.get_actual_date()
+        pending_bubble = BotBubble(
+            self.scrollable_frame,
+            "Antwort:",
+            "Die Antwort wird erstellt ...",
+            "lightblue",
+            self.last_bubble_width,
+            date_time,
+            "e",
+        )
+        request = _PendingGPTRequest(pending_bubble, date_time)
+        cache = self._get_response_cache()
+        if get_workbench().get_option("assistanceGPT.stream_responses"):
+            request.future = self._request_executor.submit(
+                self.get_response_from_openai, api_key, all_messages, settings, request, cache
+            )
+        else:
+            request.future = self._request_executor.submit(
+                self.get_response_from_openai, api_key, all_messages, settings, None, cache
             )
-            return response.choices[0].message.content
+
+        self._pending_request = request
+        self.scrollable_frame.update_idletasks()
+        self.canvas.yview_moveto(1)
+        self._poll_pending_request(request)
+
+    def _poll_pending_request(self, request):
+        if request is not self._pending_request:
+            # cancelled in the meantime (new tab or "NEU"), result is not wanted anymore
+            return
+
+        if not request.future.done():
+            chunk_count = len(request.chunks)
+            if chunk_count > request.shown_chunk_count:
+                request.shown_chunk_count = chunk_count
+                request.bubble.update_text(
+                    "".join(request.chunks[:chunk_count]).replace("\n\n", "\n"), final=False
+                )
+                self.scrollable_frame.update_idletasks()
+                self.canvas.yview_moveto(1)
+            self.after(50, self._poll_pending_request, request)
+            return
+
+        self._pending_request = None
+        try:
+            response = request.future.result()
         except openai.APIConnectionError:
             self.show_error_dialog(
                 "Verbindungsfehler",
                 "Keine Verbindung zur OpenAI-API möglich. Bitte überprüfe deine Internetverbindung.",
             )
+            response = "".join(request.chunks)
         except openai.OpenAIError as e:
             self.show_error_dialog("Fehler bei der API", f"Ein Fehler ist aufgetreten: {str(e)}")
+            response = "".join(request.chunks)
         except Exception as e:
+            logger.exception("Problem when requesting GPT response")
             self.show_error_dialog(
                 "Unbekannter Fehler", f"Es ist ein unerwarteter Fehler aufgetreten: {str(e)}"
             )
-        return ""
+            response = "".join(request.chunks)
+
+        # the placeholder becomes the final answer bubble
+        self.save_bubble_to_logfile(
+            self.get_actual_date(True), request.date_time, "Antwort:", response, "lightblue", "e"
+        )
+        request.bubble.update_text(response.replace("\n\n", "\n"))
+        self._update_request_status()
+        self._conversation.records.append(
+            {
+                "header": "Antwort:",
+                "message": response.replace("\n\n", "\n"),
+                "color": "lightblue",
+                "anchor_orientation": "e",
+                "date_time": request.date_time,
+            }
+        )
+        self.bubbles.append(request.bubble)
+        self.scrollable_frame.update_idletasks()
+        self.canvas.yview_moveto(1)
+
+    def _cancel_pending_request(self):
+        if self._pending_request is None:
+            return
+
+        # A streaming request stops at next chunk, otherwise the result just gets ignored
+        self._pending_request.cancelled = True
+        self._pending_request.future.cancel()
+        self._pending_request.bubble.frame.destroy()
+        self._pending_request = None
 
     def show_error_dialog(self, title, message):
-        self.messagebox.showerror(title, message)  # Zeige eine Fehlerbox an
+        messagebox.showerror(title, message, master=self)  # Zeige eine Fehlerbox an
 
     def get_old_messages_for_api(self):
         old_messages = []
-        for bubble in self.bubbles[
+        for record in self._conversation.records[
             :-1
-        ]:  # last bubble is actual bubble and gets added on other place
+        ]:  # last message is actual message and gets added on other place
             old_messages.append(
                 {
-                    "role": (
-                        "user" if bubble.name.cget("text") == "Deine Nachricht:" else "assistant"
-                    ),
-                    "content": bubble.text_message,
+                    "role": ("user" if record["header"] == "Deine Nachricht:" else "assistant"),
+                    "content": record["message"],
                 }
             )
 
@@ -431,6 +695,7 @@ Antworte immer auf deutsch und antworte niemals mit der Lösung der Aufgabe oder
         return datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
 
     def clear_canvas(self, event=None, triggered_from_user=True):
+        self._cancel_pending_request()
         if triggered_from_user:
             # save old gpt message history if exists and clear old file. (This old file is the actual message history)
             if self.ACTUAL_GPT_USER_FILE != "":
@@ -448,49 +713,58 @@ Antworte immer auf deutsch und antworte niemals mit der Lösung der Aufgabe oder
                             + destination_file_type
                         ),
                     )
+                    self._history_log.sync()
                     shutil.copyfile(self.ACTUAL_GPT_USER_FILE, destination_file_path)
                     # print(f"Datei von '{self.ACTUAL_GPT_USER_FILE}' nach '{destination_file_path}' kopiert.")
                 except IOError as e:
                     # print(f"Fehler beim Kopieren der Datei: {e}")
                     pass
-            with open(self.ACTUAL_GPT_USER_FILE, "w", encoding="utf-8") as file:
-                file.write("{}")
+                self._history_log.clear()
 
         for bubble in self.bubbles:
             bubble.frame.destroy()
-        self.bubbles = []
+        self.bubbles.clear()
+        self._conversation.records.clear()
         # Canvas aktualisieren
         self.scrollable_frame.update_idletasks()
         self.canvas.yview_moveto(1)
 
     def send_message(self, event=None):
         if event is None or (event.keysym == "Return"):  # and event.state == 12 # Strg+Enter
+            if self._pending_request is not None:
+                # one question at a time, the input stays in the entry
+                return "break"
+
             user_input = self.user_entry.get("1.0", tk.END).strip()
             if user_input:
-                self.display_message("Deine Nachricht:", user_input, "lightgreen", "w")
-
-                response = self.get_response_from_openai(user_input)
-                self.display_message("Antwort:", response, "lightblue", "e")
+                try:
+                    settings = self._get_request_settings()
+                except ValueError as e:
+                    # the input stays in the entry for sending again after fixing the options
+                    self.show_error_dialog("Ungültige Einstellungen", str(e))
+                    return "break"
 
+                self.display_message("Deine Nachricht:", user_input, "lightgreen", "w")
                 self.user_entry.delete("1.0", tk.END)
+                self._start_request(user_input, settings)
 
     def read_bubbles_from_logfile(self):
-        with open(self.ACTUAL_GPT_USER_FILE, "r", encoding="utf-8") as file:
-            json_data = json.load(file)
-        return json_data
+        return self._history_log.read_records()
 
     def save_bubble_to_logfile(self, id, date_time, header, message, color, anchor_orientation):
-        new_data = {
-            "date_time": date_time,
-            "header": header,
-            "message": message,
-            "color": color,
-            "anchor_orientation": anchor_orientation,
-        }
-        existing_data = self.read_bubbles_from_logfile()
-        existing_data[id] = new_data
-        with open(self.ACTUAL_GPT_USER_FILE, "w", encoding="utf-8") as file:
-            json.dump(existing_data, file, indent=2)
+        if self._history_log is None:
+            # no file tab has been seen yet
+            return
+        self._history_log.append(
+            {
+                "id": id,
+                "date_time": date_time,
+                "header": header,
+                "message": message,
+                "color": color,
+                "anchor_orientation": anchor_orientation,
+            }
+        )
 
     def display_message(
         self, header, message, color, anchor_orientation, save_to_log=True, date_time=None
@@ -503,6 +777,15 @@ Antworte immer auf deutsch und antworte niemals mit der Lösung der Aufgabe oder
             )
 
         # show bubble on screen
+        self._conversation.records.append(
+            {
+                "header": header,
+                "message": message.replace("\n\n", "\n"),
+                "color": color,
+                "anchor_orientation": anchor_orientation,
+                "date_time": date_time,
+            }
+        )
         self.bubbles.append(
             BotBubble(
                 self.scrollable_frame,
@@ -518,11 +801,43 @@ Antworte immer auf deutsch und antworte niemals mit der Lösung der Aufgabe oder
         self.canvas.yview_moveto(1)
 
 
+class _Conversation:
+    def __init__(self, canvas):
+        self.frame = tk.Frame(canvas, bg="white")
+        # dummy element
+        self.dummy = tk.Frame(self.frame, width=canvas.winfo_width(), height=0, bg="white")
+        self.dummy.pack(anchor="n")
+        self.records = []  # type: List[Dict[str, str]]
+        # bubbles exist only for the newest records, older ones are created when scrolled to
+        self.bubbles = []  # type: List[BotBubble]
+        self.bubble_width = 0
+
+
+class _PendingGPTRequest:
+    def __init__(self, bubble, date_time):
+        self.future = None
+        self.bubble = bubble
+        self.date_time = date_time
+        self.chunks = []  # type: List[str]
+        self.shown_chunk_count = 0
+        self.cancelled = False
+
+
 class BotBubble:
-    def __init__(self, master, header, text_message, color, bubble_width, time, anchor_orientation):
+    def __init__(
+        self,
+        master,
+        header,
+        text_message,
+        color,
+        bubble_width,
+        time,
+        anchor_orientation,
+        before=None,
+    ):
         self.text_message = text_message
         self.frame = tk.Frame(master, bg=color, padx=5, pady=5)
-        self.frame.pack(anchor=anchor_orientation, pady=5, padx=(10, 25))
+        self.frame.pack(anchor=anchor_orientation, pady=5, padx=(10, 25), before=before)
 
         self.name = tk.Label(
             self.frame,
@@ -538,55 +853,123 @@ class BotBubble:
         )
         self.timestamp.grid(row=1, column=0, sticky="w")
 
+        self.color = color
+        self.bubble_width = bubble_width
+        self.layout_width = bubble_width
         self.codeblocks = []
+        self._code_texts = {}  # type: Dict[tk.Text, str]
+        # line-wrap measurements per (code, code width in chars)
+        self._code_sizes = {}  # type: Dict[Tuple[str, int], Tuple[int, int]]
         self.textblocks = []
-        row = 2
+        self._blocks = []  # type: List[str]
+        self._block_widgets = []
 
         for block in self._split_text_with_code_blocks(text_message):
-            if block.startswith("```"):
-                # codeblock
-                wrap_point = int(bubble_width / 10)
-                if "\n" in block:
-                    block = block[block.find("\n") + 1 : block.rfind("```") - 1]
-                else:
-                    block = block[3:-3]
-                lines = block.split("\n")
-                height = len(lines) + sum(1 for line in lines if len(line) > wrap_point)
-
-                codeblock_width = min(wrap_point, max(len(line) for line in lines))
-                self.codeblocks.append(
-                    tk.Text(
-                        self.frame,
-                        height=height,
-                        width=codeblock_width,
-                        bg=color,
-                        wrap="word",
-                        borderwidth=1,
-                    )
+            self._add_block(block)
+
+    def relayout(self, bubble_width):
+        self.bubble_width = bubble_width
+        self.layout_width = bubble_width
+        for textblock in self.textblocks:
+            textblock.config(wraplength=bubble_width)
+
+        code_bubble_width = max(1, int(bubble_width / 10))
+        for codeblock in self.codeblocks:
+            code = self._code_texts[codeblock]
+            size = self._code_sizes.get((code, code_bubble_width))
+            if size is None:
+                size = (
+                    min(code_bubble_width, max(len(line) for line in code.split("\n")) + 1),
+                    _get_height_of_codeblock(code, code_bubble_width),
                 )
-                ip.Percolator(self.codeblocks[-1]).insertfilter(ic.ColorDelegator())
-                self.codeblocks[-1].tag_configure("no_bg", background=color)
-                self.codeblocks[-1].insert("1.0", block)
-                self.codeblocks[-1].tag_add("no_bg", "1.0", "end")
-                self.codeblocks[-1].grid(row=row, column=0, sticky="w")
-                self.codeblocks[-1].config(state=tk.DISABLED)
+                self._code_sizes[(code, code_bubble_width)] = size
+            codeblock.config(width=size[0], height=size[1])
 
-            else:
-                # textblock
-                self.textblocks.append(
-                    tk.Label(
-                        self.frame,
-                        text=block,
-                        font=("Helvetica", 9),
-                        bg=color,
-                        wraplength=bubble_width,
-                        justify="left",
-                    )
-                )
-                self.textblocks[-1].grid(row=row, column=0, sticky="w", pady=(3, 0))
-            row += 1
+    def update_text(self, text_message, final=True):
+        """Re-renders only the blocks that differ from the ones already shown.
+
+        While an answer is streamed, only its last block usually changes."""
+        self.text_message = text_message
+        new_blocks = self._split_text_with_code_blocks(text_message, final)
+
+        common = 0
+        while (
+            common < len(self._blocks)
+            and common < len(new_blocks)
+            and self._blocks[common] == new_blocks[common]
+        ):
+            common += 1
+
+        if (
+            common == len(self._blocks) - 1
+            and common < len(new_blocks)
+            and self._blocks[common].startswith("```") == new_blocks[common].startswith("```")
+        ):
+            # growing last block can be updated in place
+            self._blocks[common] = new_blocks[common]
+            self._configure_block_widget(self._block_widgets[common], new_blocks[common])
+            common += 1
+        else:
+            for widget in self._block_widgets[common:]:
+                if widget in self.codeblocks:
+                    self.codeblocks.remove(widget)
+                    del self._code_texts[widget]
+                else:
+                    self.textblocks.remove(widget)
+                widget.destroy()
+            del self._blocks[common:]
+            del self._block_widgets[common:]
+
+        for block in new_blocks[len(self._blocks) :]:
+            self._add_block(block)
+
+    def _add_block(self, block):
+        row = len(self._blocks) + 2
+        if block.startswith("```"):
+            # codeblock
+            widget = tk.Text(self.frame, bg=self.color, wrap="word", borderwidth=1)
+            ip.Percolator(widget).insertfilter(ic.ColorDelegator())
+            widget.tag_configure("no_bg", background=self.color)
+            widget.grid(row=row, column=0, sticky="w")
+            self.codeblocks.append(widget)
+        else:
+            # textblock
+            widget = tk.Label(
+                self.frame,
+                font=("Helvetica", 9),
+                bg=self.color,
+                wraplength=self.bubble_width,
+                justify="left",
+            )
+            widget.grid(row=row, column=0, sticky="w", pady=(3, 0))
+            self.textblocks.append(widget)
+
+        self._configure_block_widget(widget, block)
+        self._blocks.append(block)
+        self._block_widgets.append(widget)
 
-    def _split_text_with_code_blocks(self, input_string):
+    def _configure_block_widget(self, widget, block):
+        if not block.startswith("```"):
+            widget.config(text=block)
+            return
+
+        wrap_point = int(self.bubble_width / 10)
+        if "\n" in block:
+            block = block[block.find("\n") + 1 : block.rfind("```") - 1]
+        else:
+            block = block[3:-3]
+        lines = block.split("\n")
+        height = len(lines) + sum(1 for line in lines if len(line) > wrap_point)
+        codeblock_width = min(wrap_point, max(len(line) for line in lines))
+
+        widget.config(state=tk.NORMAL, height=height, width=codeblock_width)
+        widget.delete("1.0", "end")
+        widget.insert("1.0", block)
+        self._code_texts[widget] = block
+        widget.tag_add("no_bg", "1.0", "end")
+        widget.config(state=tk.DISABLED)
+
+    def _split_text_with_code_blocks(self, input_string, final=True):
         parts = input_string.split("```")
         result = []
 
@@ -601,7 +984,11 @@ class BotBubble:
 
         # Falls die Anzahl der Teile ungerade ist, gibt es Text nach dem letzten Codeblock
         if len(parts) % 2 == 0:
-            result.append(parts[-1])
+            if not final and "\n" in parts[-1]:
+                # Codeblock wird gerade noch gestreamt, schon als Code anzeigen
+                result.append("```" + parts[-1].rstrip("\n") + "\n```")
+            else:
+                result.append(parts[-1])
         return result
 
     def handle_toplevel_response(self, msg: ToplevelResponse) -> None:
@@ -1378,6 +1765,61 @@ def _get_imported_user_files(main_file, source=None):
     # TODO: add recursion
 
 
+def _get_height_of_codeblock(codeblock, code_bubble_width):
+    lines_count = 0
+    current_line_length = 0
+
+    for line in codeblock.splitlines():
+        words = line.split()
+        for word in words:
+            if len(word) > code_bubble_width:
+                # Wort ist länger als 100 Zeichen, setze es auf eine neue Zeile
+                lines_count += 1 + (len(word) // code_bubble_width)
+                current_line_length = len(word) % code_bubble_width
+            elif current_line_length == 0:
+                # Start einer neuen Zeile
+                lines_count += 1
+                current_line_length = len(word)
+            elif current_line_length + len(word) + 1 <= code_bubble_width:
+                # Platz für Wort und mindestens ein Leerzeichen ist vorhanden
+                current_line_length += len(word) + 1
+            else:
+                # Wort passt nicht in die aktuelle Zeile, starte eine neue Zeile
+                lines_count += 1
+                current_line_length = len(word)
+
+            current_line_length += 1  # Für das Leerzeichen nach jedem Wort
+
+        # Neue Zeile durch Zeilenumbruch
+        lines_count += 1
+        current_line_length = 0
+
+    return lines_count - 1
+
+
+# 429 codes for used up quotas (of the OpenAI account or of the classroom gateway),
+# which don't come back within the next seconds
+_FINAL_RATE_LIMIT_CODES = {"insufficient_quota", "quota_exceeded"}
+
+
+def _is_retryable_openai_error(e):
+    # rate limits and server side problems are usually gone after a while
+    if isinstance(e, openai.RateLimitError):
+        return getattr(e, "code", None) not in _FINAL_RATE_LIMIT_CODES
+    if isinstance(e, openai.APIConnectionError):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+def _get_retry_after(e):
+    if not isinstance(e, openai.APIStatusError):
+        return None
+    try:
+        return float(e.response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
 def add_program_analyzer(cls):
     _program_analyzer_classes.append(cls)
 
@@ -1401,10 +1843,87 @@ class HelperNotSupportedError(RuntimeError):
     pass
 
 
+_gateway_server = None
+
+
+def _start_gateway():
+    global _gateway_server
+    import socket
+
+    from thonny import gpt_gateway
+
+    port = get_workbench().get_option("assistanceGPT.gateway_port")
+    tokens_file = get_workbench().get_option("assistanceGPT.gateway_student_tokens_file")
+    if _gateway_server is None:
+        try:
+            student_tokens = gpt_gateway.read_student_tokens(tokens_file) if tokens_file else None
+            _gateway_server = gpt_gateway.start_in_background(
+                get_workbench().get_option("assistanceGPT.gpt_api_key"),
+                port=port,
+                upstream_url=(
+                    get_workbench().get_option("assistanceGPT.base_url")
+                    or gpt_gateway.DEFAULT_UPSTREAM_URL
+                ),
+                cache_dir=os.path.join(THONNY_USER_DIR, "gpt_files", "gateway_cache"),
+                requests_per_hour=get_workbench().get_option(
+                    "assistanceGPT.gateway_requests_per_hour"
+                ),
+                student_tokens=student_tokens,
+            )
+        except OSError as e:
+            messagebox.showerror(
+                "Gateway", f"Das Gateway konnte nicht gestartet werden: {e}", master=get_workbench()
+            )
+            return
+
+    if _gateway_server.gateway.student_tokens is not None:
+        message = (
+            "Das Gateway läuft. Trage auf den Schülerrechnern als API-URL ein:\n\n"
+            f"http://{socket.gethostname()}:{port}/v1"
+        )
+    else:
+        # without student tokens the gateway listens only on the loopback interface
+        message = (
+            "Das Gateway läuft, ist aber nur auf diesem Rechner erreichbar:\n\n"
+            f"http://127.0.0.1:{port}/v1\n\n"
+            "Um es den Schülerrechnern freizugeben, trage unter "
+            "assistanceGPT.gateway_student_tokens_file eine Datei mit Schüler-Tokens ein."
+        )
+    messagebox.showinfo("Gateway", message, master=get_workbench())
+
+
 def init():
     get_workbench().set_default("assistanceGPT.open_assistant_on_errors", False)
     get_workbench().set_default("assistanceGPT.open_assistant_on_warnings", False)
     get_workbench().set_default("assistanceGPT.disabled_checks", [])
+    get_workbench().set_default("assistanceGPT.stream_responses", True)
+    get_workbench().set_default("assistanceGPT.cached_conversations", 5)
+    get_workbench().set_default("assistanceGPT.bubble_render_batch", 20)
+    get_workbench().set_default("assistanceGPT.context_token_budget", 3000)
+    get_workbench().set_default("assistanceGPT.response_cache_enabled", True)
+    # eg. a folder on a shared drive, so that the whole class benefits from the cache
+    get_workbench().set_default("assistanceGPT.response_cache_dir", "")
+    get_workbench().set_default("assistanceGPT.response_cache_ttl_hours", 7 * 24)
+    get_workbench().set_default("assistanceGPT.response_cache_max_mb", 50)
+    # empty means OpenAI, but any OpenAI compatible server can be used
+    get_workbench().set_default("assistanceGPT.base_url", "")
+    get_workbench().set_default("assistanceGPT.max_retries", 3)
+    get_workbench().set_default("assistanceGPT.model", "gpt-4o-mini-2024-07-18")
+    get_workbench().set_default("assistanceGPT.max_tokens", 150)
+    get_workbench().set_default("assistanceGPT.temperature", 0.7)
+    get_workbench().set_default("assistanceGPT.top_p", 0.7)
+    get_workbench().set_default("assistanceGPT.frequency_penalty", 0.6)
+    get_workbench().set_default("assistanceGPT.gateway_port", 8765)
+    get_workbench().set_default("assistanceGPT.gateway_requests_per_hour", 60)
+    # file with one API key per student, without it students are told apart by IP address
+    get_workbench().set_default("assistanceGPT.gateway_student_tokens_file", "")
     get_workbench().add_view(
         AssistantViewGPT, tr("Assistant") + " GPT", "se", visible_by_default=False
     )
+    get_workbench().add_command(
+        "start_gpt_gateway",
+        "tools",
+        tr("Start GPT classroom gateway"),
+        _start_gateway,
+        group=110,
+    )
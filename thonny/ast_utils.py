@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import ast
+import re
+import sys
 from typing import Union
 
+_LINE_BREAK_RE = re.compile(r"\r\n?|\n")
+
 
 def extract_text_range(source, text_range):
     if isinstance(source, bytes):
@@ -177,6 +181,23 @@ def mark_text_ranges(node, source: Union[str, bytes], fallback_to_one_char=False
     which has attributes lineno and col_offset.
     """
     assert isinstance(source, (str, bytes))
+    if sys.version_info >= (3, 9):
+        _mark_text_ranges_from_native_positions(node, source)
+    else:
+        _mark_text_ranges_from_tokens(node, source)
+
+    if fallback_to_one_char:
+        for child in ast.walk(node):
+            # some nodes stay without end info
+            if hasattr(child, "lineno") and (
+                getattr(child, "end_lineno", None) is None
+                or getattr(child, "end_col_offset", None) is None
+            ):
+                child.end_lineno = child.lineno
+                child.end_col_offset = child.col_offset + 2
+
+
+def _mark_text_ranges_from_tokens(node, source: Union[str, bytes]):
     from asttokens.asttokens import ASTTokens
 
     ASTTokens(source, tree=node)
@@ -188,11 +209,69 @@ def mark_text_ranges(node, source: Union[str, bytes], fallback_to_one_char=False
                 # Fixes problems with some nodes like binop
                 child.lineno, child.col_offset = child.first_token.start
 
-        # some nodes stay without end info
+
+def _mark_text_ranges_from_native_positions(node, source: Union[str, bytes]):
+    """Gives the same ranges as asttokens, but without tokenizing the source.
+
+    Since Python 3.9 the parser gives end positions to all nodes which have start positions,
+    but the offsets count UTF-8 bytes and there are few differences which are fixed here.
+    Exceptions are alias and pattern nodes, where the native ranges are more correct, and
+    parts of f-strings, which asttokens leaves with byte offsets.
+    """
+    if isinstance(source, bytes):
+        from importlib.util import decode_source
+
+        source = decode_source(source)
+
+    lines = _LINE_BREAK_RE.split(source)
+    encoded_lines = {}
+    all_ascii = source.isascii()
+
+    def to_char_offset(lineno, col_offset):
+        if all_ascii or lineno > len(lines) or lines[lineno - 1].isascii():
+            return col_offset
+
+        if lineno not in encoded_lines:
+            encoded_lines[lineno] = lines[lineno - 1].encode("utf-8")
+        return len(encoded_lines[lineno][:col_offset].decode("utf-8", errors="replace"))
+
+    # children before parents
+    for child in reversed(list(ast.walk(node))):
+        if getattr(child, "lineno", None) is None:
+            # asttokens gives end info also to nodes like arguments and comprehension
+            _set_end_from_children(child)
+            continue
+
+        if getattr(child, "end_lineno", None) is None:
+            continue
+
+        child.col_offset = to_char_offset(child.lineno, child.col_offset)
+        child.end_col_offset = to_char_offset(child.end_lineno, child.end_col_offset)
+
+        if not isinstance(child, ast.stmt):
+            continue
+
         if (
-            hasattr(child, "lineno")
-            and (not hasattr(child, "end_lineno") or not hasattr(child, "end_col_offset"))
-            and fallback_to_one_char
+            hasattr(child, "body")
+            and lines[child.end_lineno - 1][child.end_col_offset - 1 : child.end_col_offset] == ";"
         ):
-            child.end_lineno = child.lineno
-            child.end_col_offset = child.col_offset + 2
+            # compound statement includes the semicolon after its last simple statement
+            _set_end_from_children(child)
+
+        decorators = getattr(child, "decorator_list", None)
+        if decorators:
+            # asttokens starts decorated definitions at the first @
+            first = decorators[0]
+            at_offset = lines[first.lineno - 1].rfind("@", 0, first.col_offset)
+            if at_offset != -1:
+                child.lineno, child.col_offset = first.lineno, at_offset
+
+
+def _set_end_from_children(node) -> None:
+    ends = [
+        (child.end_lineno, child.end_col_offset)
+        for child in ast.iter_child_nodes(node)
+        if getattr(child, "end_lineno", None) is not None
+    ]
+    if ends:
+        node.end_lineno, node.end_col_offset = max(ends)
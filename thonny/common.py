@@ -3,6 +3,8 @@
 """
 Classes used both by front-end and back-end
 """
+
+import json
 import os.path
 import site
 import sys
@@ -16,6 +18,12 @@ logger = getLogger(__name__)
 STRING_PSEUDO_FILENAME = "<string>"
 REPL_PSEUDO_FILENAME = "<stdin>"
 MESSAGE_MARKER = "\x02"
+# Messages of the framed wire format start with FRAME_MARKER, followed by payload length
+FRAME_MARKER = MESSAGE_MARKER + "F"
+LEGACY_WIRE_FORMAT = 1
+FRAMED_WIRE_FORMAT = 2
+WIRE_FORMATS_ENV_VAR = "THONNY_WIRE_FORMATS"
+WIRE_TAG = "~"
 OBJECT_LINK_START = "[object_link_for_thonny=%d]"
 OBJECT_LINK_END = "[/object_link_for_thonny]"
 REMOTE_PATH_MARKER = " :: "
@@ -233,7 +241,35 @@ class InlineResponse(MessageFromBackend):
         self.event_type = self.command_name + "_response"
 
 
-def serialize_message(msg: Record, max_line_length=65536) -> str:
+_JSON_SCALAR_TYPES = {str, int, float, bool, type(None)}
+_WIRE_TYPES_BY_TAG = {
+    "t": tuple,
+    "s": set,
+    "f": frozenset,
+    "V": ValueInfo,
+    "F": FrameInfo,
+    "T": TextRange,
+    "D": DistInfo,
+}
+_WIRE_TAGS_BY_TYPE = {value_type: tag for tag, value_type in _WIRE_TYPES_BY_TAG.items()}
+_wire_record_classes = None  # type: Optional[Dict[str, type]]
+
+
+def serialize_message(
+    msg: Record, max_line_length=65536, wire_format: int = LEGACY_WIRE_FORMAT
+) -> str:
+    if wire_format == FRAMED_WIRE_FORMAT:
+        try:
+            payload = json.dumps(_encode_wire_value(msg), ensure_ascii=False, separators=(",", ":"))
+            # lone surrogates (eg. from undecodable file names) would break the UTF-8 stream
+            payload.encode("utf-8")
+        except (TypeError, ValueError):
+            # contains something only the legacy format knows how to express
+            # (UnicodeEncodeError is also a ValueError)
+            logger.debug("Falling back to legacy wire format for %s", type(msg).__name__)
+        else:
+            return FRAME_MARKER + str(len(payload)) + " " + payload
+
     # I want to transfer only ASCII chars because encodings are not reliable
     # (eg. can't find a way to specify PYTHONIOENCODING for cx_freeze'd program)
     # The possibility for splitting message into several lines is required because of
@@ -248,6 +284,13 @@ def serialize_message(msg: Record, max_line_length=65536) -> str:
 
 
 def parse_message(msg_string: str) -> Record:
+    if msg_string.startswith(FRAME_MARKER):
+        header_end = msg_string.index(" ")
+        length = int(msg_string[len(FRAME_MARKER) : header_end])
+        payload = msg_string[header_end + 1 : header_end + 1 + length]
+        assert len(payload) == length and not msg_string[header_end + 1 + length :].strip()
+        return json.loads(payload, object_hook=_decode_wire_object)
+
     # DataFrames may have nan
     # pylint: disable=unused-variable
     nan = float("nan")  # @UnusedVariable
@@ -259,6 +302,89 @@ def parse_message(msg_string: str) -> Record:
     return eval(msg_string[msg_start:].replace("\n", ""))
 
 
+def choose_wire_format(stream) -> int:
+    """Picks the best format supported by both sides for messages written to the stream.
+
+    The front-end lists the formats it can read in an environment variable. Framed messages
+    are not ASCII-escaped, so they are used only if the stream encodes UTF-8."""
+    offered = os.environ.get(WIRE_FORMATS_ENV_VAR, "").split(",")
+    encoding = (getattr(stream, "encoding", None) or "").lower().replace("-", "").replace("_", "")
+    if str(FRAMED_WIRE_FORMAT) in offered and encoding == "utf8":
+        return FRAMED_WIRE_FORMAT
+    return LEGACY_WIRE_FORMAT
+
+
+def _encode_wire_value(value):
+    # JSON can express only str-keyed dicts, lists and scalars, everything else is
+    # represented by an object with a type tag under WIRE_TAG
+    value_type = type(value)
+    if value_type in _JSON_SCALAR_TYPES:
+        return value
+    elif value_type is list:
+        return [_encode_wire_value(item) for item in value]
+    elif value_type is dict:
+        if WIRE_TAG not in value and all(type(key) is str for key in value):
+            return {key: _encode_wire_value(item) for key, item in value.items()}
+        return {
+            WIRE_TAG: "d",
+            "v": [
+                [_encode_wire_value(key), _encode_wire_value(item)] for key, item in value.items()
+            ],
+        }
+    elif value_type in _WIRE_TAGS_BY_TYPE:
+        if value_type is DistInfo:
+            value = (value.key, value.project_name, value.version, value.location)
+        return {
+            WIRE_TAG: _WIRE_TAGS_BY_TYPE[value_type],
+            "v": [_encode_wire_value(item) for item in value],
+        }
+    elif value_type is bytes:
+        return {WIRE_TAG: "b", "v": value.decode("latin-1")}
+    elif (
+        isinstance(value, Record)
+        and _get_wire_record_classes().get(value_type.__name__) is value_type
+    ):
+        result = {key: _encode_wire_value(item) for key, item in value.__dict__.items()}
+        result[WIRE_TAG] = value_type.__name__
+        return result
+    else:
+        raise TypeError("Can't encode %r for framed message" % value_type)
+
+
+def _decode_wire_object(obj: Dict[str, Any]) -> Any:
+    if WIRE_TAG not in obj:
+        return obj
+
+    tag = obj.pop(WIRE_TAG)
+    value_type = _WIRE_TYPES_BY_TAG.get(tag)
+    if value_type in (tuple, set, frozenset):
+        return value_type(obj["v"])
+    elif value_type is not None:
+        return value_type(*obj["v"])
+    elif tag == "d":
+        # keys have been decoded already, tuples are hashable again
+        return {key: item for key, item in obj["v"]}
+    elif tag == "b":
+        return obj["v"].encode("latin-1")
+
+    record_class = _get_wire_record_classes()[tag]
+    record = record_class.__new__(record_class)
+    record.__dict__.update(obj)
+    return record
+
+
+def _get_wire_record_classes() -> Dict[str, type]:
+    global _wire_record_classes
+    if _wire_record_classes is None:
+        # same names as the legacy format can evaluate
+        _wire_record_classes = {
+            name: value
+            for name, value in globals().items()
+            if isinstance(value, type) and issubclass(value, Record)
+        }
+    return _wire_record_classes
+
+
 def normpath_with_actual_case(name: str) -> str:
     """In Windows return the path with the case it is stored in the filesystem"""
     if not os.path.exists(name):
@@ -777,6 +903,17 @@ def read_one_incoming_message_str(line_reader):
     if not msg_str.startswith(MESSAGE_MARKER):
         return msg_str
 
+    if msg_str.startswith(FRAME_MARKER):
+        # payload never contains line breaks, but the reader may give it in pieces
+        header_end = msg_str.index(" ")
+        frame_length = header_end + 1 + int(msg_str[len(FRAME_MARKER) : header_end])
+        while len(msg_str.rstrip("\r\n")) < frame_length:
+            line = line_reader()
+            if line == "":
+                break
+            msg_str += line
+        return msg_str
+
     line_count = int(msg_str[1:].split(maxsplit=1)[0])
     read_lines = 1
     while read_lines < line_count:
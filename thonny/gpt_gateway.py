@@ -0,0 +1,470 @@
+"""Classroom gateway for the GPT assistant.
+
+All Thonny instances of a lab can use this server instead of talking to OpenAI directly
+(set the API URL of the assistant to http://<gateway-host>:<port>/v1). The gateway
+answers repeated questions from a shared cache, merges identical simultaneous requests
+into one upstream call, applies per-student limits and keeps its upstream connections
+alive. If the gateway is given a list of student tokens, only requests with one of these
+tokens as API key are accepted and the token identifies the student. Without tokens anyone
+who can reach the gateway could spend the API key, so then it only listens on the loopback
+interface, requests are told apart by their IP address and the API key they send is ignored.
+
+Run standalone with ``python -m thonny.gpt_gateway --api-key-file <file>`` or start it
+from the Tools menu of Thonny.
+"""
+
+import argparse
+import http.client
+import ipaddress
+import json
+import os.path
+import queue
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from typing import Any, Collection, Deque, Dict, List, Optional, Tuple
+
+from thonny.gpt_utils import ResponseCache
+
+logger = getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_UPSTREAM_URL = "https://api.openai.com/v1"
+
+# Error code of the 429 response for a used up hourly quota (retrying doesn't help)
+QUOTA_EXCEEDED_CODE = "quota_exceeded"
+
+# Request parameters which don't change the answer
+_NON_SEMANTIC_PARAMS = {"messages", "stream", "stream_options", "user", "n"}
+
+
+class UpstreamPool:
+    """Keeps a bounded set of keep-alive connections to the upstream API."""
+
+    def __init__(self, base_url: str, api_key: str, size: int = 4, timeout: float = 60):
+        parts = urllib.parse.urlsplit(base_url)
+        self._https = parts.scheme == "https"
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path_prefix = parts.path.rstrip("/")
+        self._api_key = api_key
+        self._timeout = timeout
+        self._idle_connections = queue.LifoQueue()  # type: queue.LifoQueue
+        self._slots = threading.BoundedSemaphore(size)
+
+    def post_json(self, path: str, data: Dict[str, Any]) -> Tuple[int, Optional[str], bytes]:
+        body = json.dumps(data).encode("utf-8")
+        headers = {
+            "Authorization": "Bearer " + self._api_key,
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+        with self._slots:
+            conn = self._take_connection()
+            try:
+                response = self._send(conn, path, body, headers)
+            except (http.client.HTTPException, OSError):
+                # the server may have dropped an idle keep-alive connection
+                conn.close()
+                conn = self._create_connection()
+                response = self._send(conn, path, body, headers)
+
+            result = (response.status, response.getheader("Retry-After"), response.read())
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle_connections.put(conn)
+            return result
+
+    def close(self) -> None:
+        while not self._idle_connections.empty():
+            self._idle_connections.get_nowait().close()
+
+    def _send(self, conn, path, body, headers):
+        conn.request("POST", self._path_prefix + path, body=body, headers=headers)
+        return conn.getresponse()
+
+    def _take_connection(self):
+        try:
+            return self._idle_connections.get_nowait()
+        except queue.Empty:
+            return self._create_connection()
+
+    def _create_connection(self):
+        if self._https:
+            return http.client.HTTPSConnection(self._host, self._port, timeout=self._timeout)
+        else:
+            return http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+
+
+class _InflightRequest:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None  # type: Optional[Tuple[int, Dict[str, Any], Optional[str]]]
+
+
+class Gateway:
+    def __init__(
+        self,
+        upstream: UpstreamPool,
+        cache: Optional[ResponseCache] = None,
+        requests_per_hour: int = 60,
+        max_concurrent_per_student: int = 1,
+        student_tokens: Optional[Collection[str]] = None,
+    ):
+        self.upstream = upstream
+        self.cache = cache
+        self.requests_per_hour = requests_per_hour
+        self.max_concurrent_per_student = max_concurrent_per_student
+        self.student_tokens = None if student_tokens is None else set(student_tokens)
+        self.stats = Counter()  # type: Counter[str]
+        self._lock = threading.Lock()
+        self._inflight = {}  # type: Dict[str, _InflightRequest]
+        self._upstream_times = {}  # type: Dict[str, Deque[float]]
+        self._active_counts = Counter()  # type: Counter[str]
+
+    def get_student(self, authorization: str, client_host: str) -> Optional[str]:
+        """Returns the student id for a request or None if the request is not allowed."""
+        if self.student_tokens is None:
+            # any token would be accepted, so it can't be used for telling students apart
+            return client_host
+
+        token = authorization[7:].strip() if authorization.startswith("Bearer ") else ""
+        if token in self.student_tokens:
+            return token
+        return None
+
+    def handle_completion(
+        self, student: str, request: Dict[str, Any]
+    ) -> Tuple[int, Dict[str, Any], Optional[str]]:
+        """Returns HTTP status, response JSON and Retry-After value for a chat completion."""
+        with self._lock:
+            self.stats["requests"] += 1
+            if self._active_counts[student] >= self.max_concurrent_per_student:
+                self.stats["rejected"] += 1
+                return _error(429, "Es läuft schon eine Anfrage, bitte warte auf die Antwort.", "1")
+            self._active_counts[student] += 1
+
+        try:
+            return self._handle_completion(student, request)
+        finally:
+            with self._lock:
+                self._active_counts[student] -= 1
+
+    def _handle_completion(self, student, request):
+        params = {k: v for k, v in request.items() if k not in _NON_SEMANTIC_PARAMS}
+        key = ResponseCache.make_key(request.get("messages", []), params)
+
+        if self.cache is not None:
+            content = self.cache.get(key)
+            if content is not None:
+                with self._lock:
+                    self.stats["cache_hits"] += 1
+                return 200, _create_completion(request.get("model"), content), None
+
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                leader = False
+                self.stats["coalesced"] += 1
+            else:
+                leader = True
+                retry_after = self._check_quota(student)
+                if retry_after is not None:
+                    self.stats["rejected"] += 1
+                    return _error(
+                        429,
+                        "Das Kontingent für diese Stunde ist aufgebraucht.",
+                        retry_after,
+                        code=QUOTA_EXCEEDED_CODE,
+                    )
+                inflight = self._inflight[key] = _InflightRequest()
+
+        if not leader:
+            inflight.done.wait()
+            return inflight.result
+
+        try:
+            inflight.result = self._fetch_upstream(key, request, params)
+        except Exception as e:
+            logger.exception("Upstream request failed")
+            inflight.result = _error(502, "Keine Verbindung zum KI-Dienst: %s" % e, None)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            inflight.done.set()
+
+        return inflight.result
+
+    def _check_quota(self, student: str) -> Optional[str]:
+        # must be called with self._lock held
+        now = time.time()
+        times = self._upstream_times.setdefault(student, deque())
+        while times and now - times[0] > 3600:
+            times.popleft()
+        if len(times) >= self.requests_per_hour:
+            return str(int(3600 - (now - times[0])) + 1)
+        times.append(now)
+        return None
+
+    def _fetch_upstream(self, key, request, params):
+        upstream_request = dict(params, messages=request.get("messages", []), stream=False)
+        start_time = time.time()
+        status, retry_after, body = self.upstream.post_json("/chat/completions", upstream_request)
+        latency = time.time() - start_time
+        with self._lock:
+            self.stats["upstream_requests"] += 1
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return _error(502, "Ungültige Antwort vom KI-Dienst", None)
+
+        if status != 200:
+            return status, data, retry_after
+
+        content = data["choices"][0]["message"]["content"] or ""
+        if self.cache is not None and content:
+            self.cache.put(key, content, latency)
+        return 200, data, None
+
+
+def _create_completion(model, content):
+    return {
+        "id": "chatcmpl-" + uuid.uuid4().hex,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+    }
+
+
+def _error(status, message, retry_after, code=None):
+    return (
+        status,
+        {"error": {"message": message, "type": "gateway_error", "code": code}},
+        retry_after,
+    )
+
+
+def _completion_as_event_stream(completion: Dict[str, Any]) -> bytes:
+    # The gateway always fetches complete answers (so that they can be cached and shared),
+    # streaming clients get the answer as one chunk
+    choice = completion["choices"][0]
+    chunks = [
+        {"role": "assistant", "content": choice["message"]["content"]},
+        {},
+    ]
+    events = []
+    for i, delta in enumerate(chunks):
+        events.append(
+            {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": choice.get("finish_reason") if i else None,
+                    }
+                ],
+            }
+        )
+    return (
+        "".join("data: %s\n\n" % json.dumps(event) for event in events) + "data: [DONE]\n\n"
+    ).encode("utf-8")
+
+
+class _GatewayRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ThonnyGPTGateway"
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path.rstrip("/") not in [
+            "/v1/chat/completions",
+            "/chat/completions",
+        ]:
+            self._send_json(404, {"error": {"message": "Unknown path"}})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+
+        student = self.server.gateway.get_student(
+            self.headers.get("Authorization", ""), self.client_address[0]
+        )
+        if student is None:
+            self._send_json(*_error(401, "Unbekannter API-Schlüssel", None))
+            return
+
+        status, data, retry_after = self.server.gateway.handle_completion(student, request)
+        if status == 200 and request.get("stream"):
+            self._send(200, "text/event-stream", _completion_as_event_stream(data))
+        else:
+            self._send_json(status, data, retry_after)
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path.rstrip("/") == "/stats":
+            self._send_json(200, dict(self.server.gateway.stats))
+        else:
+            self._send_json(404, {"error": {"message": "Unknown path"}})
+
+    def _send_json(self, status, data, retry_after=None):
+        self._send(status, "application/json", json.dumps(data).encode("utf-8"), retry_after)
+
+    def _send(self, status, content_type, body, retry_after=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if retry_after is not None:
+            self.send_header("Retry-After", retry_after)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+
+class GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, gateway: Gateway):
+        self.gateway = gateway
+        super().__init__(address, _GatewayRequestHandler)
+
+    def get_url(self) -> str:
+        host, port = self.server_address[:2]
+        return "http://%s:%d/v1" % (host, port)
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def create_server(
+    api_key: str,
+    host: Optional[str] = None,
+    port: int = DEFAULT_PORT,
+    upstream_url: str = DEFAULT_UPSTREAM_URL,
+    cache_dir: Optional[str] = None,
+    cache_ttl_hours: float = 7 * 24,
+    cache_max_mb: int = 200,
+    requests_per_hour: int = 60,
+    max_concurrent_per_student: int = 1,
+    upstream_connections: int = 4,
+    student_tokens: Optional[Collection[str]] = None,
+) -> GatewayServer:
+    if host is None:
+        host = "127.0.0.1" if student_tokens is None else "0.0.0.0"
+    elif student_tokens is None and not _is_loopback(host):
+        raise ValueError("Gateway without student tokens can't listen on %s" % host)
+
+    cache = None
+    if cache_dir:
+        cache = ResponseCache(cache_dir, cache_ttl_hours * 3600, cache_max_mb * 1024 * 1024)
+    gateway = Gateway(
+        UpstreamPool(upstream_url, api_key, upstream_connections),
+        cache,
+        requests_per_hour,
+        max_concurrent_per_student,
+        student_tokens,
+    )
+    return GatewayServer((host, port), gateway)
+
+
+def start_in_background(api_key: str, **kw) -> GatewayServer:
+    server = create_server(api_key, **kw)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def read_student_tokens(path: str) -> List[str]:
+    """Reads student tokens from a file with one token per line."""
+    with open(path, encoding="utf-8") as fp:
+        return [line.strip() for line in fp if line.strip() and not line.startswith("#")]
+
+
+def main():
+    import logging
+
+    parser = argparse.ArgumentParser(description="Classroom gateway for Thonny's GPT assistant")
+    parser.add_argument("--api-key-file", required=True, help="File with the upstream API key")
+    parser.add_argument(
+        "--host",
+        help="Address to listen on (by default all interfaces with student tokens, otherwise "
+        "only the loopback interface)",
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--upstream-url", default=DEFAULT_UPSTREAM_URL)
+    parser.add_argument(
+        "--cache-dir",
+        default=os.path.join(os.path.expanduser("~"), ".thonny_gpt_gateway_cache"),
+        help="Directory for the shared response cache (empty string disables the cache)",
+    )
+    parser.add_argument("--cache-ttl-hours", type=float, default=7 * 24)
+    parser.add_argument("--cache-max-mb", type=int, default=200)
+    parser.add_argument("--requests-per-hour", type=int, default=60, help="Per student")
+    parser.add_argument("--max-concurrent-per-student", type=int, default=1)
+    parser.add_argument("--upstream-connections", type=int, default=4)
+    parser.add_argument(
+        "--student-tokens-file",
+        help="File with one accepted API key per student (without it the gateway is only "
+        "reachable from this computer)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.api_key_file, encoding="utf-8") as fp:
+        api_key = fp.read().strip()
+
+    try:
+        server = create_server(
+            api_key,
+            host=args.host,
+            port=args.port,
+            upstream_url=args.upstream_url,
+            cache_dir=args.cache_dir,
+            cache_ttl_hours=args.cache_ttl_hours,
+            cache_max_mb=args.cache_max_mb,
+            requests_per_hour=args.requests_per_hour,
+            max_concurrent_per_student=args.max_concurrent_per_student,
+            upstream_connections=args.upstream_connections,
+            student_tokens=(
+                read_student_tokens(args.student_tokens_file) if args.student_tokens_file else None
+            ),
+        )
+    except ValueError as e:
+        parser.error("%s (use --student-tokens-file)" % e)
+    logger.info("Serving on %s", server.get_url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.gateway.upstream.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,577 @@
+import ast
+import hashlib
+import json
+import os.path
+import random
+import re
+import threading
+import time
+from collections import deque
+from logging import getLogger
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = getLogger(__name__)
+
+HISTORY_FILE_EXTENSION = ".jsonl"
+LEGACY_HISTORY_FILE_EXTENSION = ".json"
+
+
+class ChatHistoryLog:
+    """Append-only store for the bubbles of one conversation.
+
+    Every bubble is one JSON record on its own line, so adding a message doesn't
+    need to read or rewrite the earlier ones. Lines which can't be used (eg. half-written
+    line after a crash or a record superseded by a later one with same id) are dropped
+    when the file gets compacted.
+    """
+
+    sync_every_records = 5
+    sync_every_seconds = 2.0
+    compact_after_garbage_lines = 20
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fp = None
+        self._unsynced_count = 0
+        self._last_sync_time = time.time()
+        self._migrate_legacy_file()
+
+    def read_records(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+
+        with open(self.path, "rb") as fp:
+            data = fp.read()
+
+        records_by_id = {}  # type: Dict[str, Dict[str, Any]]
+        garbage_lines = 0
+        lines = data.split(b"\n")
+        if lines[-1]:
+            # no newline at the end means the last write didn't complete
+            garbage_lines += 1
+        del lines[-1]
+
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                garbage_lines += 1
+                continue
+
+            key = record.get("id")
+            if key in records_by_id:
+                # later record wins, but keeps original position
+                garbage_lines += 1
+            records_by_id[key] = record
+
+        records = list(records_by_id.values())
+        if garbage_lines >= self.compact_after_garbage_lines or (
+            garbage_lines and not data.endswith(b"\n")
+        ):
+            self._rewrite(records)
+
+        return records
+
+    def append(self, record: Dict[str, Any]) -> None:
+        fp = self._get_fp()
+        fp.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        fp.flush()
+        self._unsynced_count += 1
+        if (
+            self._unsynced_count >= self.sync_every_records
+            or time.time() - self._last_sync_time >= self.sync_every_seconds
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        if self._fp is not None and self._unsynced_count:
+            try:
+                os.fsync(self._fp.fileno())
+            except OSError:
+                logger.warning("Could not fsync %s", self.path, exc_info=True)
+        self._unsynced_count = 0
+        self._last_sync_time = time.time()
+
+    def clear(self) -> None:
+        self.close()
+        with open(self.path, "wb"):
+            pass
+
+    def compact(self) -> None:
+        self._rewrite(self.read_records())
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self.sync()
+            self._fp.close()
+            self._fp = None
+
+    def _get_fp(self):
+        if self._fp is None:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            self._fp = open(self.path, "ab")
+            if self._fp.tell() > 0:
+                with open(self.path, "rb") as fp:
+                    fp.seek(-1, os.SEEK_END)
+                    if fp.read(1) != b"\n":
+                        # don't glue new record to a partial line
+                        self._fp.write(b"\n")
+        return self._fp
+
+    def _rewrite(self, records: List[Dict[str, Any]]) -> None:
+        self.close()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as fp:
+            for record in records:
+                fp.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp_path, self.path)
+
+    def _migrate_legacy_file(self) -> None:
+        # Older versions kept the whole history as one JSON object (id -> record)
+        legacy_path = os.path.splitext(self.path)[0] + LEGACY_HISTORY_FILE_EXTENSION
+        if legacy_path == self.path or not os.path.exists(legacy_path):
+            return
+
+        if not os.path.exists(self.path):
+            try:
+                with open(legacy_path, encoding="utf-8") as fp:
+                    legacy_data = json.load(fp)
+            except ValueError:
+                logger.exception("Could not read %s", legacy_path)
+                return
+
+            records = []
+            for key, record in legacy_data.items():
+                record = dict(record)
+                record["id"] = key
+                records.append(record)
+            self._rewrite(records)
+
+        os.remove(legacy_path)
+
+
+def get_history_log_path(gpt_user_dir: str, code_file_name: str) -> str:
+    return os.path.join(gpt_user_dir, code_file_name, code_file_name + HISTORY_FILE_EXTENSION)
+
+
+_TOKEN_PIECE_REGEX = re.compile(r"\w+|[^\w\s]")
+_MESSAGE_OVERHEAD_TOKENS = 4
+_OMISSION_MARKER = "# ..."
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough local estimate of the number of tokens the model sees for the text.
+
+    Punctuation is usually one token and words are split into pieces of about
+    4 characters, which is close enough for budgeting without a tokenizer.
+    """
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PIECE_REGEX.findall(text))
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(msg["content"]) + _MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+
+def select_relevant_code(code: str, max_tokens: int, focus_line: Optional[int] = None) -> str:
+    """Returns the code unchanged if it fits, otherwise the part around focus_line.
+
+    The innermost function or class containing focus_line (1-based) is preferred,
+    when this is still too long, a window of lines around focus_line is taken.
+    """
+    if estimate_tokens(code) <= max_tokens:
+        return code
+
+    lines = code.splitlines()
+    if focus_line is None or not 1 <= focus_line <= len(lines):
+        focus_line = 1
+
+    start, end = _get_enclosing_definition(code, focus_line) or (focus_line, focus_line)
+
+    # grow the window around the definition (or line) as long as the budget allows
+    used = sum(estimate_tokens(line) + 1 for line in lines[start - 1 : end])
+    while used > max_tokens and end > start:
+        if end - focus_line > focus_line - start:
+            used -= estimate_tokens(lines[end - 1]) + 1
+            end -= 1
+        else:
+            used -= estimate_tokens(lines[start - 1]) + 1
+            start += 1
+
+    while start > 1 or end < len(lines):
+        candidates = []
+        if start > 1:
+            candidates.append(("start", lines[start - 2]))
+        if end < len(lines):
+            candidates.append(("end", lines[end]))
+        # prefer to grow upwards, the lines above usually explain the focus
+        side, line = candidates[0]
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        used += cost
+        if side == "start":
+            start -= 1
+        else:
+            end += 1
+
+    result = lines[start - 1 : end]
+    if start > 1:
+        result.insert(0, _OMISSION_MARKER)
+    if end < len(lines):
+        result.append(_OMISSION_MARKER)
+    return "\n".join(result)
+
+
+def _get_enclosing_definition(code: str, line: int) -> Optional[Tuple[int, int]]:
+    try:
+        root = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    result = None
+    for node in ast.walk(root):
+        if (
+            isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+            and node.lineno <= line <= node.end_lineno
+        ):
+            first_line = min([node.lineno] + [dec.lineno for dec in node.decorator_list])
+            if result is None or node.lineno > result[0]:
+                result = (first_line, node.end_lineno)
+
+    return result
+
+
+def summarize_turns(turns: List[Dict[str, str]], max_tokens: int) -> Optional[str]:
+    """Short local summary of conversation turns which don't fit into the budget anymore."""
+    title = "Bisheriger Gesprächsverlauf (gekürzt):"
+    used = estimate_tokens(title)
+    summary_lines = []  # type: List[str]
+    # the oldest turns matter least, so they are the first to go
+    for turn in reversed(turns):
+        speaker = "Schüler" if turn["role"] == "user" else "Lehrkraft"
+        content = " ".join(turn["content"].split())
+        if len(content) > 120:
+            content = content[:117] + "..."
+        line = "- %s: %s" % (speaker, content)
+        cost = estimate_tokens(line)
+        if used + cost > max_tokens:
+            break
+        summary_lines.insert(0, line)
+        used += cost
+
+    if not summary_lines:
+        return None
+    return "\n".join([title] + summary_lines)
+
+
+def build_chat_messages(
+    system_prompt: str,
+    code: str,
+    question: str,
+    old_messages: List[Dict[str, str]],
+    token_budget: int,
+    focus_line: Optional[int] = None,
+) -> Tuple[List[Dict[str, str]], int]:
+    """Composes the messages for a chat completion request within token_budget.
+
+    System prompt and question are always included. Code gets up to 60 % of the rest
+    (reduced to the region around focus_line if necessary), previous turns get what
+    remains, newest first. Turns which don't fit are replaced by a short summary.
+    Returns the messages and their estimated token count.
+    """
+    system_message = {"role": "system", "content": system_prompt}
+
+    def format_prompt(code_part):
+        return f"```{code_part}```\n\nFrage des Schülers: {question}"
+
+    fixed_tokens = estimate_message_tokens(
+        [system_message, {"role": "user", "content": format_prompt("")}]
+    )
+    remaining = max(0, token_budget - fixed_tokens)
+
+    selected_code = select_relevant_code(code, remaining * 6 // 10, focus_line)
+    user_message = {"role": "user", "content": format_prompt(selected_code)}
+    remaining -= estimate_tokens(selected_code)
+
+    if estimate_message_tokens(old_messages) > remaining:
+        # not everything fits, leave room for the summary of the dropped turns
+        summary_budget = remaining // 5
+        remaining -= summary_budget
+    else:
+        summary_budget = 0
+
+    kept_turns = []  # type: List[Dict[str, str]]
+    dropped_count = len(old_messages)
+    for msg in reversed(old_messages):
+        cost = estimate_tokens(msg["content"]) + _MESSAGE_OVERHEAD_TOKENS
+        if cost > remaining:
+            break
+        kept_turns.insert(0, msg)
+        remaining -= cost
+        dropped_count -= 1
+
+    messages = [system_message]
+    if dropped_count:
+        summary = summarize_turns(
+            old_messages[:dropped_count], remaining + summary_budget - _MESSAGE_OVERHEAD_TOKENS
+        )
+        if summary is not None:
+            messages.append({"role": "system", "content": summary})
+    messages.extend(kept_turns)
+    messages.append(user_message)
+
+    return messages, estimate_message_tokens(messages)
+
+
+class ResponseCache:
+    """Persistent LRU cache for assistant answers.
+
+    Every entry is a separate small JSON file named after the hash of the request, which
+    allows several Thonny instances to share the directory (eg. on a network drive)
+    without any locking. Recency is tracked via file modification time.
+
+    The directory is created with default permissions. For sharing between users it should
+    be writable by all of them. Entries which can't be read are treated as missing.
+    """
+
+    prune_every_puts = 20
+
+    def __init__(self, directory: str, ttl_seconds: float, max_bytes: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._puts_since_prune = 0
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            logger.warning("Could not create response cache directory %s", directory, exc_info=True)
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, str]], params: Optional[Dict[str, Any]] = None) -> str:
+        normalized = [
+            [msg["role"], ResponseCache._normalize_content(msg["content"])] for msg in messages
+        ]
+        data = json.dumps([normalized, params or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize_content(content: str) -> str:
+        # Differences in whitespace or letter case of the question don't deserve a separate
+        # answer, but in the code between ``` fences they may well be the cause of the problem
+        parts = content.split("```")
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                parts[i] = " ".join(part.split()).casefold()
+            else:
+                parts[i] = "\n".join(line.rstrip() for line in part.splitlines())
+        return "```".join(parts)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._get_path(key)
+        try:
+            with open(path, encoding="utf-8") as fp:
+                entry = json.load(fp)
+            created = entry["created"]
+            response = entry["response"]
+        except PermissionError:
+            # eg. written by another user of a shared directory
+            logger.debug("No permission to read cached response %s", path)
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            self.misses += 1
+            return None
+
+        if time.time() - created > self.ttl_seconds:
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        self.saved_seconds += entry.get("latency", 0.0)
+        return response
+
+    def put(self, key: str, response: str, latency: float = 0.0) -> None:
+        path = self._get_path(key)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(temp_path, "w", encoding="utf-8") as fp:
+                json.dump(
+                    {"created": time.time(), "latency": latency, "response": response},
+                    fp,
+                    ensure_ascii=False,
+                )
+            os.replace(temp_path, path)
+        except OSError:
+            logger.warning("Could not store response to cache", exc_info=True)
+            self._remove(temp_path)
+            return
+
+        self._puts_since_prune += 1
+        if self._puts_since_prune >= self.prune_every_puts:
+            self.prune()
+
+    def prune(self) -> None:
+        """Removes expired entries and then least recently used ones until max_bytes is met."""
+        self._puts_since_prune = 0
+        entries = []
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # modification time is refreshed on every hit
+            if now - stat.st_mtime > self.ttl_seconds:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            self._remove(path)
+            total_size -= size
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# option name, type, smallest and largest allowed value
+_REQUEST_NUMBER_OPTIONS = [
+    ("max_retries", int, 0, 10),
+    ("temperature", float, 0.0, 2.0),
+    ("max_tokens", int, 1, None),
+    ("top_p", float, 0.0, 1.0),
+    ("frequency_penalty", float, -2.0, 2.0),
+]
+
+
+def parse_request_settings(get_option: Callable[[str], Any]) -> Dict[str, Any]:
+    """Converts the assistanceGPT request options to the settings of an API request.
+
+    The configuration page stores the numbers as entered text, so they are validated here.
+    Raises ValueError with a message which can be shown to the user.
+    """
+    numbers = {}
+    for name, number_type, min_value, max_value in _REQUEST_NUMBER_OPTIONS:
+        raw_value = get_option("assistanceGPT." + name)
+        try:
+            value = number_type(str(raw_value).strip().replace(",", "."))
+        except ValueError:
+            raise ValueError("Ungültiger Wert für %s: %r" % (name, raw_value)) from None
+
+        if value < min_value or max_value is not None and value > max_value:
+            if max_value is None:
+                allowed = "mindestens %s" % min_value
+            else:
+                allowed = "von %s bis %s" % (min_value, max_value)
+            raise ValueError("Der Wert für %s muss %s sein, nicht %s." % (name, allowed, value))
+        numbers[name] = value
+
+    return {
+        "base_url": get_option("assistanceGPT.base_url") or None,
+        "max_retries": numbers.pop("max_retries"),
+        "params": dict(model=get_option("assistanceGPT.model"), **numbers),
+    }
+
+
+_openai_clients = {}  # type: Dict[Tuple[str, Optional[str]], Any]
+_openai_clients_lock = threading.Lock()
+
+
+def get_pooled_openai_client(api_key: str, base_url: Optional[str] = None):
+    """Gives a shared client per API key and endpoint.
+
+    Reusing the client keeps its HTTP connections (and TLS sessions) alive between requests.
+    """
+    import openai
+
+    key = (api_key, base_url or None)
+    with _openai_clients_lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            # retries are done in call_with_retries
+            client = openai.OpenAI(api_key=api_key, base_url=base_url or None, max_retries=0)
+            _openai_clients[key] = client
+        return client
+
+
+def call_with_retries(
+    action: Callable[[], Any],
+    is_retryable: Callable[[Exception], bool],
+    max_retries: int,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    get_retry_after: Optional[Callable[[Exception], Optional[float]]] = None,
+    sleep: Callable[[float], Any] = time.sleep,
+) -> Any:
+    """Calls action, retrying transient failures with exponential backoff and full jitter.
+
+    Random delays keep many clients, which failed at the same moment, from
+    retrying at the same moment again.
+    """
+    attempt = 0
+    while True:
+        try:
+            return action()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            if get_retry_after is not None:
+                retry_after = get_retry_after(e)
+                if retry_after is not None:
+                    delay = max(delay, min(retry_after, max_delay))
+
+            attempt += 1
+            logger.info("Retrying (%d/%d) in %.1f s after %r", attempt, max_retries, delay, e)
+            sleep(delay)
+
+
+class LatencyStats:
+    def __init__(self, max_samples: int = 100):
+        self._samples = deque(maxlen=max_samples)  # type: Deque[float]
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def get_count(self) -> int:
+        return len(self._samples)
+
+    def get_last(self) -> Optional[float]:
+        return self._samples[-1] if self._samples else None
+
+    def get_average(self) -> Optional[float]:
+        return sum(self._samples) / len(self._samples) if self._samples else None
@@ -1,8 +1,9 @@
 import os
-from tkinter import ttk
+from tkinter import messagebox, ttk
 
 from thonny import get_workbench, ui_utils
 from thonny.config_ui import ConfigurationPage
+from thonny.gpt_utils import parse_request_settings
 from thonny.languages import tr
 from thonny.tktextext import TextFrame
 from thonny.ui_utils import askdirectory, askopenfilename, create_string_var, scrollbar_style
@@ -96,15 +97,22 @@ class AssistantGPTConfigPage(ConfigurationPage):
             command=self._select_system_prompt,
         )
         self._system_prompt_select_button.grid(row=9, column=3, sticky="e", padx=(10, 0))
-        extra_text = tr(
-            """The model 'gpt-4o-mini-2024-07-18' is used with the following parameters:
-- temperature = 0.7 (Creativity of responses)
-- top_p = 0.7 (Probability control)
-- max_tokens = 150 (Limits the maximum response length)
-- frequency_penalty = 0.6 (Reduces repetitions in responses)"""
-        )
-        extra_label = ttk.Label(self, text=extra_text)
-        extra_label.grid(row=11, columnspan=3, pady=10, sticky="w")
+        row = 11
+        for option_name, label_text in [
+            ("assistanceGPT.model", tr("Model")),
+            ("assistanceGPT.temperature", tr("temperature (Creativity of responses)")),
+            ("assistanceGPT.top_p", tr("top_p (Probability control)")),
+            ("assistanceGPT.max_tokens", tr("max_tokens (Limits the maximum response length)")),
+            (
+                "assistanceGPT.frequency_penalty",
+                tr("frequency_penalty (Reduces repetitions in responses)"),
+            ),
+            ("assistanceGPT.base_url", tr("API URL (empty for OpenAI)")),
+        ]:
+            label = ttk.Label(self, text=label_text)
+            label.grid(row=row, column=0, columnspan=2, sticky="w", pady=(5, 0))
+            self.add_entry(option_name, row=row, column=2, columnspan=2, pady=(5, 0))
+            row += 1
         self.columnconfigure(1, weight=1)
         self.columnconfigure(2, weight=1)
 
@@ -271,6 +279,12 @@ class AssistantGPTConfigPage(ConfigurationPage):
         return ""
 
     def apply(self):
+        try:
+            parse_request_settings(get_workbench().get_option)
+        except ValueError as e:
+            messagebox.showerror(tr("Invalid value"), str(e), master=self)
+            return False
+
         _system_prompt = self._read_file_to_string(
             get_workbench().get_option("assistanceGPT.system_prompt_filepath")
         )
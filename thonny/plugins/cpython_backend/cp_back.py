@@ -2,12 +2,15 @@
 import ast
 import builtins
 import functools
+import gc
 import importlib.util
 import inspect
 import io
+import itertools
 import os.path
 import queue
 import re
+import reprlib
 import site
 import subprocess
 import sys
@@ -15,6 +18,8 @@ import tokenize
 import traceback
 import types
 import warnings
+import weakref
+from collections import OrderedDict
 from typing import Dict, List, Optional, Tuple, Union
 
 import __main__
@@ -41,6 +46,7 @@ from thonny.common import (
     ToplevelResponse,
     UserError,
     ValueInfo,
+    choose_wire_format,
     execute_system_command,
     execute_with_frontend_sys_path,
     get_augmented_system_path,
@@ -60,6 +66,24 @@ _CONFIG_FILENAME = os.path.join(thonny.THONNY_USER_DIR, "backend_configuration.i
 
 _backend = None
 
+# Repr of these can't change without the object getting replaced
+_IMMUTABLE_TYPES = {
+    int,
+    float,
+    complex,
+    bool,
+    str,
+    bytes,
+    range,
+    type(None),
+    type,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.ModuleType,
+}
+# Elements of big containers are sent to Object inspector in pages
+OBJECT_INFO_PAGE_SIZE = 500
+
 
 class MainCPythonBackend(MainBackend):
     def __init__(self, target_cwd, options):
@@ -79,10 +103,13 @@ class MainCPythonBackend(MainBackend):
         self._source_preprocessors = []
         self._ast_postprocessors = []
         self._main_dir = os.path.dirname(sys.modules["thonny"].__file__)
-        self._heap = {}  # WeakValueDictionary would be better, but can't store reference to None
+        self._heap = ObjectHeap()
+        # name -> (value, ValueInfo) of last exported __main__ globals
+        self._exported_globals = None  # type: Optional[Dict[str, Tuple[object, ValueInfo]]]
         self._source_info_by_frame = {}
         self._init_help()
         self._install_fake_streams()
+        self._wire_format = choose_wire_format(self._original_stdout)
         self._install_repl_helper()
         self._current_executor = None
         self._io_level = 0
@@ -455,9 +482,13 @@ class MainCPythonBackend(MainBackend):
 
     def _cmd_FastDebug(self, cmd):
         self.switch_env_to_script_mode(cmd)
-        from thonny.plugins.cpython_backend.cp_tracers import FastTracer
+        from thonny.plugins.cpython_backend.cp_tracers import FastTracer, MonitoringFastTracer
 
-        return self._execute_file(cmd, FastTracer)
+        if hasattr(sys, "monitoring"):
+            # Python 3.12+
+            return self._execute_file(cmd, MonitoringFastTracer)
+        else:
+            return self._execute_file(cmd, FastTracer)
 
     def _cmd_Debug(self, cmd):
         self.switch_env_to_script_mode(cmd)
@@ -583,17 +614,33 @@ class MainCPythonBackend(MainBackend):
 
     def _cmd_get_heap(self, cmd):
         result = {}
-        for key in self._heap:
-            result[key] = self.export_value(self._heap[key])
+        for key, value in self._heap.items():
+            result[key] = self.export_value(value)
+
+        return InlineResponse("get_heap", heap=result, heap_stats=self._heap.get_stats())
 
-        return InlineResponse("get_heap", heap=result)
+    def _cmd_get_heap_stats(self, cmd):
+        return dict(heap_stats=self._heap.get_stats())
+
+    def _cmd_get_debugger_history_stats(self, cmd):
+        if self._current_executor is None:
+            return dict(history_stats=None)
+        return dict(history_stats=self._current_executor.get_history_stats())
+
+    def _cmd_prune_heap(self, cmd):
+        self._heap.prune()
+        # objects in reference cycles disappear from the weak generation as well
+        gc.collect()
+        return dict(heap_stats=self._heap.get_stats())
 
     def _cmd_get_object_info(self, cmd):
         if self._current_executor and self._current_executor.is_in_past():
             info = {"id": cmd.object_id, "error": "past info not available"}
 
-        elif cmd.object_id in self._heap:
+        elif cmd.object_id in self._heap or self._recover_heap_object(cmd.object_id):
             value = self._heap[cmd.object_id]
+            # keep the inspected object alive until the inspector shows another one
+            self._heap.pin("object_inspector", value)
             attributes = {}
             if cmd.include_attributes:
                 for name in dir(value):
@@ -604,10 +651,10 @@ class MainCPythonBackend(MainBackend):
                         except Exception:
                             pass
 
-            self._heap[id(type(value))] = type(value)
+            self._heap.add(type(value))
             info = {
                 "id": cmd.object_id,
-                "repr": repr(value),
+                "repr": self._get_object_info_repr(value),
                 "type": str(type(value)),
                 "full_type_name": str(type(value))
                 .replace("<class '", "")
@@ -630,9 +677,11 @@ class MainCPythonBackend(MainBackend):
             ):
                 self._add_function_info(value, info)
             elif isinstance(value, (list, tuple, set)):
-                self._add_elements_info(value, info)
+                self._add_elements_info(value, info, 0, OBJECT_INFO_PAGE_SIZE)
             elif isinstance(value, dict):
-                self._add_entries_info(value, info)
+                self._add_entries_info(value, info, 0, OBJECT_INFO_PAGE_SIZE)
+            elif self._is_array_like(value):
+                self._add_array_info(value, info)
             elif isinstance(value, float):
                 self._add_float_info(value, info)
             elif hasattr(value, "image_data"):
@@ -649,6 +698,22 @@ class MainCPythonBackend(MainBackend):
 
         return dict(id=cmd.object_id, info=info)
 
+    def _cmd_get_object_elements(self, cmd):
+        """Next page of elements or entries for Object inspector"""
+        if cmd.object_id not in self._heap:
+            return dict(id=cmd.object_id, error="object info not available")
+
+        value = self._heap[cmd.object_id]
+        page = {}
+        if isinstance(value, dict):
+            self._add_entries_info(value, page, cmd.offset, cmd.limit)
+        elif isinstance(value, (list, tuple, set)):
+            self._add_elements_info(value, page, cmd.offset, cmd.limit)
+        else:
+            # the id may have been reused by an object of another type
+            return dict(id=cmd.object_id, error="object has no elements")
+        return dict(id=cmd.object_id, **page)
+
     def _cmd_mkdir(self, cmd):
         os.mkdir(cmd.path)
 
@@ -799,15 +864,63 @@ class MainCPythonBackend(MainBackend):
         except Exception:
             pass
 
-    def _add_elements_info(self, value, info):
-        info["elements"] = []
-        for element in value:
-            info["elements"].append(self.export_value(element))
+    def _add_elements_info(self, value, info, offset, limit):
+        if isinstance(value, (list, tuple)):
+            elements = value[offset : offset + limit]
+        else:
+            elements = itertools.islice(value, offset, offset + limit)
+        info["elements"] = [self.export_value(element) for element in elements]
+        info["elements_offset"] = offset
+        info["elements_total"] = len(value)
+
+    def _add_entries_info(self, value, info, offset, limit):
+        info["entries"] = [
+            (self.export_value(key), self.export_value(value[key]))
+            for key in itertools.islice(value, offset, offset + limit)
+        ]
+        info["entries_offset"] = offset
+        info["entries_total"] = len(value)
+
+    def _get_object_info_repr(self, value):
+        if (
+            isinstance(value, (list, tuple, set, frozenset, dict))
+            and len(value) > OBJECT_INFO_PAGE_SIZE
+        ):
+            # full repr of a big container would cost more than the elements shown
+            return _container_repr.repr(value)
+        return repr(value)
+
+    def _is_array_like(self, value):
+        numpy = sys.modules.get("numpy")
+        if numpy is not None and isinstance(value, numpy.ndarray):
+            return True
+        pandas = sys.modules.get("pandas")
+        return pandas is not None and isinstance(value, (pandas.DataFrame, pandas.Series))
+
+    def _add_array_info(self, value, info):
+        """Summary of a NumPy array or pandas object, without exporting the elements"""
+        summary = {
+            "shape": tuple(value.shape),
+            "size": int(value.size),
+        }
+        if hasattr(value, "dtypes") and not hasattr(value, "dtype"):
+            # DataFrame
+            summary["dtype"] = ", ".join(
+                "%s: %s" % (name, dtype) for name, dtype in value.dtypes.items()
+            )
+        else:
+            summary["dtype"] = str(value.dtype)
 
-    def _add_entries_info(self, value, info):
-        info["entries"] = []
-        for key in value:
-            info["entries"].append((self.export_value(key), self.export_value(value[key])))
+        if hasattr(value, "head"):
+            if len(value) > 10:
+                summary["head"] = value.head(5).to_string()
+                summary["tail"] = value.tail(5).to_string()
+            else:
+                summary["head"] = value.to_string()
+        else:
+            # NumPy summarizes big arrays by itself
+            summary["head"] = repr(value)
+        info["array_summary"] = summary
 
     def _add_float_info(self, value, info):
         if not value.is_integer():
@@ -868,7 +981,7 @@ class MainCPythonBackend(MainBackend):
                 except Exception as e:
                     obj_repr = "<repr error: " + str(e) + ">"
                 print(OBJECT_LINK_START % id(obj), obj_repr, OBJECT_LINK_END, sep="")
-                self._heap[id(obj)] = obj
+                self._heap.add(obj)
                 builtins._ = obj
 
         setattr(builtins, _REPL_HELPER_NAME, _handle_repl_value)
@@ -909,18 +1022,18 @@ class MainCPythonBackend(MainBackend):
         if isinstance(msg, ToplevelResponse):
             if "cwd" not in msg:
                 msg["cwd"] = os.getcwd()
-            if "globals" not in msg:
-                msg["globals"] = self.export_globals()
+            if "globals" not in msg and "globals_delta" not in msg:
+                msg["globals_delta"] = self.export_globals_delta()
 
-        self._original_stdout.write(serialize_message(msg) + "\n")
+        self._original_stdout.write(serialize_message(msg, wire_format=self._wire_format) + "\n")
         self._original_stdout.flush()
         if isinstance(msg, ToplevelResponse):
             self._check_load_jedi()
 
     def export_value(self, value, max_repr_length=5000):
-        self._heap[id(value)] = value
+        self._heap.add(value)
         try:
-            rep = repr(value)
+            rep = _get_limited_repr(value, max_repr_length)
         except Exception:
             # See https://bitbucket.org/plas/thonny/issues/584/problem-with-thonnys-back-end-obj-no
             rep = "??? <repr error>"
@@ -930,13 +1043,29 @@ class MainCPythonBackend(MainBackend):
 
         return ValueInfo(id(value), rep)
 
-    def export_variables(self, variables):
+    def _recover_heap_object(self, object_id):
+        # the heap may have dropped a value which is still referenced by a global
+        for value in list(__main__.__dict__.values()):
+            if id(value) == object_id:
+                self._heap.add(value)
+                return True
+        return False
+
+    def export_variables(self, variables, repr_cache=None):
         result = {}
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             for name in variables:
                 if not name.startswith("__"):
-                    result[name] = self.export_value(variables[name], 100)
+                    value = variables[name]
+                    value_info = repr_cache.get(value) if repr_cache is not None else None
+                    if value_info is None:
+                        value_info = self.export_value(value, 100)
+                        if repr_cache is not None:
+                            repr_cache.put(value, value_info)
+                    else:
+                        self._heap.add(value)
+                    result[name] = value_info
 
         return result
 
@@ -946,6 +1075,43 @@ class MainCPythonBackend(MainBackend):
         else:
             raise RuntimeError("Module '{0}' is not loaded".format(module_name))
 
+    def export_globals_delta(self):
+        """Exports __main__ globals which have been added, changed or removed since last call.
+
+        Immutable values which are still the same objects don't get repr-ed again, others may
+        have been mutated in place. The front-end (SubprocessProxy) applies the delta to its
+        copy of the globals.
+        """
+        variables = __main__.__dict__
+        previous = self._exported_globals or {}
+        current = {}
+        changed = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for name in variables:
+                if name.startswith("__"):
+                    continue
+
+                value = variables[name]
+                old = previous.get(name)
+                if old is not None and old[0] is value and type(value) in _IMMUTABLE_TYPES:
+                    self._heap.add(value)
+                    current[name] = old
+                else:
+                    value_info = self.export_value(value, 100)
+                    current[name] = (value, value_info)
+                    if old is None or old[1] != value_info:
+                        changed[name] = value_info
+
+        delta = {
+            # first export of this process replaces whatever the front-end had before
+            "full": self._exported_globals is None,
+            "changed": changed,
+            "removed": [name for name in previous if name not in current],
+        }
+        self._exported_globals = current
+        return delta
+
     def _debug(self, *args):
         logger.debug("MainCPythonBackend: " + str(args))
 
@@ -958,8 +1124,11 @@ class MainCPythonBackend(MainBackend):
     def is_doing_io(self):
         return self._io_level > 0
 
-    def _export_stack(self, newest_frame, relevance_checker=None):
+    def _export_stack(self, newest_frame, relevance_checker=None, repr_cache=None):
         result = []
+        exported_globals_per_dict = {}
+        if repr_cache is not None:
+            repr_cache.start_step()
 
         system_frame = newest_frame
 
@@ -983,8 +1152,10 @@ class MainCPythonBackend(MainBackend):
                         filename=system_frame.f_code.co_filename,
                         module_name=module_name,
                         code_name=code_name,
-                        locals=self.export_variables(system_frame.f_locals),
-                        globals=self.export_variables(system_frame.f_globals),
+                        locals=self.export_variables(system_frame.f_locals, repr_cache),
+                        globals=self._export_frame_globals(
+                            system_frame, exported_globals_per_dict, repr_cache
+                        ),
                         freevars=system_frame.f_code.co_freevars,
                         source=source,
                         lineno=system_frame.f_lineno,
@@ -1008,6 +1179,13 @@ class MainCPythonBackend(MainBackend):
         assert result  # not empty
         return result
 
+    def _export_frame_globals(self, frame, exported_globals_per_dict, repr_cache):
+        # frames of same module share the globals
+        key = id(frame.f_globals)
+        if key not in exported_globals_per_dict:
+            exported_globals_per_dict[key] = self.export_variables(frame.f_globals, repr_cache)
+        return exported_globals_per_dict[key]
+
     def _lookup_frame_by_id(self, frame_id):
         def lookup_from_stack(frame):
             if frame is None:
@@ -1101,6 +1279,151 @@ class MainCPythonBackend(MainBackend):
         return os.path.isfile(marker_path)
 
 
+class ReprCache:
+    """Exported variable values of a debugging session.
+
+    Within one step (export of the stack) every value gets repr-ed only once, no matter in
+    how many frames it appears. Immutable values are reused also in the following steps,
+    others may have been mutated in place.
+    """
+
+    def __init__(self):
+        self._current = {}  # type: Dict[int, Tuple[object, ValueInfo]]
+        self._previous = {}  # type: Dict[int, Tuple[object, ValueInfo]]
+
+    def start_step(self) -> None:
+        # values which were not present in last step are forgotten
+        self._previous = {
+            key: entry for key, entry in self._current.items() if type(entry[0]) in _IMMUTABLE_TYPES
+        }
+        self._current = {}
+
+    def get(self, value) -> Optional[ValueInfo]:
+        key = id(value)
+        entry = self._current.get(key)
+        if entry is not None and entry[0] is value:
+            return entry[1]
+
+        entry = self._previous.get(key)
+        if entry is not None and entry[0] is value:
+            self._current[key] = entry
+            return entry[1]
+
+        return None
+
+    def put(self, value, value_info: ValueInfo) -> None:
+        self._current[id(value)] = (value, value_info)
+
+
+class ObjectHeap:
+    """Objects which the front-end may refer to by id.
+
+    Recently exported objects are kept alive in a generation bounded by count and total
+    (shallow) size. Evicted objects stay reachable through weak references for as long as
+    the program keeps them alive (objects which don't support weak references are dropped).
+    The object shown in the Object inspector is pinned until the inspector shows another one.
+    """
+
+    max_recent_count = 10000
+    max_recent_bytes = 64 * 1024 * 1024
+
+    def __init__(self):
+        self._recent = OrderedDict()  # type: OrderedDict[int, Tuple[object, int]]
+        self._recent_bytes = 0
+        self._weak = {}  # type: Dict[int, weakref.ref]
+        self._pins = {}  # type: Dict[str, object]
+        self._evicted_count = 0
+
+    def add(self, value) -> int:
+        key = id(value)
+        entry = self._recent.pop(key, None)
+        if entry is not None:
+            self._recent_bytes -= entry[1]
+
+        ref = self._weak.get(key)
+        if ref is None or ref() is not value:
+            try:
+                self._weak[key] = weakref.ref(value, functools.partial(self._forget, key))
+            except TypeError:
+                # eg. ints, lists and dicts can't be referenced weakly
+                pass
+
+        try:
+            size = sys.getsizeof(value)
+        except Exception:
+            size = 0
+        self._recent[key] = (value, size)
+        self._recent_bytes += size
+
+        while len(self._recent) > 1 and (
+            len(self._recent) > self.max_recent_count or self._recent_bytes > self.max_recent_bytes
+        ):
+            _, (_, evicted_size) = self._recent.popitem(last=False)
+            self._recent_bytes -= evicted_size
+            self._evicted_count += 1
+
+        return key
+
+    def _forget(self, key, ref):
+        # called when weakly referenced object gets collected
+        if self._weak.get(key) is ref:
+            del self._weak[key]
+
+    def __getitem__(self, key):
+        entry = self._recent.get(key)
+        if entry is not None:
+            self._recent.move_to_end(key)
+            return entry[0]
+
+        ref = self._weak.get(key)
+        if ref is not None:
+            value = ref()
+            if value is not None:
+                return value
+
+        for value in self._pins.values():
+            if id(value) == key:
+                return value
+
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def items(self) -> List[Tuple[int, object]]:
+        result = {key: value for key, (value, _) in self._recent.items()}
+        for key, ref in list(self._weak.items()):
+            value = ref()
+            if value is not None:
+                result.setdefault(key, value)
+        for value in self._pins.values():
+            result.setdefault(id(value), value)
+        return list(result.items())
+
+    def pin(self, owner: str, value) -> None:
+        self._pins[owner] = value
+
+    def prune(self) -> None:
+        """Drops strong references to everything but pinned objects"""
+        self._evicted_count += len(self._recent)
+        self._recent.clear()
+        self._recent_bytes = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "recent_count": len(self._recent),
+            "recent_bytes": self._recent_bytes,
+            "max_recent_bytes": self.max_recent_bytes,
+            "weak_count": sum(1 for ref in list(self._weak.values()) if ref() is not None),
+            "pinned_count": len(self._pins),
+            "evicted_count": self._evicted_count,
+        }
+
+
 class FakeStream:
     def __init__(self, backend: MainCPythonBackend, target_stream):
         self._backend = backend
@@ -1275,6 +1598,10 @@ class Executor:
     def is_in_past(self):
         return False
 
+    def get_history_stats(self):
+        """Size of the state history kept for stepping back, if any"""
+        return None
+
     def execute_source(self, source: str, filename, mode, ast_postprocessors):
         assert isinstance(source, str)
 
@@ -1296,10 +1623,7 @@ class Executor:
                 statements = compile(module, filename, "exec")
             elif mode == "exec":
                 report_time("Before preparing ast in executor")
-                root = self._prepare_ast(source, filename, mode)
-                for func in ast_postprocessors:
-                    func(root)
-                statements = compile(root, filename, mode)
+                statements = self._compile_source(source, filename, mode, ast_postprocessors)
                 report_time("After compiling ast in executor")
             else:
                 raise ValueError("Unknown mode", mode)
@@ -1317,6 +1641,12 @@ class Executor:
         """override in subclass for custom-loading user modules"""
         return None
 
+    def _compile_source(self, source, filename, mode, ast_postprocessors=()):
+        root = self._prepare_ast(source, filename, mode)
+        for func in ast_postprocessors:
+            func(root)
+        return compile(root, filename, mode)
+
     def _prepare_ast(self, source, filename, mode):
         return ast.parse(source, filename, mode)
 
@@ -1475,5 +1805,107 @@ def _is_library_file(filename):
     )
 
 
+_container_repr = reprlib.Repr()
+_container_repr.maxlist = _container_repr.maxtuple = _container_repr.maxset = 100
+_container_repr.maxfrozenset = _container_repr.maxdict = 100
+_container_repr.maxstring = _container_repr.maxother = 200
+
+
+_RECURSIVE_REPRS = {
+    list: "[...]",
+    tuple: "(...)",
+    dict: "{...}",
+    set: "set(...)",
+    frozenset: "frozenset(...)",
+}
+
+
+class _ReprLimitReached(Exception):
+    pass
+
+
+class _ReprNotSupported(Exception):
+    pass
+
+
+def _get_limited_repr(value, max_length):
+    """Returns repr(value) or a prefix of it which is longer than max_length.
+
+    Builtin containers are repr-ed element by element, so that a small list of big lists
+    doesn't get repr-ed completely only to be truncated. Other objects could refer back to
+    the containers (which repr would show as [...]), so these are repr-ed only as leaves of
+    the builtin containers."""
+    parts = []
+    length = 0
+    active_ids = set()
+
+    def add(text):
+        nonlocal length
+        parts.append(text)
+        length += len(text)
+        if length > max_length:
+            raise _ReprLimitReached()
+
+    def add_repr(value):
+        value_type = type(value)
+        if value_type in _IMMUTABLE_TYPES or value_type in _RECURSIVE_REPRS and not value:
+            add(repr(value))
+            return
+
+        if value_type not in _RECURSIVE_REPRS:
+            raise _ReprNotSupported()
+
+        if id(value) in active_ids:
+            add(_RECURSIVE_REPRS[value_type])
+            return
+
+        active_ids.add(id(value))
+        if value_type is dict:
+            add("{")
+            for i, (key, item) in enumerate(value.items()):
+                if i:
+                    add(", ")
+                add_repr(key)
+                add(": ")
+                add_repr(item)
+            add("}")
+        else:
+            if value_type is list:
+                add("[")
+            elif value_type is tuple:
+                add("(")
+            elif value_type is set:
+                add("{")
+            else:
+                add("frozenset({")
+
+            for i, item in enumerate(value):
+                if i:
+                    add(", ")
+                add_repr(item)
+
+            if value_type is list:
+                add("]")
+            elif value_type is tuple:
+                add(",)" if len(value) == 1 else ")")
+            elif value_type is set:
+                add("}")
+            else:
+                add("})")
+        active_ids.remove(id(value))
+
+    if type(value) not in _RECURSIVE_REPRS:
+        return repr(value)
+
+    try:
+        add_repr(value)
+    except _ReprLimitReached:
+        pass
+    except _ReprNotSupported:
+        return repr(value)
+
+    return "".join(parts)
+
+
 def get_backend():
     return _backend
@@ -2,15 +2,22 @@ import _ast
 import ast
 import builtins
 import dis
+import hashlib
 import inspect
+import marshal
 import os.path
+import pickle
 import site
 import sys
+import tempfile
+import threading
 from collections import namedtuple
 from importlib.machinery import PathFinder, SourceFileLoader
+from importlib.util import decode_source
 from logging import getLogger
 from typing import Union
 
+import thonny
 from thonny import report_time
 from thonny.common import (
     DebuggerCommand,
@@ -25,7 +32,11 @@ from thonny.common import (
     range_contains_smaller_or_equal,
     try_load_modules_with_frontend_sys_path,
 )
-from thonny.plugins.cpython_backend.cp_back import Executor, format_exception_with_frame_info
+from thonny.plugins.cpython_backend.cp_back import (
+    Executor,
+    ReprCache,
+    format_exception_with_frame_info,
+)
 
 BEFORE_STATEMENT_MARKER = "_thonny_hidden_before_stmt"
 BEFORE_EXPRESSION_MARKER = "_thonny_hidden_before_expr"
@@ -38,6 +49,11 @@ _CO_ITERABLE_COROUTINE = getattr(inspect, "CO_ITERABLE_COROUTINE", 0)
 _CO_ASYNC_GENERATOR = getattr(inspect, "CO_ASYNC_GENERATOR", 0)
 _CO_WEIRDO = _CO_GENERATOR | _CO_COROUTINE | _CO_ITERABLE_COROUTINE | _CO_ASYNC_GENERATOR
 
+# Change when instrumentation changes in a way which Thonny version doesn't reflect
+INSTRUMENTATION_FORMAT = 2
+INSTRUMENTATION_CACHE_DIR = os.path.join(thonny.THONNY_USER_DIR, "instrumented_code")
+INSTRUMENTATION_CACHE_MAX_FILES = 500
+
 
 logger = getLogger(__name__)
 
@@ -69,6 +85,7 @@ class Tracer(Executor):
         self._file_interest_cache = {}
         self._file_breakpoints_cache = {}
         self._command_completion_handler = None
+        self._repr_cache = ReprCache()
 
         # first (automatic) stepping command depends on whether any breakpoints were set or not
         breakpoints = self._original_cmd.breakpoints
@@ -108,17 +125,23 @@ class Tracer(Executor):
     def _execute_prepared_user_code(self, statements, global_vars):
         old_breakpointhook = None
         try:
-            sys.settrace(self._trace)
+            self._start_tracing()
             if hasattr(sys, "breakpointhook"):
                 old_breakpointhook = sys.breakpointhook
                 sys.breakpointhook = self._breakpointhook
 
             return super()._execute_prepared_user_code(statements, global_vars)
         finally:
-            sys.settrace(None)
+            self._stop_tracing()
             if hasattr(sys, "breakpointhook"):
                 sys.breakpointhook = old_breakpointhook
 
+    def _start_tracing(self):
+        sys.settrace(self._trace)
+
+    def _stop_tracing(self):
+        sys.settrace(None)
+
     def _is_interesting_frame(self, frame):
         code = frame.f_code
 
@@ -360,7 +383,7 @@ class FastTracer(Tracer):
         return self._trace
 
     def _report_current_state(self, frame):
-        stack = self._backend._export_stack(frame, self._is_interesting_frame)
+        stack = self._backend._export_stack(frame, self._is_interesting_frame, self._repr_cache)
         msg = DebuggerResponse(
             stack=stack,
             in_present=True,
@@ -425,19 +448,245 @@ class FastTracer(Tracer):
         )
 
 
+class MonitoringFastTracer(FastTracer):
+    """FastTracer implemented with sys.monitoring (PEP 669, Python 3.12+).
+
+    Unlike sys.settrace, monitoring events can be enabled per code object and switched off
+    per code location, so most of the program runs without any callbacks:
+
+    * LINE events are enabled only for the code objects containing breakpoints (found via
+      PY_START, which is switched off for each code object after its first call).
+      While resuming, the lines without breakpoints are switched off after first visit.
+    * While stepping, LINE events are enabled for all code (step into) or for the code of
+      the frames on the stack (step over, step out). Uninteresting lines get switched off.
+    * PY_RETURN is enabled only for the code of the frames on the stack, because only
+      these returns need to be noticed.
+
+    Switched off locations are switched on again for each new command.
+
+    FastTracer gets events only from the frames, which it didn't skip when they were
+    entered (see _should_skip_frame). In order to stop at the same places, the frames
+    which FastTracer would trace are remembered (see _is_traced_frame) and events from other
+    frames are ignored.
+    """
+
+    def __init__(self, backend, original_cmd):
+        self._monitoring_active = False
+        self._local_events = {}
+        self._thread_id = threading.get_ident()
+        # frames entered while the command didn't allow skipping them (id -> frame)
+        self._traced_frames = {}
+        super().__init__(backend, original_cmd)
+
+    def _start_tracing(self):
+        monitoring = sys.monitoring
+        tool_id = monitoring.DEBUGGER_ID
+        if monitoring.get_tool(tool_id) is not None:
+            logger.warning(
+                "Debugger id is used by %r, using sys.settrace", monitoring.get_tool(tool_id)
+            )
+            super()._start_tracing()
+            return
+
+        monitoring.use_tool_id(tool_id, "thonny")
+        events = monitoring.events
+        monitoring.register_callback(tool_id, events.PY_START, self._monitor_py_start)
+        monitoring.register_callback(tool_id, events.PY_RESUME, self._monitor_py_start)
+        monitoring.register_callback(tool_id, events.LINE, self._monitor_line)
+        monitoring.register_callback(tool_id, events.RAISE, self._monitor_raise)
+        for event in [events.PY_RETURN, events.PY_YIELD, events.PY_UNWIND]:
+            monitoring.register_callback(tool_id, event, self._monitor_return)
+
+        self._monitoring_active = True
+        self._update_monitored_events(None)
+
+    def _stop_tracing(self):
+        if not self._monitoring_active:
+            super()._stop_tracing()
+            return
+
+        self._monitoring_active = False
+        monitoring = sys.monitoring
+        tool_id = monitoring.DEBUGGER_ID
+        monitoring.set_events(tool_id, monitoring.events.NO_EVENTS)
+        self._clear_local_events()
+        for event in self._get_used_events():
+            monitoring.register_callback(tool_id, event, None)
+        monitoring.free_tool_id(tool_id)
+        self._traced_frames = {}
+
+    def _initialize_new_command(self, current_frame):
+        self._remember_traced_frames(current_frame)
+        super()._initialize_new_command(current_frame)
+        if self._monitoring_active:
+            self._update_monitored_events(current_frame)
+
+    def _remember_traced_frames(self, current_frame):
+        # FastTracer keeps tracing these frames even if their breakpoints get removed
+        traced_frames = {}
+        frame = current_frame
+        while frame is not None:
+            if self._is_traced_frame(frame):
+                traced_frames[id(frame)] = frame
+            frame = frame.f_back
+
+        # suspended generators keep their tracing as well
+        for frame_id, frame in self._traced_frames.items():
+            if frame.f_code.co_flags & _CO_WEIRDO:
+                traced_frames[frame_id] = frame
+
+        self._traced_frames = traced_frames
+
+    def _is_traced_frame(self, frame):
+        return (
+            self._traced_frames.get(id(frame)) is frame
+            or self._is_interesting_frame(frame)
+            and bool(self._get_breakpoints_in_code(frame.f_code))
+        )
+
+    def _get_used_events(self):
+        events = sys.monitoring.events
+        return [
+            events.PY_START,
+            events.PY_RESUME,
+            events.LINE,
+            events.RAISE,
+            events.PY_RETURN,
+            events.PY_YIELD,
+            events.PY_UNWIND,
+        ]
+
+    def _update_monitored_events(self, current_frame):
+        monitoring = sys.monitoring
+        events = monitoring.events
+        command_name = self._current_command.name
+
+        global_events = events.PY_START | events.PY_RESUME
+        if command_name == "step_into":
+            global_events |= events.LINE
+        if command_name in ["step_into", "step_over"]:
+            global_events |= events.RAISE
+        if command_name != "resume":
+            # PY_UNWIND can't be enabled per code object
+            global_events |= events.PY_UNWIND
+        monitoring.set_events(monitoring.DEBUGGER_ID, global_events)
+
+        self._clear_local_events()
+        frame = current_frame
+        while frame is not None:
+            if self._is_traced_frame(frame):
+                code_events = events.PY_RETURN | events.PY_YIELD
+                if command_name in ["step_over", "step_out"] or self._get_breakpoints_in_code(
+                    frame.f_code
+                ):
+                    code_events |= events.LINE
+                self._add_local_events(frame.f_code, code_events)
+            frame = frame.f_back
+
+        # code objects with breakpoints get discovered again
+        monitoring.restart_events()
+
+    def _add_local_events(self, code, events):
+        events |= self._local_events.get(code, 0)
+        sys.monitoring.set_local_events(sys.monitoring.DEBUGGER_ID, code, events)
+        self._local_events[code] = events
+
+    def _clear_local_events(self):
+        for code in self._local_events:
+            sys.monitoring.set_local_events(
+                sys.monitoring.DEBUGGER_ID, code, sys.monitoring.events.NO_EVENTS
+            )
+        self._local_events = {}
+
+    def _monitor_py_start(self, code, instruction_offset):
+        if threading.get_ident() != self._thread_id:
+            # switching off would hide this code from the debugged thread as well
+            return None
+
+        frame = sys._getframe(1)
+        if not self._should_skip_frame(frame, "call") and not (
+            self._current_command.name == "step_over" and not self._current_command.breakpoints
+        ):
+            # same decision as in FastTracer._trace
+            self._traced_frames[id(frame)] = frame
+
+        if self._get_breakpoints_in_code(code) and self._is_interesting_frame(frame):
+            self._add_local_events(code, sys.monitoring.events.LINE)
+
+        return sys.monitoring.DISABLE
+
+    def _monitor_line(self, code, line_number):
+        if threading.get_ident() != self._thread_id:
+            return None
+
+        frame = sys._getframe(1)
+        if not self._is_interesting_frame(frame):
+            return sys.monitoring.DISABLE
+
+        if self._current_command.name == "resume" and not self._at_a_breakpoint(frame):
+            return sys.monitoring.DISABLE
+
+        if self._backend.is_doing_io() or not self._is_traced_frame(frame):
+            # other frames of the same code may need this line
+            return None
+
+        self._check_store_main_frame_id(frame)
+        self._fresh_exception = None
+
+        if self._command_completion_handler(frame):
+            self._report_current_state(frame)
+            self._fetch_next_debugger_command(frame)
+
+        return None
+
+    def _monitor_raise(self, code, instruction_offset, exception):
+        if threading.get_ident() != self._thread_id:
+            return
+
+        frame = sys._getframe(1)
+        if not self._is_traced_frame(frame) or self._backend.is_doing_io():
+            return
+
+        arg = (type(exception), exception, exception.__traceback__)
+        if self._is_interesting_exception(frame, arg):
+            self._fresh_exception = arg
+            self._register_affected_frame(exception, frame)
+            # UI doesn't know about separate exception events
+            self._report_current_state(frame)
+            self._fetch_next_debugger_command(frame)
+
+    def _monitor_return(self, code, instruction_offset, retval_or_exception):
+        if threading.get_ident() != self._thread_id:
+            return
+
+        frame = sys._getframe(1)
+        if not self._is_traced_frame(frame):
+            return
+
+        frame_id = id(frame)
+        self._fresh_exception = None
+        if frame_id == self._current_command["frame_id"]:
+            self._command_frame_returned = True
+        self._check_notify_return(frame_id)
+
+
 class NiceTracer(Tracer):
     def __init__(self, backend, original_cmd):
         super().__init__(backend, original_cmd)
         self._instrumented_files = set()
         self._install_marker_functions()
         self._custom_stack = []
-        self._saved_states = []
+        self._saved_states = StateHistory(
+            self._backend.get_option("debugger.history_max_bytes", StateHistory.default_max_bytes)
+        )
         self._current_state_index = 0
 
         from collections import Counter
 
         self._fulltags = Counter()
         self._nodes = {}
+        self._file_nodes = {}
+        self._node_id_base = 0
 
     def _breakpointhook(self, *args, **kw):
         self._report_state(len(self._saved_states) - 1)
@@ -465,6 +714,10 @@ class NiceTracer(Tracer):
 
         root = ast.parse(source, filename, mode)
 
+        # node ids get baked into the code, so they need to be unique among cached files
+        self._file_nodes = {}
+        self._node_id_base = int(_get_instrumentation_key(source, filename, mode)[:12], 16) << 24
+
         ast_utils.mark_text_ranges(root, source)
         self._tag_nodes(root)
         self._insert_expression_markers(root)
@@ -474,6 +727,25 @@ class NiceTracer(Tracer):
 
         return root
 
+    def _compile_source(self, source, filename, mode, ast_postprocessors=()):
+        if ast_postprocessors:
+            # result depends on the plug-ins
+            return super()._compile_source(source, filename, mode, ast_postprocessors)
+
+        cache_path = os.path.join(
+            INSTRUMENTATION_CACHE_DIR, _get_instrumentation_key(source, filename, mode) + ".pickle"
+        )
+        cached = _load_instrumented_code(cache_path)
+        if cached is not None:
+            code, nodes = cached
+            self._nodes.update(nodes)
+            self._instrumented_files.add(filename)
+            return code
+
+        code = super()._compile_source(source, filename, mode)
+        _store_instrumented_code(cache_path, code, self._file_nodes)
+        return code
+
     def _should_skip_frame(self, frame, event):
         # nice tracer can't skip any of the frames which need to be
         # shown in the stacktrace
@@ -695,6 +967,7 @@ class NiceTracer(Tracer):
             exception_info = prev_state["exception_info"]
             # share the stack ...
             stack = prev_state["stack"]
+            full_stack = None
             # ... but override certain things
             active_frame_overrides = {
                 "event": custom_frame.event,
@@ -706,7 +979,8 @@ class NiceTracer(Tracer):
             }
         else:
             # make full export
-            stack = self._export_stack()
+            stack = None
+            full_stack = self._export_stack()
             exception_info = self._export_exception_info()
             active_frame_overrides = {}
 
@@ -724,7 +998,7 @@ class NiceTracer(Tracer):
             "exception_info": exception_info,
         }
 
-        self._saved_states.append(msg)
+        self._saved_states.append(msg, full_stack)
 
     def _respond_to_commands(self):
         """Tries to respond to client commands with states collected so far.
@@ -751,8 +1025,8 @@ class NiceTracer(Tracer):
                     self._fetch_next_debugger_command(frame)
 
             if self._current_command.name == "step_back":
-                if self._current_state_index == 0:
-                    # Already in first state. Remain in this loop
+                if self._current_state_index == self._saved_states.first_index:
+                    # Already in first (remaining) state. Remain in this loop
                     pass
                 else:
                     assert self._current_state_index > 0
@@ -775,12 +1049,12 @@ class NiceTracer(Tracer):
             # was not the right choice. See tag_nodes for more.)
             # Re-exporting reduces the harm by showing correct data at least
             # for present states.
-            self._saved_states[state_index]["stack"] = self._export_stack()
+            self._saved_states.replace_last_stack(self._export_stack())
 
         # need to make a copy for applying overrides
         # and removing helper fields without modifying original
         state = self._saved_states[state_index].copy()
-        state["stack"] = state["stack"].copy()
+        state["stack"] = self._saved_states.get_stack(state_index)
 
         state["in_present"] = in_present
         if not in_present:
@@ -920,11 +1194,11 @@ class NiceTracer(Tracer):
         # Check if the selected message has been previously sent to front-end
         return (
             self._saved_states[self._current_state_index]["in_client_log"]
-            or self._current_state_index == 0
+            or self._current_state_index == self._saved_states.first_index
         )
 
     def _cmd_step_out_completed(self, frame, cmd):
-        if self._current_state_index == 0:
+        if self._current_state_index == self._saved_states.first_index:
             return False
 
         if frame.event == "after_statement":
@@ -977,13 +1251,14 @@ class NiceTracer(Tracer):
 
     def _export_stack(self):
         result = []
+        self._repr_cache.start_step()
 
         exported_globals_per_module = {}
 
         def export_globals(module_name, frame):
             if module_name not in exported_globals_per_module:
                 exported_globals_per_module[module_name] = self._backend.export_variables(
-                    frame.f_globals
+                    frame.f_globals, self._repr_cache
                 )
             return exported_globals_per_module[module_name]
 
@@ -1000,7 +1275,7 @@ class NiceTracer(Tracer):
                     locals=(
                         None
                         if system_frame.f_locals is system_frame.f_globals
-                        else self._backend.export_variables(system_frame.f_locals)
+                        else self._backend.export_variables(system_frame.f_locals, self._repr_cache)
                     ),
                     globals=export_globals(module_name, system_frame),
                     event=custom_frame.event,
@@ -1419,23 +1694,236 @@ class NiceTracer(Tracer):
 
     def _export_node(self, node):
         assert isinstance(node, (ast.expr, ast.stmt))
-        node_id = id(node)
+        node_id = self._node_id_base + len(self._file_nodes)
+        self._file_nodes[node_id] = node
         self._nodes[node_id] = node
         return ast.Num(node_id)
 
     def _debug(self, *args):
         logger.debug("TRACER: " + str(args))
 
+    def get_history_stats(self):
+        return self._saved_states.get_stats()
+
     def _execute_prepared_user_code(self, statements, global_vars):
         try:
             return Tracer._execute_prepared_user_code(self, statements, global_vars)
         finally:
-            """
-            from thonny.misc_utils import _win_get_used_memory
-            print("Memory:", _win_get_used_memory() / 1024 / 1024)
-            print("States:", len(self._saved_states))
-            print(self._fulltags.most_common())
-            """
+            logger.info("State history: %s", self._saved_states.get_stats())
+
+
+# (is_checkpoint, changed_scopes, removed_scope_keys)
+_UNCHANGED_VARIABLES = (False, {}, ())
+
+
+class StateHistory:
+    """Program states saved by NiceTracer, for stepping back.
+
+    A state is the message dict prepared by NiceTracer._save_current_state. Its "stack"
+    keeps only the frames and focuses (TempFrameInfos without locals and globals).
+    The variables are stored separately as differences from the previous state, with a
+    full copy (checkpoint) after every checkpoint_interval states. When the estimated
+    size exceeds max_bytes, the oldest checkpoint interval gets dropped, so the step back
+    depth shrinks instead of memory use growing.
+
+    Indices are counted from the start of the program, ie. they don't change when
+    oldest states get dropped. len() gives the index after the last state.
+    """
+
+    checkpoint_interval = 100
+    default_max_bytes = 256 * 1024 * 1024
+
+    # rough sizes of the objects behind a state, a frame and a variable
+    _state_overhead = 1000
+    _frame_overhead = 300
+    _variable_overhead = 150
+
+    def __init__(self, max_bytes=default_max_bytes):
+        self.max_bytes = max_bytes
+        self.first_index = 0
+        self._states = []
+        self._deltas = []
+        self._sizes = []
+        self._total_bytes = 0
+        self._dropped_count = 0
+        self._scope_keys = []
+        self._last_scopes = {}
+        self._last_base_scopes = {}
+
+    def __len__(self):
+        return self.first_index + len(self._states)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < self.first_index:
+            raise IndexError("State %d has been dropped" % index)
+        return self._states[index - self.first_index]
+
+    def append(self, state, full_stack=None) -> None:
+        """Adds a state. full_stack=None means variables haven't changed."""
+        is_checkpoint = len(self) % self.checkpoint_interval == 0
+        if full_stack is None:
+            assert self._states, "First state needs variables"
+            scope_keys = self._scope_keys[-1]
+            new_scopes = self._last_scopes
+        else:
+            scope_keys, new_scopes = self._split_stack(full_stack)
+            state["stack"] = [frame._replace(locals=None, globals=None) for frame in full_stack]
+
+        if is_checkpoint:
+            base_scopes = {}
+        else:
+            base_scopes = self._last_scopes
+
+        if full_stack is None and not is_checkpoint:
+            delta = _UNCHANGED_VARIABLES
+        else:
+            delta = self._create_delta(is_checkpoint, base_scopes, new_scopes)
+
+        self._states.append(state)
+        self._scope_keys.append(scope_keys)
+        self._deltas.append(delta)
+        size = self._estimate_size(state, delta)
+        self._sizes.append(size)
+        self._total_bytes += size
+        self._last_base_scopes = base_scopes
+        self._last_scopes = new_scopes
+
+        if self._total_bytes > self.max_bytes:
+            self._drop_old_states()
+
+    def replace_last_stack(self, full_stack) -> None:
+        """Replaces the variables of the newest state with a fresh export"""
+        scope_keys, new_scopes = self._split_stack(full_stack)
+        is_checkpoint = self._deltas[-1][0]
+        delta = self._create_delta(is_checkpoint, self._last_base_scopes, new_scopes)
+
+        state = self._states[-1]
+        state["stack"] = [frame._replace(locals=None, globals=None) for frame in full_stack]
+        self._scope_keys[-1] = scope_keys
+        self._deltas[-1] = delta
+        self._total_bytes -= self._sizes[-1]
+        self._sizes[-1] = self._estimate_size(state, delta)
+        self._total_bytes += self._sizes[-1]
+        self._last_scopes = new_scopes
+
+    def get_stack(self, index):
+        """Returns the stack of given state together with locals and globals"""
+        if index < 0:
+            index += len(self)
+        pos = index - self.first_index
+        assert 0 <= pos < len(self._states)
+
+        if pos == len(self._states) - 1:
+            scopes = self._last_scopes
+        else:
+            scopes = self._restore_scopes(pos)
+
+        return [
+            frame._replace(
+                locals=None if locals_key is None else scopes[locals_key],
+                globals=scopes[globals_key],
+            )
+            for frame, (locals_key, globals_key) in zip(
+                self._states[pos]["stack"], self._scope_keys[pos]
+            )
+        ]
+
+    def _restore_scopes(self, pos):
+        checkpoint_pos = pos
+        while not self._deltas[checkpoint_pos][0]:
+            checkpoint_pos -= 1
+
+        scopes = {}
+        for delta_pos in range(checkpoint_pos, pos + 1):
+            _, changed_scopes, removed_scope_keys = self._deltas[delta_pos]
+            for key in removed_scope_keys:
+                del scopes[key]
+            for key, (changed, removed_names) in changed_scopes.items():
+                # stored dicts are shared between states, so build new ones
+                scope = scopes.setdefault(key, {})
+                scope.update(changed)
+                for name in removed_names:
+                    del scope[name]
+
+        return scopes
+
+    def get_stats(self):
+        return {
+            "state_count": len(self._states),
+            "first_index": self.first_index,
+            "checkpoint_count": sum(1 for delta in self._deltas if delta[0]),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "dropped_count": self._dropped_count,
+        }
+
+    def _split_stack(self, full_stack):
+        scope_keys = []
+        scopes = {}
+        for frame in full_stack:
+            system_frame = frame.system_frame
+            globals_key = ("globals", system_frame.f_globals.get("__name__", None))
+            scopes[globals_key] = frame.globals
+            if frame.locals is None:
+                locals_key = None
+            else:
+                # frame object is hashed by identity and kept alive by the state anyway
+                locals_key = ("locals", system_frame)
+                scopes[locals_key] = frame.locals
+            scope_keys.append((locals_key, globals_key))
+
+        return tuple(scope_keys), scopes
+
+    def _create_delta(self, is_checkpoint, base_scopes, new_scopes):
+        changed_scopes = {}
+        for key, new in new_scopes.items():
+            old = base_scopes.get(key)
+            if old is None:
+                changed_scopes[key] = (new, ())
+            elif old is not new:
+                changed = {name: value for name, value in new.items() if old.get(name) != value}
+                removed_names = tuple(name for name in old if name not in new)
+                if changed or removed_names:
+                    changed_scopes[key] = (changed, removed_names)
+
+        removed_scope_keys = tuple(key for key in base_scopes if key not in new_scopes)
+        return is_checkpoint, changed_scopes, removed_scope_keys
+
+    def _estimate_size(self, state, delta):
+        size = self._state_overhead
+        if delta is not _UNCHANGED_VARIABLES:
+            size += self._frame_overhead * len(state["stack"])
+        for changed, removed_names in delta[1].values():
+            for name, value in changed.items():
+                size += self._variable_overhead + len(name) + len(value.repr)
+            size += self._variable_overhead * len(removed_names)
+
+        for _, value in state["active_frame_overrides"].get("current_evaluations", []):
+            size += self._variable_overhead + len(value.repr)
+
+        return size
+
+    def _drop_old_states(self):
+        while self._total_bytes > self.max_bytes:
+            # drop until the next checkpoint, but always keep the newest checkpoint
+            next_checkpoint_pos = None
+            for pos in range(1, len(self._deltas)):
+                if self._deltas[pos][0]:
+                    next_checkpoint_pos = pos
+                    break
+
+            if next_checkpoint_pos is None:
+                return
+
+            self._total_bytes -= sum(self._sizes[:next_checkpoint_pos])
+            del self._states[:next_checkpoint_pos]
+            del self._deltas[:next_checkpoint_pos]
+            del self._sizes[:next_checkpoint_pos]
+            del self._scope_keys[:next_checkpoint_pos]
+            self.first_index += next_checkpoint_pos
+            self._dropped_count += next_checkpoint_pos
 
 
 class FancySourceFileLoader(SourceFileLoader):
@@ -1449,12 +1937,98 @@ class FancySourceFileLoader(SourceFileLoader):
         old_tracer = sys.gettrace()
         sys.settrace(None)
         try:
-            root = self._tracer._prepare_ast(data, path, "exec")
-            return super().source_to_code(root, path)
+            # asttokens needs text
+            return self._tracer._compile_source(decode_source(data), path, "exec")
         finally:
             sys.settrace(old_tracer)
 
 
+class CachedNode:
+    """The parts of an instrumented AST node which NiceTracer needs while running"""
+
+    def __init__(self, node, converted_nodes):
+        converted_nodes[id(node)] = self
+        # Module has no position
+        self.lineno = getattr(node, "lineno", None)
+        self.col_offset = getattr(node, "col_offset", None)
+        self.end_lineno = getattr(node, "end_lineno", None)
+        self.end_col_offset = getattr(node, "end_col_offset", None)
+        self.tags = getattr(node, "tags", set())
+
+        if hasattr(node, "parent_node"):
+            parent = converted_nodes.get(id(node.parent_node))
+            if parent is None:
+                parent = CachedNode(node.parent_node, converted_nodes)
+            self.parent_node = parent
+
+        if hasattr(node, "parent_statement_focus"):
+            self.parent_statement_focus = node.parent_statement_focus
+
+
+def _get_instrumentation_key(source: Union[str, bytes], filename: str, mode: str) -> str:
+    if isinstance(source, str):
+        source = source.encode("utf-8", errors="surrogatepass")
+
+    hasher = hashlib.sha256(source)
+    for part in [
+        filename,
+        mode,
+        sys.version,
+        str(sys.flags.optimize),
+        thonny.get_version(),
+        str(INSTRUMENTATION_FORMAT),
+    ]:
+        hasher.update(b"\0" + part.encode("utf-8", errors="surrogatepass"))
+    return hasher.hexdigest()
+
+
+def _load_instrumented_code(path):
+    try:
+        with open(path, "rb") as fp:
+            data = pickle.load(fp)
+        return marshal.loads(data["code"]), data["nodes"]
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("Could not load instrumented code from %s", path, exc_info=True)
+        return None
+
+
+def _store_instrumented_code(path, code, nodes) -> None:
+    converted_nodes = {}
+    data = {
+        "code": marshal.dumps(code),
+        "nodes": {
+            node_id: converted_nodes.get(id(node)) or CachedNode(node, converted_nodes)
+            for node_id, node in nodes.items()
+        },
+    }
+
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with open(fd, "wb") as fp:
+            pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        _prune_instrumented_code_cache(cache_dir)
+    except Exception:
+        logger.warning("Could not store instrumented code to %s", path, exc_info=True)
+
+
+def _prune_instrumented_code_cache(cache_dir) -> None:
+    entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(".pickle")]
+    if len(entries) <= INSTRUMENTATION_CACHE_MAX_FILES:
+        return
+
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[: len(entries) - INSTRUMENTATION_CACHE_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
 class CustomStackFrame:
     def __init__(self, frame, event, focus=None):
         self.system_frame = frame
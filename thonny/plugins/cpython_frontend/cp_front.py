@@ -69,6 +69,10 @@ class LocalCPythonProxy(SubprocessProxy):
         # Can't run in isolated mode as it would hide user site-packages
         return False
 
+    def _get_standby_backend_count(self) -> int:
+        # Backend gets restarted before each Run
+        return get_workbench().get_option("run.standby_backends")
+
     def _store_state_info(self, msg):
         super()._store_state_info(msg)
 
@@ -9,12 +9,12 @@ from thonny import get_runner, get_workbench
 from thonny.common import InlineCommand
 from thonny.languages import tr
 from thonny.memory import MAX_REPR_LENGTH_IN_GRID, MemoryFrame, format_object_id, parse_object_id
-from thonny.misc_utils import shorten_repr
+from thonny.misc_utils import shorten_repr, sizeof_fmt
 
 
 class HeapView(MemoryFrame):
     def __init__(self, master):
-        MemoryFrame.__init__(self, master, ("id", "value"))
+        MemoryFrame.__init__(self, master, ("id", "value"), show_statusbar=True)
 
         self.tree.column("id", width=100, anchor=tk.W, stretch=False)
         self.tree.column("value", width=150, anchor=tk.W, stretch=True)
@@ -22,7 +22,16 @@ class HeapView(MemoryFrame):
         self.tree.heading("id", text=tr("ID"), anchor=tk.W)
         self.tree.heading("value", text=tr("Value"), anchor=tk.W)
 
+        self.stats_label = ttk.Label(self.statusbar, text="", anchor="w")
+        self.stats_label.grid(row=0, column=0, sticky="w")
+        self.prune_button = ttk.Button(
+            self.statusbar, text=tr("Prune"), command=self._prune_heap, style="Toolbutton"
+        )
+        self.prune_button.grid(row=0, column=1, sticky="e")
+        self.statusbar.columnconfigure(0, weight=1)
+
         get_workbench().bind("get_heap_response", self._handle_heap_event, True)
+        get_workbench().bind("prune_heap_response", self._handle_prune_event, True)
 
         get_workbench().bind("DebuggerResponse", self._request_heap_data, True)
         get_workbench().bind("ToplevelResponse", self._request_heap_data, True)
@@ -71,6 +80,33 @@ class HeapView(MemoryFrame):
         if self.winfo_ismapped():
             if hasattr(msg, "heap"):
                 self._update_data(msg.heap)
+            self._update_stats(msg.get("heap_stats"))
+
+    def _update_stats(self, stats):
+        if stats is None:
+            # back-end doesn't keep statistics
+            self.stats_label.configure(text="")
+            self.prune_button.grid_remove()
+            return
+
+        self.stats_label.configure(
+            text=tr("Kept alive: %d (%s), weak: %d, pinned: %d, dropped: %d")
+            % (
+                stats["recent_count"],
+                sizeof_fmt(stats["recent_bytes"]),
+                stats["weak_count"],
+                stats["pinned_count"],
+                stats["evicted_count"],
+            )
+        )
+        self.prune_button.grid()
+
+    def _prune_heap(self):
+        if get_runner() is not None:
+            get_runner().send_command(InlineCommand("prune_heap"))
+
+    def _handle_prune_event(self, msg):
+        self._request_heap_data()
 
     def _on_map(self, event):
         self.info_label.grid(row=0, column=1005)
@@ -15,6 +15,9 @@ from thonny.ui_utils import ems_to_pixels
 
 logger = logging.getLogger(__name__)
 
+# same as back-end's page size
+ELEMENTS_PAGE_SIZE = 500
+
 
 class ObjectInspector(ttk.Frame):
     def __init__(self, master):
@@ -144,6 +147,7 @@ class ObjectInspector(ttk.Frame):
                 ImageInspector(self.content_page),
                 IntInspector(self.content_page),
                 FloatInspector(self.content_page),
+                ArraySummaryInspector(self.content_page),
                 ReprInspector(self.content_page),  # fallback content inspector
             ]
         )
@@ -496,6 +500,29 @@ class FloatInspector(TextFrame, ContentInspector):
         self.text.set_content(content)
 
 
+class ArraySummaryInspector(TextFrame, ContentInspector):
+    """NumPy arrays and pandas objects are described by the back-end, not exported element-wise"""
+
+    def __init__(self, master):
+        ContentInspector.__init__(self, master)
+        TextFrame.__init__(self, master, read_only=True, wrap="none")
+
+    def applies_to(self, object_info):
+        return "array_summary" in object_info
+
+    def set_object_info(self, object_info):
+        summary = object_info["array_summary"]
+        content = "shape: %s\nsize: %d\ndtype: %s\n\n%s" % (
+            summary["shape"],
+            summary["size"],
+            summary["dtype"],
+            summary["head"],
+        )
+        if "tail" in summary:
+            content += "\n...\n" + summary["tail"]
+        self.text.set_content(content)
+
+
 class ReprInspector(TextFrame, ContentInspector):
     def __init__(self, master):
         ContentInspector.__init__(self, master)
@@ -522,7 +549,74 @@ class ReprInspector(TextFrame, ContentInspector):
         """
 
 
-class ElementsInspector(thonny.memory.MemoryFrame, ContentInspector):
+class PagedContentInspector(ContentInspector):
+    """Shows elements or entries of a container, which the back-end may send in pages.
+
+    Next page gets requested when the tree is scrolled near its end."""
+
+    items_key = None  # type: str
+
+    def _init_paging(self):
+        self.context_id = None
+        self._loaded_count = 0
+        self._total_count = 0
+        self._page_requested = False
+        self.tree.configure(yscrollcommand=self._on_tree_yscroll)
+        get_workbench().bind("get_object_elements_response", self._handle_page_response, True)
+
+    def _show_first_page(self, object_info):
+        items = object_info[self.items_key]
+        self.context_id = object_info["id"]
+        self._loaded_count = 0
+        # MicroPython back-end sends all items at once
+        self._total_count = object_info.get(self.items_key + "_total", len(items))
+        self._page_requested = False
+        self._clear_tree()
+        self._add_page(items)
+
+    def _add_page(self, items):
+        self._add_rows(items, self._loaded_count)
+        self._loaded_count += len(items)
+        if self._loaded_count < self._total_count:
+            self.len_label.configure(
+                text=" len: %d (%d shown)" % (self._total_count, self._loaded_count)
+            )
+        else:
+            self.len_label.configure(text=" len: %d" % self._total_count)
+
+    def _add_rows(self, items, offset):
+        raise NotImplementedError()
+
+    def _on_tree_yscroll(self, first, last):
+        self.vert_scrollbar.set(first, last)
+        if (
+            float(last) >= 0.9
+            and self._loaded_count < self._total_count
+            and not self._page_requested
+            and get_runner() is not None
+        ):
+            self._page_requested = True
+            get_runner().send_command(
+                InlineCommand(
+                    "get_object_elements",
+                    object_id=self.context_id,
+                    offset=self._loaded_count,
+                    limit=ELEMENTS_PAGE_SIZE,
+                )
+            )
+
+    def _handle_page_response(self, msg):
+        if msg.get("id") != self.context_id:
+            return
+
+        self._page_requested = False
+        if msg.get(self.items_key + "_offset") == self._loaded_count:
+            self._add_page(msg[self.items_key])
+
+
+class ElementsInspector(thonny.memory.MemoryFrame, PagedContentInspector):
+    items_key = "elements"
+
     def __init__(self, master):
         ContentInspector.__init__(self, master)
         thonny.memory.MemoryFrame.__init__(
@@ -544,6 +638,7 @@ class ElementsInspector(thonny.memory.MemoryFrame, ContentInspector):
 
         self.elements_have_indices = None
         self.update_memory_model()
+        self._init_paging()
 
         get_workbench().bind("ShowView", self.update_memory_model, True)
         get_workbench().bind("HideView", self.update_memory_model, True)
@@ -577,12 +672,10 @@ class ElementsInspector(thonny.memory.MemoryFrame, ContentInspector):
 
         self.elements_have_indices = object_info["type"] in (repr(tuple), repr(list))
         self._update_columns()
-        self.context_id = object_info["id"]
+        self._show_first_page(object_info)
 
-        self._clear_tree()
-        index = 0
-        # TODO: don't show too big number of elements
-        for element in object_info["elements"]:
+    def _add_rows(self, elements, offset):
+        for index, element in enumerate(elements, offset):
             node_id = self.tree.insert("", "end")
             if self.elements_have_indices:
                 self.tree.set(node_id, "index", index)
@@ -593,13 +686,11 @@ class ElementsInspector(thonny.memory.MemoryFrame, ContentInspector):
             self.tree.set(
                 node_id, "value", shorten_repr(element.repr, thonny.memory.MAX_REPR_LENGTH_IN_GRID)
             )
-            index += 1
 
-        count = len(object_info["elements"])
-        self.len_label.configure(text=" len: %d" % count)
 
+class DictInspector(thonny.memory.MemoryFrame, PagedContentInspector):
+    items_key = "entries"
 
-class DictInspector(thonny.memory.MemoryFrame, ContentInspector):
     def __init__(self, master):
         ContentInspector.__init__(self, master)
         thonny.memory.MemoryFrame.__init__(
@@ -622,6 +713,7 @@ class DictInspector(thonny.memory.MemoryFrame, ContentInspector):
         self.statusbar.columnconfigure(0, weight=1)
 
         self.update_memory_model()
+        self._init_paging()
 
     def update_memory_model(self, event=None):
         if get_workbench().in_heap_mode():
@@ -641,11 +733,11 @@ class DictInspector(thonny.memory.MemoryFrame, ContentInspector):
 
     def set_object_info(self, object_info):
         assert "entries" in object_info
-        self.context_id = object_info["id"]
+        self._show_first_page(object_info)
+        self.update_memory_model()
 
-        self._clear_tree()
-        # TODO: don't show too big number of elements
-        for key, value in object_info["entries"]:
+    def _add_rows(self, entries, offset):
+        for key, value in entries:
             node_id = self.tree.insert("", "end")
             self.tree.set(node_id, "key_id", thonny.memory.format_object_id(key.id))
             self.tree.set(
@@ -656,10 +748,6 @@ class DictInspector(thonny.memory.MemoryFrame, ContentInspector):
                 node_id, "value", shorten_repr(value.repr, thonny.memory.MAX_REPR_LENGTH_IN_GRID)
             )
 
-        count = len(object_info["entries"])
-        self.len_label.configure(text=" len: %d" % count)
-        self.update_memory_model()
-
 
 class ImageInspector(ContentInspector, tk.Frame):
     def __init__(self, master):
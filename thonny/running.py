@@ -7,19 +7,22 @@ Commands get executed via shell, this way the command line in the
 shell becomes kind of title for the execution.
 
 """
+
 import collections
+import functools
 import os.path
 import re
 import shlex
 import subprocess
 import sys
+import tempfile
 import time
 import tkinter as tk
 import traceback
 import warnings
 from abc import ABC, abstractmethod
 from logging import getLogger
-from threading import Thread
+from threading import Condition, Lock, Thread, Timer
 from time import sleep
 from tkinter import messagebox, ttk
 from typing import Any, Callable, Dict, List, Optional, Set, Union  # @UnusedImport; @UnusedImport
@@ -35,7 +38,11 @@ from thonny import (
     report_time,
 )
 from thonny.common import (
+    FRAME_MARKER,
+    FRAMED_WIRE_FORMAT,
+    LEGACY_WIRE_FORMAT,
     PROCESS_ACK,
+    WIRE_FORMATS_ENV_VAR,
     BackendEvent,
     CommandToBackend,
     DebuggerCommand,
@@ -79,6 +86,22 @@ logger = getLogger(__name__)
 
 WINDOWS_EXE = "python.exe"
 OUTPUT_MERGE_THRESHOLD = 1000
+# seconds the UI thread may spend on backend messages before handling user actions again
+MESSAGE_BATCH_TIME_BUDGET = 0.03
+# milliseconds between termination checks of a backend, which wakes the runner itself
+# (the wakeup may be missed, eg. when a grandchild process keeps stdout of the backend open)
+TERMINATION_CHECK_INTERVAL = 1000
+# reader thread merges consecutive outputs up to this size
+OUTPUT_CHUNK_SIZE = 16 * 1024
+# runaway output protection, see OutputFirehose
+FIREHOSE_WINDOW = 0.5
+# number of consecutive windows over the threshold, which activate the protection
+FIREHOSE_ACTIVATION_WINDOWS = 3
+FIREHOSE_FLUSH_INTERVAL = 0.2
+FIREHOSE_TAIL_SIZE = 4096
+FIREHOSE_MAX_SPOOL_SIZE = 256 * 1024 * 1024
+# milliseconds to wait after backend start before starting standby backends
+STANDBY_BACKEND_DELAY = 500
 
 RUN_COMMAND_LABEL = ""  # init later when gettext is ready
 RUN_COMMAND_CAPTION = ""
@@ -134,12 +157,22 @@ class Runner:
         get_workbench().set_default("run.allow_running_unnamed_programs", True)
         get_workbench().set_default("run.auto_cd", True)
         get_workbench().set_default("run.warn_module_shadowing", True)
+        get_workbench().set_default("run.firehose_mode", True)
+        # characters per second
+        get_workbench().set_default("run.firehose_threshold", 500_000)
+        # number of pre-started backend processes for instant restart (0 to disable)
+        get_workbench().set_default("run.standby_backends", 1)
+        get_workbench().bind("WorkbenchClose", lambda event: _standby_pool.clear(), True)
 
         self._init_commands()
         self._state = "starting"
         self._proxy: Optional[BackendProxy] = None
         self._publishing_events = False
         self._polling_after_id = None
+        self._polling_for_termination = False
+        self._pulling_messages = False
+        self._message_wakeup = None  # type: Optional[UiWakeup]
+        self._proxy_wakes_runner = False
         self._postponed_commands = []  # type: List[CommandToBackend]
         self._last_accepted_backend_command = None
 
@@ -631,23 +664,60 @@ class Runner:
         return proxy and proxy.is_connected()
 
     def _poll_backend_messages(self) -> None:
-        """I chose polling instead of event_generate in listener thread,
-        because event_generate across threads is not reliable
+        """Processes available messages and decides when to look again.
+
+        Event_generate across threads is not reliable
         http://www.thecodingforums.com/threads/more-on-tk-event_generate-and-threads.359615/
+        therefore proxies which support it wake the runner up via UiWakeup. Then only
+        termination gets checked periodically. With other proxies (or where UiWakeup is not
+        supported) the runner keeps polling.
         """
         self._polling_after_id = None
-        if self._pull_backend_messages() is False:
+        self._polling_for_termination = False
+        self._pulling_messages = True
+        try:
+            result = self._pull_backend_messages()
+        finally:
+            self._pulling_messages = False
+
+        if result is False:
+            return
+
+        if result:
+            # Time budget ran out, let Tk handle user actions and redraw before next batch
+            self._polling_after_id = get_workbench().after(1, self._poll_backend_messages)
+        elif not self._proxy_wakes_runner or self._postponed_commands:
+            self._polling_after_id = get_workbench().after(20, self._poll_backend_messages)
+        else:
+            self._polling_for_termination = True
+            self._polling_after_id = get_workbench().after(
+                TERMINATION_CHECK_INTERVAL, self._poll_backend_messages
+            )
+
+    def _on_backend_message_wakeup(self) -> None:
+        if self._pulling_messages:
             return
 
-        self._polling_after_id = get_workbench().after(20, self._poll_backend_messages)
+        if self._polling_after_id is not None:
+            if not self._polling_for_termination:
+                # next batch is coming soon anyway
+                return
+            get_workbench().after_cancel(self._polling_after_id)
+            self._polling_after_id = None
+
+        self._poll_backend_messages()
 
     def _pull_backend_messages(self):
-        # Don't process too many messages in single batch, allow screen updates
+        """Returns False if backend terminated and True if some messages were left for next batch"""
+        # Don't spend too much time in single batch, allow screen updates
         # and user actions between batches.
         # Mostly relevant when backend prints a lot quickly.
-        msg_count = 0
-        max_msg_count = 10
-        while self._proxy is not None and msg_count < max_msg_count:
+        deadline = time.perf_counter() + MESSAGE_BATCH_TIME_BUDGET
+        while self._proxy is not None:
+            if time.perf_counter() > deadline:
+                self._send_postponed_commands()
+                return True
+
             try:
                 msg = self._proxy.fetch_next_message()
                 if not msg:
@@ -655,8 +725,6 @@ class Runner:
                 logger.debug(
                     "RUNNER GOT: %s, %s in state: %s", msg.event_type, msg, self.get_state()
                 )
-
-                msg_count += 1
             except BackendTerminatedError as exc:
                 self._handle_backend_termination(exc.returncode)
                 return False
@@ -730,6 +798,12 @@ class Runner:
         self._proxy = None
         self._proxy = backend_class(clean)
 
+        if self._message_wakeup is None:
+            self._message_wakeup = UiWakeup(get_workbench(), self._on_backend_message_wakeup)
+        self._proxy_wakes_runner = (
+            self._message_wakeup.is_supported()
+            and self._proxy.set_message_wakeup(self._message_wakeup.notify)
+        )
         self._poll_backend_messages()
 
         if not first:
@@ -832,6 +906,401 @@ class Runner:
         )
 
 
+class UiWakeup:
+    """Calls the handler in the UI thread soon after notify() has been called in any thread.
+
+    Uses a pipe watched by Tk, so the UI thread can sleep until something happens.
+    Not supported where Tk can't watch file descriptors (Windows)."""
+
+    def __init__(self, tk_widget, handler: Callable[[], None]) -> None:
+        self._tk = tk_widget.tk
+        self._handler = handler
+        self._pending = False
+        self._read_fd = None
+        self._write_fd = None
+
+        if os.name == "nt" or not hasattr(self._tk, "createfilehandler"):
+            return
+
+        try:
+            self._read_fd, self._write_fd = os.pipe()
+            os.set_blocking(self._read_fd, False)
+            os.set_blocking(self._write_fd, False)
+            self._tk.createfilehandler(self._read_fd, tk.READABLE, self._on_readable)
+        except Exception:
+            logger.warning("Could not create UI wakeup pipe", exc_info=True)
+            self.close()
+
+    def is_supported(self) -> bool:
+        return self._write_fd is not None
+
+    def notify(self) -> None:
+        if self._pending or self._write_fd is None:
+            # handler hasn't run since last notification, one byte in the pipe is enough
+            return
+
+        self._pending = True
+        try:
+            os.write(self._write_fd, b"\0")
+        except OSError:
+            # pipe full or closed
+            pass
+
+    def _on_readable(self, fd, mask) -> None:
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except OSError:
+            # drained
+            pass
+
+        # must be cleared before the handler looks for news
+        self._pending = False
+        self._handler()
+
+    def close(self) -> None:
+        if self._read_fd is not None:
+            try:
+                self._tk.deletefilehandler(self._read_fd)
+            except Exception:
+                pass
+            os.close(self._read_fd)
+            self._read_fd = None
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+
+
+class BackendMessageQueue(collections.deque):
+    """Messages from the reader threads of a SubprocessProxy to the UI thread.
+
+    Appending calls wakeup. Reader thread can wait until the UI thread has caught up."""
+
+    def __init__(self, wakeup: Optional[Callable[[], None]] = None) -> None:
+        super().__init__()
+        self.wakeup = wakeup
+        self._lock = Lock()
+        self._shrunk = Condition()
+        self._wanted_length = None
+
+    def append(self, msg) -> None:
+        with self._lock:
+            super().append(msg)
+        self.notify()
+
+    def append_output(self, msg: BackendEvent, max_size: int = OUTPUT_CHUNK_SIZE) -> None:
+        """Appends ProgramOutput or merges it into the last queued ProgramOutput"""
+        with self._lock:
+            if self:
+                last = self[-1]
+                if (
+                    last.event_type == "ProgramOutput"
+                    and last["stream_name"] == msg["stream_name"]
+                    and len(last["data"]) + len(msg["data"]) <= max_size
+                    and ("\n" not in last["data"] or not io_animation_required)
+                ):
+                    last["data"] += msg["data"]
+                    return
+
+            super().append(msg)
+        self.notify()
+
+    def appendleft(self, msg) -> None:
+        with self._lock:
+            super().appendleft(msg)
+
+    def notify(self) -> None:
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def popleft(self):
+        with self._lock:
+            msg = super().popleft()
+        wanted_length = self._wanted_length
+        if wanted_length is not None and len(self) <= wanted_length:
+            with self._shrunk:
+                self._shrunk.notify_all()
+        return msg
+
+    def wait_for_length(self, length: int, timeout: float = 1.0) -> None:
+        # timeout guards against waiting for a consumer which is gone
+        with self._shrunk:
+            self._wanted_length = length
+            self._shrunk.wait_for(lambda: len(self) <= length, timeout)
+            self._wanted_length = None
+
+
+class OutputFirehose:
+    """Protects the UI thread from runaway program output (eg. print in an endless loop).
+
+    Used by the reader thread of SubprocessProxy. When output has arrived faster than
+    threshold (characters per second) during FIREHOSE_ACTIVATION_WINDOWS consecutive
+    windows, it gets spooled to a file (starting from the beginning of the burst) and the
+    queue receives only the size of the skipped part and the tail of the output after every
+    FIREHOSE_FLUSH_INTERVAL seconds. A single big print doesn't activate the protection.
+    """
+
+    def __init__(
+        self,
+        message_queue: BackendMessageQueue,
+        threshold: int,
+        spool_dir: str,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._queue = message_queue
+        self._threshold = threshold
+        self._spool_dir = spool_dir
+        self._clock = clock
+        self._lock = Lock()
+        self._window_start = clock()
+        self._window_size = 0
+        self._hot_window_count = 0
+        # output of the current burst, which has been queued as usual
+        self._burst = []  # type: List[str]
+        self._active = False
+        self._spool = None
+        self._spool_path = None
+        self._spool_size = 0
+        self._pending_size = 0
+        self._tail = collections.deque()  # [data, stream_name] pairs
+        self._tail_size = 0
+        self._last_flush_time = 0
+        self._flush_timer = None
+
+    def publish(self, msg: BackendEvent) -> bool:
+        """Returns False if the ProgramOutput should be queued as usual"""
+        data = msg["data"]
+        now = self._clock()
+        with self._lock:
+            elapsed = now - self._window_start
+            if elapsed >= FIREHOSE_WINDOW:
+                if self._active:
+                    if self._window_size < self._threshold * elapsed / 2:
+                        self._stop()
+                elif self._window_size > self._threshold * elapsed:
+                    self._hot_window_count += 1
+                else:
+                    self._hot_window_count = 0
+                    self._burst.clear()
+                self._window_start = now
+                self._window_size = 0
+
+            self._window_size += len(data)
+            if not self._active:
+                if (
+                    self._window_size <= self._threshold * FIREHOSE_WINDOW
+                    or self._hot_window_count < FIREHOSE_ACTIVATION_WINDOWS - 1
+                ):
+                    self._burst.append(data)
+                    return False
+                self._start()
+
+            self._pending_size += len(data)
+            self._write_spool(data)
+            self._add_to_tail(data, msg["stream_name"])
+            if now - self._last_flush_time >= FIREHOSE_FLUSH_INTERVAL:
+                self._flush()
+            elif self._flush_timer is None:
+                self._flush_timer = Timer(FIREHOSE_FLUSH_INTERVAL, self._flush_later)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+            return True
+
+    def flush(self) -> None:
+        """Forwards the tail before a message of other kind gets queued"""
+        with self._lock:
+            if self._active:
+                self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._active:
+                self._stop()
+            self._burst.clear()
+
+    def _start(self) -> None:
+        logger.info("Program output exceeds %s characters per second", self._threshold)
+        self._active = True
+        self._last_flush_time = self._clock()
+        try:
+            os.makedirs(self._spool_dir, exist_ok=True)
+            fd, self._spool_path = tempfile.mkstemp(
+                prefix="output_", suffix=".txt", dir=self._spool_dir
+            )
+            self._spool = open(fd, "w", encoding="utf-8", errors="replace", newline="")
+        except OSError:
+            logger.exception("Could not create output spool file")
+            self._spool = None
+            self._spool_path = None
+
+        # the log starts with the output already shown in the shell
+        for data in self._burst:
+            self._write_spool(data)
+        self._burst.clear()
+
+    def _stop(self) -> None:
+        self._flush()
+        if self._spool is not None:
+            self._spool.close()
+        self._active = False
+        self._spool = None
+        self._spool_path = None
+        self._spool_size = 0
+        self._hot_window_count = 0
+
+    def _write_spool(self, data: str) -> None:
+        if self._spool is None or self._spool_size >= FIREHOSE_MAX_SPOOL_SIZE:
+            return
+
+        data = data[: FIREHOSE_MAX_SPOOL_SIZE - self._spool_size]
+        try:
+            self._spool.write(data)
+        except OSError:
+            logger.exception("Could not write output spool file")
+            self._spool_size = FIREHOSE_MAX_SPOOL_SIZE
+        else:
+            self._spool_size += len(data)
+
+    def _add_to_tail(self, data: str, stream_name: str) -> None:
+        if self._tail and self._tail[-1][1] == stream_name:
+            self._tail[-1][0] += data
+        else:
+            self._tail.append([data, stream_name])
+        self._tail_size += len(data)
+
+        while self._tail_size - len(self._tail[0][0]) >= FIREHOSE_TAIL_SIZE:
+            self._tail_size -= len(self._tail.popleft()[0])
+
+        if self._tail_size > 2 * FIREHOSE_TAIL_SIZE:
+            # don't keep a long chunk around until next flush
+            first = self._tail[0]
+            first[0] = first[0][self._tail_size - FIREHOSE_TAIL_SIZE :]
+            self._tail_size = FIREHOSE_TAIL_SIZE
+
+    def _flush_later(self) -> None:
+        with self._lock:
+            self._flush_timer = None
+            if self._active:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        self._last_flush_time = self._clock()
+
+        if self._tail_size > FIREHOSE_TAIL_SIZE:
+            # start the tail from a line start if possible
+            first = self._tail[0]
+            first[0] = first[0][self._tail_size - FIREHOSE_TAIL_SIZE :]
+            line_end = first[0].find("\n")
+            if line_end >= 0:
+                first[0] = first[0][line_end + 1 :]
+            self._tail_size = sum(len(data) for data, _ in self._tail)
+
+        skipped_size = self._pending_size - self._tail_size
+        if skipped_size > 0:
+            if self._spool is not None:
+                self._spool.flush()
+            self._queue.append(
+                BackendEvent(
+                    "ProgramOutputSkipped",
+                    size=skipped_size,
+                    path=self._spool_path,
+                    truncated=self._spool_size >= FIREHOSE_MAX_SPOOL_SIZE,
+                )
+            )
+
+        for data, stream_name in self._tail:
+            if not data:
+                continue
+            self._queue.append_output(
+                BackendEvent("ProgramOutput", data=data, stream_name=stream_name)
+            )
+
+        self._tail.clear()
+        self._tail_size = 0
+        self._pending_size = 0
+
+
+class BackendStandbyPool:
+    """Backend processes started in advance.
+
+    Restarting the backend then doesn't need to wait for interpreter startup, importing
+    thonny and loading the plug-ins. A standby process is used only if it was started
+    with exactly the same command line, working directory and environment.
+
+    Refills are scheduled with after() of the scheduler (the workbench by default).
+    """
+
+    def __init__(self, scheduler=None):
+        self._scheduler = scheduler
+        self._key = None
+        self._procs = []  # type: List[subprocess.Popen]
+        self._refill_after_id = None
+
+    def take(self, key) -> Optional[subprocess.Popen]:
+        if key != self._key:
+            self.clear()
+            return None
+
+        while self._procs:
+            proc = self._procs.pop(0)
+            if proc.poll() is None:
+                return proc
+            logger.warning("Standby backend had exited with code %s", proc.returncode)
+
+        return None
+
+    def schedule_refill(self, key, size: int, create_process: Callable[[], subprocess.Popen]):
+        if key != self._key:
+            self.clear()
+            self._key = key
+
+        if self._refill_after_id is not None:
+            self._get_scheduler().after_cancel(self._refill_after_id)
+
+        # give the active backend a head start
+        self._refill_after_id = self._get_scheduler().after(
+            STANDBY_BACKEND_DELAY, lambda: self._refill(key, size, create_process)
+        )
+
+    def _refill(self, key, size, create_process):
+        self._refill_after_id = None
+        if key != self._key:
+            return
+
+        while len(self._procs) < size:
+            logger.info("Starting a standby backend")
+            try:
+                self._procs.append(create_process())
+            except Exception:
+                logger.exception("Could not start a standby backend")
+                break
+
+    def clear(self) -> None:
+        if self._refill_after_id is not None:
+            self._get_scheduler().after_cancel(self._refill_after_id)
+            self._refill_after_id = None
+
+        for proc in self._procs:
+            if proc.poll() is None:
+                proc.kill()
+                # reap it, otherwise it stays around as a zombie
+                try:
+                    proc.wait(timeout=2)
+                except subprocess.TimeoutExpired:
+                    logger.warning("Standby backend %s didn't exit after kill", proc.pid)
+        self._procs = []
+        self._key = None
+
+    def _get_scheduler(self):
+        return self._scheduler if self._scheduler is not None else get_workbench()
+
+
+_standby_pool = BackendStandbyPool()
+
+
 class BackendProxy(ABC):
     """Communicates with backend process.
 
@@ -863,6 +1332,12 @@ class BackendProxy(ABC):
     def fetch_next_message(self):
         """Read next message from the queue or None if queue is empty"""
 
+    def set_message_wakeup(self, wakeup: Callable[[], None]) -> bool:
+        """Returns True if the proxy is going to call wakeup (from any thread) whenever
+        fetch_next_message may have something new to return (including termination).
+        Otherwise the runner keeps polling."""
+        return False
+
     @abstractmethod
     def get_sys_path(self):
         "backend's sys.path"
@@ -985,6 +1460,12 @@ class SubprocessProxy(BackendProxy, ABC):
 
         self._proc = None
         self._response_queue = None
+        self._output_firehose = None
+        self._message_wakeup = None
+        # upgraded when the backend answers in a better format
+        self._wire_format = LEGACY_WIRE_FORMAT
+        # backend sends only changes of __main__ globals
+        self._globals_mirror = {}
         self._sys_path = []
         self._usersitepackages = None
         self._externally_managed = None
@@ -1046,6 +1527,8 @@ class SubprocessProxy(BackendProxy, ABC):
         # Let back-end know about plug-ins
         env["THONNY_USER_DIR"] = THONNY_USER_DIR
         env["THONNY_FRONTEND_SYS_PATH"] = repr(sys.path)
+        # Backends which understand it may answer in a newer wire format
+        env[WIRE_FORMATS_ENV_VAR] = "%d,%d" % (LEGACY_WIRE_FORMAT, FRAMED_WIRE_FORMAT)
 
         env["THONNY_LANGUAGE"] = get_workbench().get_option("general.language")
         env["THONNY_VERSION"] = get_version()
@@ -1058,7 +1541,16 @@ class SubprocessProxy(BackendProxy, ABC):
 
     def _start_background_process(self, clean=None, extra_args=[]):
         # deque, because in one occasion I need to put messages back
-        self._response_queue = collections.deque()
+        self._response_queue = BackendMessageQueue(self._message_wakeup)
+        if get_workbench().get_option("run.firehose_mode"):
+            self._output_firehose = OutputFirehose(
+                self._response_queue,
+                get_workbench().get_option("run.firehose_threshold"),
+                get_workbench().get_temp_dir(create_if_doesnt_exist=False),
+            )
+        else:
+            self._output_firehose = None
+        self._wire_format = LEGACY_WIRE_FORMAT
 
         if not os.path.exists(self._mgmt_executable):
             get_shell().print_error(
@@ -1084,24 +1576,27 @@ class SubprocessProxy(BackendProxy, ABC):
         if running_on_windows():
             creationflags = subprocess.CREATE_NEW_PROCESS_GROUP
 
-        logger.info("Starting the backend: %s %s", cmd_line, get_workbench().get_local_cwd())
-
-        self._proc = subprocess.Popen(
-            cmd_line,
-            executable=cmd_line[0],
-            bufsize=0,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=self._get_launch_cwd(),
-            env=self._get_environment(),
-            universal_newlines=True,
-            creationflags=creationflags,
-            encoding="utf-8",
+        launch_cwd = self._get_launch_cwd()
+        env = self._get_environment()
+        create_process = functools.partial(
+            _create_backend_process, cmd_line, launch_cwd, env, creationflags
         )
+        standby_count = self._get_standby_backend_count()
+        standby_key = (tuple(cmd_line), launch_cwd, tuple(sorted(env.items())), creationflags)
+
+        self._proc = None
+        if standby_count > 0:
+            self._proc = _standby_pool.take(standby_key)
+        if self._proc is not None:
+            logger.info("Using a standby backend: %s %s", cmd_line, launch_cwd)
+        else:
+            logger.info("Starting the backend: %s %s", cmd_line, get_workbench().get_local_cwd())
+            self._proc = create_process()
 
         # read success acknowledgement
         ack = self._proc.stdout.readline()
+        if standby_count > 0 and ack.strip() == PROCESS_ACK:
+            _standby_pool.schedule_refill(standby_key, standby_count, create_process)
 
         # setup asynchronous output listeners
         Thread(target=self._listen_stdout, args=(self._proc.stdout,), daemon=True).start()
@@ -1116,6 +1611,26 @@ class SubprocessProxy(BackendProxy, ABC):
                 f"INTERNAL ERROR, got {ack!r} instead of {PROCESS_ACK!r}\n---\n"
             )
 
+    def _get_standby_backend_count(self) -> int:
+        """How many backend processes should be started in advance"""
+        return 0
+
+    def _apply_globals_delta(self, msg):
+        delta = msg.pop("globals_delta")
+        if delta["full"]:
+            self._globals_mirror = {}
+        for name in delta["removed"]:
+            self._globals_mirror.pop(name, None)
+        self._globals_mirror.update(delta["changed"])
+        # consumers get the complete globals, as before
+        msg["globals"] = dict(self._globals_mirror)
+
+    def set_message_wakeup(self, wakeup: Callable[[], None]) -> bool:
+        self._message_wakeup = wakeup
+        if self._response_queue is not None:
+            self._response_queue.wakeup = wakeup
+        return True
+
     def _send_initial_input(self) -> None:
         # Used for sending data sending for startup, which can't be send by other means
         # (e.g. don't want the password to end up in logs)
@@ -1150,7 +1665,7 @@ class SubprocessProxy(BackendProxy, ABC):
             logger.warning("Ignoring command without active backend process")
             return
 
-        self._proc.stdin.write(serialize_message(msg) + "\n")
+        self._proc.stdin.write(serialize_message(msg, wire_format=self._wire_format) + "\n")
         self._proc.stdin.flush()
 
     def _prepare_clean_launch(self):
@@ -1185,20 +1700,33 @@ class SubprocessProxy(BackendProxy, ABC):
     def _listen_stdout(self, stdout):
         # will be called from separate thread
 
-        # allow self._response_queue to be replaced while processing
+        # allow self._response_queue and self._proc to be replaced while processing
         message_queue = self._response_queue
+        firehose = self._output_firehose
+        proc = self._proc
+
+        def queue_msg(msg):
+            if msg.event_type == "ProgramOutput":
+                if firehose is None or not firehose.publish(msg):
+                    message_queue.append_output(msg)
+            else:
+                if firehose is not None:
+                    firehose.flush()
+                message_queue.append(msg)
 
         def publish_as_msg(data):
             msg = parse_message(data)
+            if data.startswith(FRAME_MARKER):
+                # the backend accepted the offer, it can read framed messages as well
+                self._wire_format = FRAMED_WIRE_FORMAT
             if "cwd" in msg:
                 self.cwd = msg["cwd"]
-            message_queue.append(msg)
+            queue_msg(msg)
 
             if len(message_queue) > 10:
                 # Probably backend runs an infinite/long print loop.
                 # Throttle message throughput in order to keep GUI thread responsive.
-                while len(message_queue) > 0:
-                    sleep(0.005)
+                message_queue.wait_for_length(0)
 
         while True:
             try:
@@ -1211,6 +1739,16 @@ class SubprocessProxy(BackendProxy, ABC):
             # debug("... read some stdout data", repr(data))
             if data == "":
                 logger.info("Reader got EOF")
+                if proc is not None:
+                    # let the runner notice the termination right away. If the process
+                    # outlives the timeout, the runner notices it with its periodic check
+                    try:
+                        proc.wait(timeout=5)
+                    except subprocess.TimeoutExpired:
+                        pass
+                if firehose is not None:
+                    firehose.close()
+                message_queue.notify()
                 break
             else:
                 try:
@@ -1224,9 +1762,7 @@ class SubprocessProxy(BackendProxy, ABC):
                     parts = data.rsplit(common.MESSAGE_MARKER, maxsplit=1)
 
                     # print first part as it is
-                    message_queue.append(
-                        BackendEvent("ProgramOutput", data=parts[0], stream_name="stdout")
-                    )
+                    queue_msg(BackendEvent("ProgramOutput", data=parts[0], stream_name="stdout"))
 
                     if len(parts) == 2:
                         second_part = common.MESSAGE_MARKER + parts[1]
@@ -1234,7 +1770,7 @@ class SubprocessProxy(BackendProxy, ABC):
                             publish_as_msg(second_part)
                         except Exception:
                             # just print ...
-                            message_queue.append(
+                            queue_msg(
                                 BackendEvent(
                                     "ProgramOutput", data=second_part, stream_name="stdout"
                                 )
@@ -1264,6 +1800,9 @@ class SubprocessProxy(BackendProxy, ABC):
         if "sys_path" in msg:
             self._sys_path = msg["sys_path"]
 
+        if "globals_delta" in msg:
+            self._apply_globals_delta(msg)
+
         if "usersitepackages" in msg:
             self._usersitepackages = msg["usersitepackages"]
 
@@ -1357,6 +1896,22 @@ class SubprocessProxy(BackendProxy, ABC):
             return msg
 
 
+def _create_backend_process(cmd_line, cwd, env, creationflags) -> subprocess.Popen:
+    return subprocess.Popen(
+        cmd_line,
+        executable=cmd_line[0],
+        bufsize=0,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        universal_newlines=True,
+        creationflags=creationflags,
+        encoding="utf-8",
+    )
+
+
 def _ends_with_incomplete_ansi_code(data):
     pos = max(data.rfind("\033["), data.rfind("\033]"))
 
@@ -0,0 +1,127 @@
+"""Append-only storage for the text which doesn't fit into Shell anymore"""
+
+import mmap
+import os.path
+import tempfile
+from array import array
+from bisect import bisect_right
+from logging import getLogger
+from typing import List, Optional
+
+logger = getLogger(__name__)
+
+SEARCH_BLOCK_SIZE = 1024 * 1024
+
+
+class ScrollbackStore:
+    """Keeps text in a temporary file and reads it back through a memory map.
+
+    The line index (start offsets of the lines in the UTF-8 encoded file) allows fetching
+    any range of lines without decoding the rest. Lines are separated by "\\n" and
+    returned without it.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        fd, self._path = tempfile.mkstemp(prefix="scrollback_", suffix=".txt", dir=directory)
+        self._file = open(fd, "w+b")
+        self._size = 0
+        self._line_starts = array("q", [0])
+        self._map = None  # type: Optional[mmap.mmap]
+
+    def append(self, text: str) -> None:
+        if not text:
+            return
+
+        data = text.encode("utf-8", errors="surrogatepass")
+        self._file.seek(self._size)
+        self._file.write(data)
+
+        pos = data.find(b"\n")
+        while pos != -1:
+            self._line_starts.append(self._size + pos + 1)
+            pos = data.find(b"\n", pos + 1)
+
+        self._size += len(data)
+
+    def get_line_count(self) -> int:
+        if self._size > self._line_starts[-1]:
+            # last line has no line break
+            return len(self._line_starts)
+        else:
+            return len(self._line_starts) - 1
+
+    def get_size(self) -> int:
+        return self._size
+
+    def get_lines(self, first: int, last: int) -> List[str]:
+        """Returns lines first..last-1"""
+        last = min(last, self.get_line_count())
+        if first >= last:
+            return []
+
+        text = self._get_data(self._line_starts[first], self._get_line_end(last - 1))
+        return text.decode("utf-8", errors="surrogatepass").split("\n")[: last - first]
+
+    def get_text(self) -> str:
+        return self._get_data(0, self._size).decode("utf-8", errors="surrogatepass")
+
+    def find(self, needle: str, start_line: int = 0, nocase: bool = False) -> Optional[int]:
+        """Returns the number of first line at or after start_line containing needle"""
+        if not needle or start_line >= self.get_line_count():
+            return None
+
+        if not nocase:
+            data = self._get_map()
+            pos = data.find(needle.encode("utf-8"), self._line_starts[start_line], self._size)
+            if pos == -1:
+                return None
+            return bisect_right(self._line_starts, pos) - 1
+
+        needle = needle.lower()
+        line = start_line
+        line_count = self.get_line_count()
+        while line < line_count:
+            # search a block of whole lines at a time
+            block_end = bisect_right(
+                self._line_starts, self._line_starts[line] + SEARCH_BLOCK_SIZE, lo=line + 1
+            )
+            block_end = min(max(block_end - 1, line + 1), line_count)
+            lines = self.get_lines(line, block_end)
+            for i, text in enumerate(lines):
+                if needle in text.lower():
+                    return line + i
+            line = block_end
+
+        return None
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+        self._file.close()
+        try:
+            os.remove(self._path)
+        except OSError:
+            logger.warning("Could not remove %s", self._path)
+
+    def _get_line_end(self, line: int) -> int:
+        if line + 1 < len(self._line_starts):
+            # don't include the line break
+            return self._line_starts[line + 1] - 1
+        else:
+            return self._size
+
+    def _get_data(self, start: int, end: int) -> bytes:
+        if start >= end:
+            return b""
+        return self._get_map()[start:end]
+
+    def _get_map(self) -> mmap.mmap:
+        if self._map is None or len(self._map) < self._size:
+            if self._map is not None:
+                self._map.close()
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+        return self._map
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import collections
 import os.path
 import re
 import tkinter as tk
 import traceback
+from array import array
 from logging import getLogger
 from tkinter import ttk
 from typing import cast
@@ -22,8 +24,9 @@ from thonny.common import (
     ToplevelResponse,
 )
 from thonny.languages import tr
-from thonny.misc_utils import construct_cmd_line, parse_cmd_line
-from thonny.running import EDITOR_CONTENT_TOKEN
+from thonny.misc_utils import construct_cmd_line, parse_cmd_line, sizeof_fmt
+from thonny.running import EDITOR_CONTENT_TOKEN, FIREHOSE_MAX_SPOOL_SIZE
+from thonny.scrollback import ScrollbackStore
 from thonny.tktextext import TextFrame, TweakableText, index2line
 from thonny.ui_utils import (
     CommonDialog,
@@ -34,6 +37,7 @@ from thonny.ui_utils import (
     get_beam_cursor,
     get_hyperlink_cursor,
     lookup_style_option,
+    open_with_default_app,
     replace_unsupported_chars,
     scrollbar_style,
     select_sequence,
@@ -64,6 +68,9 @@ SIMPLE_URL_SPLIT_REGEX = re.compile(
 )
 
 INT_REGEX = re.compile(r"\d+")
+# number of lines ScrollbackDialog keeps in the widget above and below the visible part
+SCROLLBACK_WINDOW_MARGIN = 300
+PLOTTER_PARSE_CACHE_SIZE = 1000
 ANSI_COLOR_NAMES = {
     "0": "black",
     "1": "red",
@@ -171,6 +178,7 @@ class ShellView(tk.PanedWindow):
 
     def init_plotter(self):
         self.plotter = None
+        self._plotter_update_after_id = None
         get_workbench().set_default("view.show_plotter", False)
         get_workbench().set_default("view.shell_sash_position", 400)
 
@@ -296,6 +304,12 @@ class ShellView(tk.PanedWindow):
             self.update_plotter()
 
     def update_plotter(self):
+        # many lines may arrive in one batch, plot them together
+        if self._plotter_update_after_id is None:
+            self._plotter_update_after_id = self.after_idle(self._update_plotter_now)
+
+    def _update_plotter_now(self):
+        self._plotter_update_after_id = None
         if self.plotter is not None and self.plotter.winfo_ismapped():
             self.plotter.update_plot()
 
@@ -315,6 +329,7 @@ class ShellMenu(TextMenu):
     def add_extra_items(self):
         self.add_separator()
         self.add_command(label=tr("Clear"), command=self.text._clear_shell)
+        self.add_command(label=tr("Show full history"), command=self.text.show_scrollback)
 
         def toggle_from_menu():
             # I don't like that Tk menu toggles checbutton variable
@@ -343,6 +358,9 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         self.view = view
         self._ignore_program_output = False
         self._link_handler_count = 0
+        # only the active shell keeps the content it discards
+        self._keeps_scrollback = False
+        self._scrollback = None
         self._last_main_file = None
         kw["tabstyle"] = "wordprocessor"
         kw["cursor"] = get_beam_cursor()
@@ -355,8 +373,8 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
 
         # logs of IO events for current toplevel block
         # (enables undoing and redoing the events)
-        self._applied_io_events = []
-        self._queued_io_events = []
+        self._reset_io_events()
+        self._squeeze_splitter = None
         self._images = set()
 
         self._ansi_foreground = None
@@ -480,6 +498,31 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
 
         self._update_visible_io(None)
 
+    def _handle_program_output_skipped(self, msg):
+        # Backend prints faster than the shell could show, only the tail gets here
+        if self._ignore_program_output:
+            return
+
+        self._ensure_visible()
+        self._update_visible_io(None)
+        if self.get("output_insert -1 c", "output_insert") not in ("", "\n"):
+            self._insert_text_directly("\n", ("io",))
+
+        text = tr("%s of output skipped") % sizeof_fmt(msg.size)
+        if msg.path:
+            self._insert_text_directly("[%s, " % text, ("io",))
+            if msg.truncated:
+                link_text = tr("open the log (%s)") % sizeof_fmt(FIREHOSE_MAX_SPOOL_SIZE)
+            else:
+                link_text = tr("open full log")
+            self._insert_command_link(link_text, lambda e: open_with_default_app(msg.path))
+            self._insert_text_directly("]\n", ("io",))
+        else:
+            self._insert_text_directly("[%s]\n" % text, ("io",))
+
+        self.mark_set("output_end", self.index("end-1c"))
+        self.see("end")
+
     def _handle_toplevel_response(self, msg: ToplevelResponse) -> None:
         if msg.get("error"):
             self._ensure_visible()
@@ -519,19 +562,39 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
     def _get_squeeze_threshold(self):
         return get_workbench().get_option("shell.squeeze_threshold")
 
+    def _get_squeeze_splitter(self):
+        threshold = self._get_squeeze_threshold()
+        if self._squeeze_splitter is None or self._squeeze_splitter[0] != threshold:
+            self._squeeze_splitter = (threshold, re.compile("(.{%d,})" % (threshold + 1)))
+        return self._squeeze_splitter
+
+    def _reset_io_events(self):
+        self._applied_io_events = []
+        self._applied_io_char_count = 0
+        self._queued_io_events = collections.deque()
+
+    def _add_applied_io_event(self, data, stream_name):
+        self._applied_io_events.append((data, stream_name))
+        self._applied_io_char_count += len(data)
+
     def _append_to_io_queue(self, data, stream_name):
         # Make sure ANSI CSI codes and object links are stored as separate events
         # TODO: try to complete previously submitted incomplete code
-        parts = re.split(OUTPUT_SPLIT_REGEX, data)
-        for part in parts:
-            if part:  # split may produce empty string in the beginning or start
-                # split the data so that very long lines separated
-                for block in re.split("(.{%d,})" % (self._get_squeeze_threshold() + 1), part):
-                    if block:
-                        self._queued_io_events.append((block, stream_name))
+        threshold, splitter = self._get_squeeze_splitter()
+        for part in OUTPUT_SPLIT_REGEX.split(data):
+            if not part:
+                # split may produce empty string in the beginning or start
+                continue
+            if len(part) <= threshold:
+                self._queued_io_events.append((part, stream_name))
+                continue
+            # split the data so that very long lines separated
+            for block in splitter.split(part):
+                if block:
+                    self._queued_io_events.append((block, stream_name))
 
     def _update_visible_io(self, target_num_visible_chars):
-        current_num_visible_chars = sum(map(lambda x: len(x[0]), self._applied_io_events))
+        current_num_visible_chars = self._applied_io_char_count
 
         if (
             target_num_visible_chars is not None
@@ -539,21 +602,22 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         ):
             # hard to undo complex renderings (squeezed texts and ANSI codes)
             # easier to clean everything and start again
-            self._queued_io_events = self._applied_io_events + self._queued_io_events
+            self._queued_io_events.extendleft(reversed(self._applied_io_events))
             self._applied_io_events = []
+            self._applied_io_char_count = 0
             self.direct_delete("command_io_start", "output_end")
             current_num_visible_chars = 0
             self._reset_ansi_attributes()
 
         while self._queued_io_events and current_num_visible_chars != target_num_visible_chars:
-            data, stream_name = self._queued_io_events.pop(0)
+            data, stream_name = self._queued_io_events.popleft()
 
             if target_num_visible_chars is not None:
                 leftover_count = current_num_visible_chars + len(data) - target_num_visible_chars
 
                 if leftover_count > 0:
                     # add suffix to the queue
-                    self._queued_io_events.insert(0, (data[-leftover_count:], stream_name))
+                    self._queued_io_events.appendleft((data[-leftover_count:], stream_name))
                     data = data[:-leftover_count]
 
             self._apply_io_event(data, stream_name)
@@ -568,7 +632,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
 
         original_data = data
 
-        if self.tty_mode and re.match(TERMINAL_CONTROL_REGEX, data):
+        if self.tty_mode and TERMINAL_CONTROL_REGEX.match(data):
             if data == "\a":
                 get_workbench().bell()
             elif data == "\b":
@@ -588,7 +652,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             else:
                 logger.warning("Don't know what to do with %r" % data)
 
-        elif re.match(OBJECT_INFO_START_REGEX, data):
+        elif OBJECT_INFO_START_REGEX.match(data):
             id_str = data[data.index("=") + 1 : data.index("]")]
             self.active_extra_tags.append("value")
             self.active_extra_tags.append(id_str)
@@ -600,7 +664,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
                     memory.format_object_id(int(id_str)), tuple(self.active_extra_tags)
                 )
 
-        elif re.match(OBJECT_INFO_END_REGEX, data):
+        elif OBJECT_INFO_END_REGEX.match(data):
             try:
                 self.active_extra_tags.pop()
                 self.active_extra_tags.pop()
@@ -694,14 +758,14 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
                 # if any data is still left, then this should be output normally
                 self._insert_text_directly(data, tuple(tags))
 
-        self._applied_io_events.append((original_data, stream_name))
+        self._add_applied_io_event(original_data, stream_name)
 
     def _show_squeezed_text(self, button):
         dlg = SqueezedTextDialog(self, button)
         show_dialog(dlg)
 
     def _change_io_cursor_offset_csi(self, marker):
-        ints = re.findall(INT_REGEX, marker)
+        ints = INT_REGEX.findall(marker)
         if len(ints) != 1:
             logger.warning("bad CSI cursor positioning: %s", marker)
             # do nothing
@@ -756,7 +820,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             # ignore
             return
 
-        codes = re.findall(INT_REGEX, marker)
+        codes = INT_REGEX.findall(marker)
         if not codes:
             self._reset_ansi_attributes()
 
@@ -1321,8 +1385,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
                 self.mark_set("command_io_start", "output_insert")
                 self.mark_gravity("command_io_start", "left")
                 # discard old io events
-                self._applied_io_events = []
-                self._queued_io_events = []
+                self._reset_io_events()
             except Exception:
                 get_workbench().report_exception()
                 self._insert_prompt()
@@ -1333,7 +1396,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             assert get_runner().is_running()
             get_runner().send_program_input(text_to_be_submitted)
             get_workbench().event_generate("ShellInput", input_text=text_to_be_submitted)
-            self._applied_io_events.append((text_to_be_submitted, "stdin"))
+            self._add_applied_io_event(text_to_be_submitted, "stdin")
 
     def _arrow_up(self, event):
         if not get_runner().is_waiting_toplevel_command():
@@ -1529,7 +1592,52 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
 
         self._clear_content(proposed_cut)
 
+    def _get_text_with_squeezed_parts(self, start, end):
+        parts = []
+        for key, value, _ in self.dump(start, end, text=True, window=True):
+            if key == "text":
+                parts.append(value)
+            elif key == "window":
+                try:
+                    widget = self.nametowidget(value)
+                except KeyError:
+                    continue
+                parts.append(getattr(widget, "contained_text", None) or "")
+
+        return "".join(parts)
+
+    def _archive_content(self, start, end):
+        if not self._keeps_scrollback:
+            return
+
+        text = self._get_text_with_squeezed_parts(start, end)
+        if not text:
+            return
+        if not text.endswith("\n"):
+            text += "\n"
+
+        try:
+            if self._scrollback is None:
+                self._scrollback = ScrollbackStore(get_workbench().get_temp_dir())
+            self._scrollback.append(text)
+        except OSError:
+            logger.exception("Could not store discarded Shell content")
+            self._keeps_scrollback = False
+
+    def _close_scrollback(self, event=None):
+        if self._scrollback is not None:
+            self._scrollback.close()
+            self._scrollback = None
+        self._keeps_scrollback = False
+
+    def show_scrollback(self):
+        dlg = ScrollbackDialog(
+            self, self._scrollback, self._get_text_with_squeezed_parts("1.0", "end-1c")
+        )
+        show_dialog(dlg)
+
     def _clear_content(self, cut_idx):
+        self._archive_content("1.0", cut_idx)
         proposed_cut_float = float(self.index(cut_idx))
         for btn in list(self._squeeze_buttons):
             try:
@@ -1621,6 +1729,7 @@ class ShellText(BaseShellText):
     def __init__(self, master, view, **kw):
         super().__init__(master, view, **kw)
         self.bindtags(self.bindtags() + ("ShellText",))
+        self._keeps_scrollback = True
 
         self.tag_bind("value", "<1>", self._value_click)
         self.tag_bind("value", "<ButtonRelease-1>", self._value_mouse_up)
@@ -1631,12 +1740,14 @@ class ShellText(BaseShellText):
 
         get_workbench().bind("InputRequest", self._handle_input_request, True)
         get_workbench().bind("ProgramOutput", self._handle_program_output, True)
+        get_workbench().bind("ProgramOutputSkipped", self._handle_program_output_skipped, True)
         get_workbench().bind("ToplevelResponse", self._handle_toplevel_response, True)
         get_workbench().bind("DebuggerResponse", self._handle_fancy_debugger_progress, True)
         get_workbench().bind("BackendTerminated", self._on_backend_terminated, True)
         get_workbench().bind(
             "HideTrailingOutput", lambda msg: self._hide_trailing_output(msg.text), True
         )
+        get_workbench().bind("WorkbenchClose", self._close_scrollback, True)
 
 
 class SqueezedTextDialog(CommonDialog):
@@ -1737,6 +1848,257 @@ class SqueezedTextDialog(CommonDialog):
         self.destroy()
 
 
+class _ScrollbackSource:
+    """Lines of the store at the moment of creation followed by lines of given text"""
+
+    def __init__(self, store, tail_text):
+        self._store = store
+        self._stored_count = store.get_line_count() if store is not None else 0
+        self._tail = tail_text.split("\n")
+        if self._tail[-1] == "":
+            self._tail.pop()
+
+    def get_line_count(self):
+        return self._stored_count + len(self._tail)
+
+    def get_lines(self, first, last):
+        result = []
+        if first < self._stored_count:
+            result += self._store.get_lines(first, min(last, self._stored_count))
+        if last > self._stored_count:
+            result += self._tail[max(first - self._stored_count, 0) : last - self._stored_count]
+        return result
+
+    def get_text(self):
+        return "\n".join(self.get_lines(0, self.get_line_count()))
+
+    def find(self, needle, start_line):
+        """Case-insensitive search, returns line number or None"""
+        if start_line < self._stored_count:
+            line = self._store.find(needle, start_line, nocase=True)
+            if line is not None and line < self._stored_count:
+                return line
+
+        needle = needle.lower()
+        for i in range(max(start_line - self._stored_count, 0), len(self._tail)):
+            if needle in self._tail[i].lower():
+                return self._stored_count + i
+
+        return None
+
+
+class _ScrollbackTextFrame(TextFrame):
+    """Scrollbar represents all lines of the dialog, not only the ones in the widget"""
+
+    def __init__(self, master, dialog, **kw):
+        self._dialog = dialog
+        super().__init__(master, **kw)
+
+    def _vertical_scrollbar_update(self, *args):
+        if not hasattr(self, "_vbar"):
+            return
+
+        self._vbar.set(*self._dialog.get_yview())
+        self._dialog.schedule_refill()
+
+    def _vertical_scroll(self, *args):
+        self._dialog.scroll(*args)
+
+
+class ScrollbackDialog(CommonDialog):
+    """Shows all output of the session, including the part discarded from Shell.
+
+    Only the visible lines plus SCROLLBACK_WINDOW_MARGIN lines on both sides are
+    kept in the text widget, the rest gets fetched when scrolling.
+    """
+
+    def __init__(self, master: BaseShellText, store, tail_text):
+        super().__init__(master)
+        self._source = _ScrollbackSource(store, tail_text)
+        self._squeeze_threshold = max(master._get_squeeze_threshold(), 80)
+        self._expanded_lines = set()
+        self._window_start = 0
+        self._window_end = 0
+        self._found_line = None
+        self._refill_after_id = None
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        padding = 20
+
+        mainframe = ttk.Frame(self)
+        mainframe.grid(row=0, column=0, sticky="nsew")
+        mainframe.columnconfigure(0, weight=1)
+        mainframe.rowconfigure(1, weight=1)
+
+        search_frame = ttk.Frame(mainframe)
+        search_frame.grid(row=0, column=0, padx=padding, pady=(padding, padding // 2), sticky="ew")
+        search_frame.columnconfigure(1, weight=1)
+        search_label = ttk.Label(search_frame, text=tr("Find:"))
+        search_label.grid(row=0, column=0, padx=(0, padding // 2))
+        self._search_var = tk.StringVar(value="")
+        self._search_var.trace_add("write", self._on_search_text_change)
+        self.search_entry = ttk.Entry(search_frame, textvariable=self._search_var)
+        self.search_entry.grid(row=0, column=1, sticky="ew")
+        self.search_entry.bind("<Return>", self._on_find, True)
+        find_button = ttk.Button(search_frame, text=tr_btn("Find next"), command=self._on_find)
+        find_button.grid(row=0, column=2, padx=(padding // 2, 0))
+
+        self.text_frame = _ScrollbackTextFrame(
+            mainframe,
+            self,
+            text_class=TweakableText,
+            read_only=True,
+            height=25,
+            width=100,
+            relief="sunken",
+            borderwidth=1,
+            wrap="none",
+            font="IOFont",
+        )
+        self.text_frame.grid(row=1, column=0, padx=padding, sticky="nsew")
+        self.text = self.text_frame.text
+        self.text.tag_configure("squeezed", **get_syntax_options_for_tag("hyperlink"))
+        self.text.tag_bind("squeezed", "<ButtonRelease-1>", self._on_expand, True)
+
+        button_frame = ttk.Frame(mainframe)
+        button_frame.grid(row=2, column=0, padx=padding, pady=padding, sticky="nswe")
+        button_frame.columnconfigure(0, weight=1)
+
+        copy_caption = tr_btn("Copy all")
+        copy_button = ttk.Button(
+            button_frame, text=copy_caption, width=len(copy_caption), command=self._on_copy_all
+        )
+        copy_button.grid(row=0, column=1, sticky="e", padx=(0, padding))
+
+        close_button = ttk.Button(button_frame, text=tr_btn("Close"), command=self._on_close)
+        close_button.grid(row=0, column=2, sticky="e")
+
+        self.bind("<Escape>", self._on_close, True)
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.title(tr("Shell history (%d lines)") % self._source.get_line_count())
+
+        self._show_window(self._source.get_line_count() - 1)
+        self.text.see("end")
+
+    def _get_visible_range(self):
+        # line numbers of the text widget
+        first = int(self.text.index("@0,0").split(".")[0])
+        last = int(self.text.index("@0,%d" % self.text.winfo_height()).split(".")[0])
+        return first, last
+
+    def _show_window(self, top_line):
+        """Fills the widget with lines around top_line and scrolls top_line to the top"""
+        line_count = self._source.get_line_count()
+        top_line = max(0, min(top_line, line_count - 1))
+        start = max(
+            0, min(top_line - SCROLLBACK_WINDOW_MARGIN, line_count - 3 * SCROLLBACK_WINDOW_MARGIN)
+        )
+        lines = self._source.get_lines(start, start + 3 * SCROLLBACK_WINDOW_MARGIN)
+
+        self.text.direct_delete("1.0", "end")
+        pending = []
+        for i, line in enumerate(lines, start=start):
+            if len(line) > self._squeeze_threshold and i not in self._expanded_lines:
+                self.text.direct_insert("end", "".join(pending) + line[: self._squeeze_threshold])
+                self.text.direct_insert(
+                    "end",
+                    " … " + tr("[%d more characters]") % (len(line) - self._squeeze_threshold),
+                    ("squeezed",),
+                )
+                pending = ["\n"]
+            else:
+                pending.append(line + "\n")
+
+        # Tk adds the final line break itself
+        self.text.direct_insert("end", "".join(pending)[:-1])
+
+        self._window_start = start
+        self._window_end = start + len(lines)
+        if lines:
+            self.text.yview_moveto((top_line - start) / len(lines))
+
+    def get_yview(self):
+        line_count = self._source.get_line_count()
+        if not line_count:
+            return 0.0, 1.0
+
+        first, last = self._get_visible_range()
+        return (
+            (self._window_start + first - 1) / line_count,
+            min(self._window_start + last, line_count) / line_count,
+        )
+
+    def schedule_refill(self):
+        if self._refill_after_id is None:
+            self._refill_after_id = self.after_idle(self._refill_if_needed)
+
+    def _refill_if_needed(self):
+        self._refill_after_id = None
+        first, last = self._get_visible_range()
+        reserve = SCROLLBACK_WINDOW_MARGIN // 3
+        if (first <= reserve and self._window_start > 0) or (
+            last >= self._window_end - self._window_start - reserve
+            and self._window_end < self._source.get_line_count()
+        ):
+            self._show_window(self._window_start + first - 1)
+
+    def scroll(self, *args):
+        if args[0] == "moveto":
+            self._show_window(int(float(args[1]) * self._source.get_line_count()))
+        else:
+            self.text.yview(*args)
+
+    def _on_expand(self, event):
+        line = int(self.text.index("@%d,%d" % (event.x, event.y)).split(".")[0])
+        first, _ = self._get_visible_range()
+        self._expanded_lines.add(self._window_start + line - 1)
+        self._show_window(self._window_start + first - 1)
+
+    def _on_search_text_change(self, *args):
+        self._found_line = None
+
+    def _on_find(self, event=None):
+        needle = self._search_var.get()
+        if not needle:
+            return "break"
+
+        if self._found_line is None:
+            start_line = self._window_start + self._get_visible_range()[0] - 1
+        else:
+            start_line = self._found_line + 1
+
+        line = self._source.find(needle, start_line)
+        if line is None and start_line > 0:
+            # continue from the beginning
+            line = self._source.find(needle, 0)
+        if line is None:
+            self.bell()
+            return "break"
+
+        self._found_line = line
+        if len(self._source.get_lines(line, line + 1)[0]) > self._squeeze_threshold:
+            self._expanded_lines.add(line)
+        self._show_window(line - 5)
+
+        local_line = line - self._window_start + 1
+        self.text.tag_remove("sel", "1.0", "end")
+        pos = self.text.search(needle, "%d.0" % local_line, "%d.end" % local_line, nocase=True)
+        if pos:
+            self.text.tag_add("sel", pos, "%s +%d chars" % (pos, len(needle)))
+            self.text.mark_set("insert", pos)
+            self.text.see(pos)
+
+        return "break"
+
+    def _on_copy_all(self):
+        self.clipboard_clear()
+        self.clipboard_append(self._source.get_text())
+
+    def _on_close(self, event=None):
+        self.destroy()
+
+
 class PlotterCanvas(tk.Canvas):
     def __init__(self, master, text):
         self.master = master
@@ -1759,6 +2121,8 @@ class PlotterCanvas(tk.Canvas):
         self.range_block_size = 0
         self.value_range = 2
         self.last_legend = None
+        # line text => (pattern, numbers), most recently used last
+        self._parse_cache = collections.OrderedDict()
         self.font = tk.font.nametofont("TkDefaultFont")
         self.linespace = self.font.metrics("linespace")
         self.y_padding = self.linespace
@@ -1848,19 +2212,23 @@ class PlotterCanvas(tk.Canvas):
         return 30
 
     def update_plot(self, force_clean=False):
-        data_lines = []
         bottom_index = self.text.index(
             "@%d,%d" % (self.text.winfo_width(), self.text.winfo_height())
         )
         bottom_lineno = int(float(bottom_index))
+        first_lineno = bottom_lineno - self.get_num_steps()
 
-        for i in range(bottom_lineno - self.get_num_steps(), bottom_lineno + 1):
-            line_start_index = "%d.0" % i
-            if i < 1 or "stdout" not in self.text.tag_names(line_start_index):
-                data_lines.append(([], []))
+        data_lines = [([], [])] * max(1 - first_lineno, 0)
+        first_lineno = max(first_lineno, 1)
+        stdout_linenos = _get_line_starts_in_ranges(
+            self._get_stdout_ranges(first_lineno, bottom_lineno), first_lineno, bottom_lineno
+        )
+        content = self.text.get("%d.0" % first_lineno, "%d.0 lineend" % bottom_lineno)
+        for i, line in enumerate(content.split("\n"), start=first_lineno):
+            if i in stdout_linenos:
+                data_lines.append(self._parse_line(line))
             else:
-                content = self.text.get(line_start_index, line_start_index + " lineend")
-                data_lines.append(self.extract_pattern_and_numbers(content))
+                data_lines.append(([], []))
 
         # data_lines need to be transposed
         segments_by_color = []
@@ -1971,13 +2339,14 @@ class PlotterCanvas(tk.Canvas):
         return count
 
     def draw_segment(self, color, pos, nums):
-        x = self.x_padding_left + pos * self.x_scale
+        x0 = self.x_padding_left + pos * self.x_scale
 
         args = []
-        for num in nums:
+        # no point in drawing more than 2 points per pixel column
+        bucket_size = int(1 / self.x_scale) if self.x_scale > 0 else 1
+        for i, num in _decimate_min_max(nums, bucket_size):
             y = self.y_padding + (self.range_end - num) * self.y_scale
-            args.extend([x, y])
-            x += self.x_scale
+            args.extend([x0 + i * self.x_scale, y])
 
         self.create_line(
             *args,
@@ -2087,6 +2456,32 @@ class PlotterCanvas(tk.Canvas):
             )
             value += self.range_block_size
 
+    def _get_stdout_ranges(self, first_lineno, last_lineno):
+        ranges = []
+        # the range covering the start of the first line may start before it
+        current = self.text.tag_prevrange("stdout", "%d.0 +1 chars" % first_lineno)
+        if not current:
+            current = self.text.tag_nextrange(
+                "stdout", "%d.0" % first_lineno, "%d.0 lineend" % last_lineno
+            )
+        while current:
+            ranges.append(current)
+            current = self.text.tag_nextrange("stdout", current[1], "%d.0 lineend" % last_lineno)
+
+        return ranges
+
+    def _parse_line(self, line):
+        result = self._parse_cache.get(line)
+        if result is None:
+            result = self.extract_pattern_and_numbers(line)
+            self._parse_cache[line] = result
+            if len(self._parse_cache) > PLOTTER_PARSE_CACHE_SIZE:
+                self._parse_cache.popitem(last=False)
+        else:
+            self._parse_cache.move_to_end(line)
+
+        return result
+
     def extract_pattern_and_numbers(self, line):
         parts = NUMBER_SPLIT_REGEX.split(line)
         if len(parts) < 2:
@@ -2107,14 +2502,14 @@ class PlotterCanvas(tk.Canvas):
     def extract_series_segments(self, data_lines, series_nr):
         """Yields numbers which form connected multilines on graph
         Each segment is pair of starting position and numbers"""
-        segment = (0, [])
+        segment = (0, array("d"))
         prev_pattern = None
         for i, (pattern, nums) in enumerate(data_lines):
             if len(nums) <= series_nr or pattern != prev_pattern:
                 # break the segment
                 if len(segment[1]) > 1:
                     yield segment
-                segment = (i, [])
+                segment = (i, array("d"))
 
             if len(nums) > series_nr:
                 segment[1].append(nums[series_nr])
@@ -2168,3 +2563,34 @@ class PlotterCanvas(tk.Canvas):
         self.update_close_button()
         assert isinstance(self.master, ShellView)
         self.master.resize_plotter()
+
+
+def _get_line_starts_in_ranges(ranges, first_lineno, last_lineno):
+    """Returns numbers of the lines between first_lineno and last_lineno (inclusive)
+    which start inside one of the given Text index ranges"""
+    result = set()
+    for start, end in ranges:
+        start_line, start_col = map(int, str(start).split("."))
+        end_line, end_col = map(int, str(end).split("."))
+        if start_col > 0:
+            start_line += 1
+        if end_col == 0:
+            end_line -= 1
+        result.update(range(max(start_line, first_lineno), min(end_line, last_lineno) + 1))
+
+    return result
+
+
+def _decimate_min_max(values, bucket_size):
+    """Yields (index, value) pairs. With bucket_size > 1 only the minimum and the maximum
+    of each bucket of consecutive values is kept (in their original order)."""
+    if bucket_size <= 1:
+        yield from enumerate(values)
+        return
+
+    for start in range(0, len(values), bucket_size):
+        bucket = values[start : start + bucket_size]
+        min_i = min(range(len(bucket)), key=bucket.__getitem__)
+        max_i = max(range(len(bucket)), key=bucket.__getitem__)
+        for i in sorted({min_i, max_i}):
+            yield start + i, bucket[i]
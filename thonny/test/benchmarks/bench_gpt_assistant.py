@@ -0,0 +1,394 @@
+"""Benchmark for the responsiveness of the GPT assistant view.
+
+Runs AssistantViewGPT in a hidden Tk root against a local fake OpenAI-compatible server and
+measures time to first token, end-to-end answer latency, history log write cost as the
+history grows, tab switch rebuild time for N bubbles and memory per bubble.
+
+Needs a display (or Xvfb) and the openai package. Run from the repository root::
+
+    python -m thonny.test.benchmarks.bench_gpt_assistant --bubbles 200 --output result.json
+
+The files in this package are not collected by pytest.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os.path
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = (
+    "Schau dir noch einmal die Bedingung deiner Schleife an. Was passiert, wenn die "
+    "Variable zaehler den Wert 10 erreicht?\n```python\nwhile zaehler < 10:\n"
+    "    zaehler = zaehler + 1\n```\nWelche Zeile wird danach ausgeführt?"
+)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers /v1/chat/completions like OpenAI, either as JSON or as an event stream."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.request_count += 1
+        time.sleep(self.server.first_token_delay)
+        if request.get("stream"):
+            self._send_stream(request)
+        else:
+            self._send_json(request)
+
+    def _send_json(self, request):
+        body = json.dumps(
+            {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": self.server.answer},
+                        "finish_reason": "stop",
+                    }
+                ],
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, request):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        tokens = self.server.answer.split(" ")
+        for i, token in enumerate(tokens):
+            if i > 0:
+                time.sleep(self.server.token_delay)
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": token if i == 0 else " " + token},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            self._write_chunk("data: " + json.dumps(chunk) + "\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_server(first_token_delay, token_delay, answer=ANSWER):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.first_token_delay = first_token_delay
+    server.token_delay = token_delay
+    server.answer = answer
+    server.request_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _FakeEditor:
+    def __init__(self, text_widget):
+        self.filename = None
+        self._text_widget = text_widget
+
+    def get_filename(self):
+        return self.filename
+
+    def get_text_widget(self):
+        return self._text_widget
+
+
+class _FakeEditorNotebook:
+    def __init__(self, editor):
+        self._editor = editor
+
+    def bind(self, sequence, func, add=None):
+        pass
+
+    def get_current_editor(self):
+        return self._editor
+
+    def get_current_editor_content(self):
+        return self._editor.get_text_widget().get("1.0", "end-1c")
+
+
+class _BenchmarkWorkbench:
+    """Just enough of the Workbench for the assistant view."""
+
+    def __init__(self, notebook):
+        self._options = {}
+        self._notebook = notebook
+
+    def set_default(self, name, value):
+        self._options.setdefault(name, value)
+
+    def get_option(self, name, default=None):
+        return self._options.get(name, default)
+
+    def set_option(self, name, value):
+        self._options[name] = value
+
+    def add_view(self, *args, **kw):
+        pass
+
+    def add_command(self, *args, **kw):
+        pass
+
+    def get_editor_notebook(self):
+        return self._notebook
+
+
+def _summarize(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "median": statistics.median(values),
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+def _pump_until(root, condition, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Assistant did not answer in %s seconds" % timeout)
+        root.update()
+        time.sleep(0.001)
+    return time.perf_counter()
+
+
+def measure_requests(root, view, workbench, count, stream, use_cache):
+    workbench.set_option("assistanceGPT.stream_responses", stream)
+    workbench.set_option("assistanceGPT.response_cache_enabled", use_cache)
+    ttfts = []
+    latencies = []
+    for i in range(count):
+        # questions differ, unless the cache is what we are measuring
+        question = "Warum endet meine Schleife nicht?" + ("" if use_cache else " (%d)" % i)
+        view.user_entry.delete("1.0", "end")
+        view.user_entry.insert("1.0", question)
+        start = time.perf_counter()
+        view.send_message()
+        request = view._pending_request
+        first_token = _pump_until(
+            root, lambda: request.shown_chunk_count > 0 or view._pending_request is None
+        )
+        done = _pump_until(root, lambda: view._pending_request is None)
+        ttfts.append(first_token - start)
+        latencies.append(done - start)
+
+    if use_cache:
+        # the first one filled the cache
+        ttfts, latencies = ttfts[1:], latencies[1:]
+    return {"ttft": _summarize(ttfts), "end_to_end": _summarize(latencies)}
+
+
+def measure_log_writes(history_log_class, directory, sizes):
+    """Average cost of appending one record when the history has reached the given sizes."""
+    record = {
+        "id": "",
+        "date_time": "01.01.2025 08:00:00 Uhr",
+        "header": "Antwort:",
+        "message": ANSWER,
+        "color": "lightblue",
+        "anchor_orientation": "e",
+    }
+    result = {}
+    path = os.path.join(directory, "log_writes", "log_writes.jsonl")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    log = history_log_class(path)
+    written = 0
+    for size in sizes:
+        while written < size - 100:
+            log.append(record)
+            written += 1
+        start = time.perf_counter()
+        for _ in range(100):
+            log.append(record)
+        log.sync()
+        written += 100
+        result[str(size)] = (time.perf_counter() - start) / 100
+    log.close()
+    return result
+
+
+def write_history(history_log_class, gpt_user_dir, code_file_name, bubble_count, get_path):
+    log = history_log_class(get_path(gpt_user_dir, code_file_name))
+    log.clear()
+    for i in range(bubble_count):
+        question = i % 2 == 0
+        log.append(
+            {
+                "id": str(i),
+                "date_time": "01.01.2025 08:00:00 Uhr",
+                "header": "Deine Nachricht:" if question else "Antwort:",
+                "message": "Warum endet meine Schleife nicht?" if question else ANSWER,
+                "color": "lightgreen" if question else "lightblue",
+                "anchor_orientation": "w" if question else "e",
+            }
+        )
+    log.close()
+
+
+def measure_tab_switches(root, view, editor, directory, rounds):
+    def switch_to(name):
+        editor.filename = os.path.join(directory, "code", name + ".py")
+        start = time.perf_counter()
+        view.update_assistant_gpt_viewer()
+        root.update()
+        return time.perf_counter() - start
+
+    switch_to("empty")
+    cold = switch_to("tab_a")
+    cached = []
+    for _ in range(rounds):
+        switch_to("tab_b")
+        cached.append(switch_to("tab_a"))
+    return {"cold": cold, "cached": _summarize(cached)}
+
+
+def _get_rss():
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def measure_bubble_memory(root, view, count):
+    view.clear_canvas(triggered_from_user=False)
+    root.update()
+    rss_before = _get_rss()
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    for i in range(count):
+        view.display_message(
+            "Antwort:", ANSWER, "lightblue", "e", save_to_log=False, date_time=str(i)
+        )
+    root.update()
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    rss_after = _get_rss()
+
+    python_bytes = sum(
+        stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename")
+    )
+    result = {"python_bytes_per_bubble": python_bytes / count}
+    if rss_before is not None and rss_after is not None:
+        # includes the Tk widgets, which tracemalloc can't see
+        result["rss_bytes_per_bubble"] = (rss_after - rss_before) / count
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10, help="requests per scenario")
+    parser.add_argument("--bubbles", type=int, default=200, help="bubbles in a conversation")
+    parser.add_argument("--tab-switches", type=int, default=5)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    user_dir = tempfile.mkdtemp(prefix="thonny_gpt_bench_")
+    os.environ["THONNY_USER_DIR"] = user_dir
+
+    import tkinter as tk
+
+    import thonny
+    from thonny import assistanceGPT
+    from thonny.gpt_utils import ChatHistoryLog, get_history_log_path
+
+    root = tk.Tk()
+    root.geometry("700x900")
+    root.withdraw()
+
+    editor = _FakeEditor(tk.Text(root))
+    editor.get_text_widget().insert("1.0", "zaehler = 0\nwhile zaehler < 10:\n    print(zaehler)\n")
+    workbench = _BenchmarkWorkbench(_FakeEditorNotebook(editor))
+    thonny._workbench = workbench
+    assistanceGPT.init()
+
+    server = start_fake_server(args.first_token_delay, args.token_delay)
+    workbench.set_option("assistanceGPT.gpt_api_key", "bench")
+    workbench.set_option(
+        "assistanceGPT.base_url", "http://127.0.0.1:%d/v1" % server.server_address[1]
+    )
+    workbench.set_option("assistanceGPT.cached_conversations", 5)
+
+    view = assistanceGPT.AssistantViewGPT(root)
+    errors = []
+    view.show_error_dialog = lambda title, message: errors.append(message)
+    view.last_bubble_width = 420
+    view.adjust_bubble_size(420)
+
+    results = {"settings": vars(args)}
+    editor.filename = os.path.join(user_dir, "code", "requests.py")
+    view.update_assistant_gpt_viewer()
+    # the view prints the prompts, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["streaming"] = measure_requests(
+            root, view, workbench, args.requests, stream=True, use_cache=False
+        )
+        results["non_streaming"] = measure_requests(
+            root, view, workbench, args.requests, stream=False, use_cache=False
+        )
+        results["cached"] = measure_requests(
+            root, view, workbench, args.requests + 1, stream=True, use_cache=True
+        )
+    if errors:
+        raise RuntimeError("Requests failed: %s" % errors)
+
+    results["log_append_seconds_at_size"] = measure_log_writes(
+        ChatHistoryLog, user_dir, [100, 1000, 10000]
+    )
+
+    gpt_user_dir = view.GPT_USER_DIR
+    write_history(ChatHistoryLog, gpt_user_dir, "tab_a", args.bubbles, get_history_log_path)
+    write_history(ChatHistoryLog, gpt_user_dir, "tab_b", args.bubbles, get_history_log_path)
+    results["tab_switch_seconds"] = measure_tab_switches(
+        root, view, editor, user_dir, args.tab_switches
+    )
+    results["memory"] = measure_bubble_memory(root, view, args.bubbles)
+
+    server.shutdown()
+    root.destroy()
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Pushes a lot of colored program output through the IO queue of the shell.
+
+Drives BaseShellText._append_to_io_queue and _update_visible_io the way
+_handle_program_output does, with output chunks of the size the reader thread produces.
+Tk text operations are replaced with counting, so the numbers show the cost of the
+Python side and no display is needed. Run from the repository root::
+
+    python -m thonny.test.benchmarks.bench_shell_io --megabytes 100
+"""
+
+import argparse
+import time
+
+import thonny
+from thonny.running import OUTPUT_CHUNK_SIZE
+from thonny.shell import BaseShellText
+
+
+class _BenchmarkWorkbench:
+    def __init__(self):
+        self._options = {"shell.squeeze_threshold": 1000, "shell.auto_inspect_values": False}
+
+    def get_option(self, name, default=None):
+        return self._options.get(name, default)
+
+    def in_heap_mode(self):
+        return False
+
+    def bell(self):
+        pass
+
+
+class _HeadlessShellText(BaseShellText):
+    """Only the state of BaseShellText which the IO queue needs, no widget"""
+
+    def __init__(self):
+        self.tty_mode = True
+        self.active_extra_tags = []
+        self.inserted_char_count = 0
+        self._squeeze_splitter = None
+        self._squeeze_buttons = set()
+        self._io_cursor_offset = 0
+        self._reset_io_events()
+        self._reset_ansi_attributes()
+
+    def direct_insert(self, index, chars, tags=None, **kw):
+        self.inserted_char_count += len(chars)
+
+    def direct_delete(self, index1, index2=None, **kw):
+        pass
+
+    def mark_set(self, name, index):
+        pass
+
+    def mark_gravity(self, name, direction=None):
+        pass
+
+    def index(self, index):
+        return "1.0"
+
+    def get(self, index1, index2=None):
+        return ""
+
+    def see(self, index):
+        pass
+
+    def tag_add(self, tag_name, index1, *args):
+        pass
+
+
+def generate_chunks(total_size, chunk_size):
+    lines = []
+    for i in range(1000):
+        color = 31 + i % 7
+        lines.append("\x1b[%dm%6d\x1b[0m: \x1b[1mvalue\x1b[22m = %s\n" % (color, i, "x" * (i % 60)))
+        if i % 10 == 0:
+            lines.append("progress %3d%%\r" % (i // 10))
+    text = "".join(lines)
+
+    produced = 0
+    pos = 0
+    while produced < total_size:
+        chunk = text[pos : pos + chunk_size]
+        if len(chunk) < chunk_size:
+            chunk += text[: chunk_size - len(chunk)]
+        pos = (pos + chunk_size) % len(text)
+        produced += len(chunk)
+        yield chunk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=100)
+    parser.add_argument("--chunk-size", type=int, default=OUTPUT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    thonny._workbench = _BenchmarkWorkbench()
+    text = _HeadlessShellText()
+    total_size = int(args.megabytes * 1024 * 1024)
+
+    report_step = max(total_size // 10, 1)
+    next_report = report_step
+    step_start = start = time.perf_counter()
+    pushed = 0
+    for chunk in generate_chunks(total_size, args.chunk_size):
+        text._append_to_io_queue(chunk, "stdout")
+        text._update_visible_io(None)
+        pushed += len(chunk)
+        if pushed >= next_report:
+            now = time.perf_counter()
+            print(
+                "%7.1f MB: %6.2f MB/s in last step"
+                % (pushed / 1024 / 1024, report_step / 1024 / 1024 / (now - step_start))
+            )
+            step_start = now
+            next_report += report_step
+
+    elapsed = time.perf_counter() - start
+    print(
+        "%.1f MB in %.2f s, %.2f MB/s, %d chars inserted, %d events"
+        % (
+            pushed / 1024 / 1024,
+            elapsed,
+            pushed / 1024 / 1024 / elapsed,
+            text.inserted_char_count,
+            len(text._applied_io_events),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
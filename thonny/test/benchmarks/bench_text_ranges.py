@@ -0,0 +1,50 @@
+"""Compares token based and native text ranges on the modules of the standard library.
+
+Run from the repository root::
+
+    python -m thonny.test.benchmarks.bench_text_ranges --limit 200
+"""
+
+import argparse
+import ast
+import glob
+import os.path
+import time
+
+from thonny import ast_utils
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limit", type=int, default=200, help="number of modules")
+    args = parser.parse_args(argv)
+
+    sources = []
+    stdlib_dir = os.path.dirname(ast.__file__)
+    for path in sorted(glob.glob(os.path.join(stdlib_dir, "*.py")))[: args.limit]:
+        with open(path, "rb") as fp:
+            sources.append(fp.read().decode("utf-8", errors="replace"))
+
+    for name, mark in [
+        ("tokens", ast_utils._mark_text_ranges_from_tokens),
+        ("native", ast_utils._mark_text_ranges_from_native_positions),
+    ]:
+        parse_time = mark_time = 0.0
+        node_count = 0
+        for source in sources:
+            start = time.perf_counter()
+            tree = ast.parse(source)
+            parsed = time.perf_counter()
+            mark(tree, source)
+            parse_time += parsed - start
+            mark_time += time.perf_counter() - parsed
+            node_count += sum(1 for _ in ast.walk(tree))
+
+        print(
+            "%s: %d modules, %d nodes, parse %.2f s, mark ranges %.2f s"
+            % (name, len(sources), node_count, parse_time, mark_time)
+        )
+
+
+if __name__ == "__main__":
+    main()
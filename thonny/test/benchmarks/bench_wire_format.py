@@ -0,0 +1,106 @@
+"""Compares the legacy and the framed wire format on realistic DebuggerResponse messages.
+
+Run from the repository root::
+
+    python -m thonny.test.benchmarks.bench_wire_format --frames 30 --variables 200
+"""
+
+import argparse
+import io
+import timeit
+
+from thonny.common import (
+    FRAMED_WIRE_FORMAT,
+    LEGACY_WIRE_FORMAT,
+    DebuggerResponse,
+    FrameInfo,
+    TextRange,
+    ValueInfo,
+    parse_message,
+    read_one_incoming_message_str,
+    serialize_message,
+)
+
+
+def make_debugger_response(frame_count, variable_count):
+    source = "".join(
+        "def funktsioon_%d(väärtus):\n    return väärtus * %d  # läheb ümber\n" % (i, i)
+        for i in range(100)
+    )
+    globals_ = {
+        "muutuja_%d" % i: ValueInfo(140000000 + i, repr(["väärtus %d" % i] * (i % 10)))
+        for i in range(variable_count)
+    }
+    stack = []
+    for i in range(frame_count):
+        focus = TextRange(2 * i + 2, 4, 2 * i + 2, 30)
+        stack.append(
+            FrameInfo(
+                id=139000000 + i,
+                filename="/home/õpilane/projekt/moodul.py",
+                module_name="__main__",
+                code_name="funktsioon_%d" % i,
+                source=source,
+                lineno=2 * i + 2,
+                firstlineno=2 * i + 1,
+                in_library=False,
+                locals={"väärtus": ValueInfo(141000000 + i, str(i))},
+                globals=globals_,
+                freevars=(),
+                event="before_expression",
+                focus=focus,
+                node_tags={"call_function", "has_children"},
+                current_statement=focus,
+                current_root_expression=focus,
+                current_evaluations=[
+                    (TextRange(2 * i + 2, 11, 2 * i + 2, 18 + j), ValueInfo(142000000 + j, str(j)))
+                    for j in range(5)
+                ],
+            )
+        )
+    return DebuggerResponse(
+        stack=stack,
+        in_present=True,
+        io_symbol_count=None,
+        exception_info={"id": None, "msg": None, "type_name": None, "items": None},
+        loaded_modules=["__main__", "moodul"],
+        tracer_class="NiceTracer",
+    )
+
+
+def transfer(msg, wire_format):
+    # what happens between backend's send_message and the reader thread of the front-end
+    stream = io.StringIO(serialize_message(msg, wire_format=wire_format) + "\n")
+    return parse_message(read_one_incoming_message_str(stream.readline))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--variables", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    msg = make_debugger_response(args.frames, args.variables)
+    print("%d frames, %d globals per frame" % (args.frames, args.variables))
+    for name, wire_format in [("legacy", LEGACY_WIRE_FORMAT), ("framed", FRAMED_WIRE_FORMAT)]:
+        msg_str = serialize_message(msg, wire_format=wire_format)
+        assert transfer(msg, wire_format) == msg
+        serialize_time = min(
+            timeit.repeat(
+                lambda: serialize_message(msg, wire_format=wire_format),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        transfer_time = min(
+            timeit.repeat(lambda: transfer(msg, wire_format), number=1, repeat=args.repeat)
+        )
+        print(
+            "%s: %8d chars, serialize %7.2f ms, serialize + read + parse %7.2f ms"
+            % (name, len(msg_str), serialize_time * 1000, transfer_time * 1000)
+        )
+
+
+if __name__ == "__main__":
+    main()
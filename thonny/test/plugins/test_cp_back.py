@@ -0,0 +1,151 @@
+import types
+
+from thonny.common import InlineCommand, ValueInfo
+from thonny.plugins.cpython_backend import cp_back
+from thonny.plugins.cpython_backend.cp_back import (
+    MainCPythonBackend,
+    ObjectHeap,
+    ReprCache,
+    _get_limited_repr,
+)
+
+
+def test_repr_cache_reuses_only_immutable_values():
+    small_list = [1, 2]
+    big_list = list(range(2000))
+    text = "tekst"
+    cache = ReprCache()
+
+    cache.start_step()
+    for value in [small_list, big_list, text]:
+        assert cache.get(value) is None
+        cache.put(value, ValueInfo(id(value), repr(value)[:100]))
+        assert cache.get(value) == ValueInfo(id(value), repr(value)[:100])
+
+    cache.start_step()
+    # mutable values are repr-ed again in every step
+    assert cache.get(small_list) is None
+    assert cache.get(big_list) is None
+    assert cache.get(text) == ValueInfo(id(text), repr(text))
+
+    # values not seen in last step are forgotten
+    cache.start_step()
+    cache.start_step()
+    assert cache.get(text) is None
+
+
+class _Node:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return "Node" + repr(self.children)
+
+
+def test_limited_repr_is_prefix_of_repr():
+    recursive_list = [1]
+    recursive_list.append(recursive_list)
+    recursive_dict = {"õ": (recursive_list,)}
+    recursive_dict[2] = recursive_dict
+    node_children = [1.5, None]
+    node_children.append(_Node(node_children))
+
+    values = [
+        recursive_list,
+        recursive_dict,
+        node_children,
+        [list(range(i, i + 1000)) for i in range(20)],
+        ((1,), (), [], {}, set(), frozenset(), frozenset({"a"}), {b"b": {3, 4}}),
+        [len, int, -0.0, True, "jutumärgid '\"", range(3)],
+    ]
+    for value in values:
+        full_repr = repr(value)
+        for max_length in [0, 1, 10, 100, 5000]:
+            limited_repr = _get_limited_repr(value, max_length)
+            assert full_repr.startswith(limited_repr)
+            assert limited_repr == full_repr or len(limited_repr) > max_length
+
+
+def _create_backend():
+    # only the parts needed for exporting values
+    backend = MainCPythonBackend.__new__(MainCPythonBackend)
+    backend._heap = ObjectHeap()
+    backend._exported_globals = None
+    return backend
+
+
+def test_globals_delta_notices_in_place_mutation(monkeypatch):
+    main_module = types.ModuleType("__main__")
+    monkeypatch.setattr(cp_back, "__main__", main_module)
+    backend = _create_backend()
+
+    data = [0] * 5000
+    main_module.data = data
+    main_module.text = "tekst"
+    delta = backend.export_globals_delta()
+    assert delta["full"] and set(delta["changed"]) == {"data", "text"}
+
+    data[0] = 99
+    delta = backend.export_globals_delta()
+    assert not delta["full"] and list(delta["changed"]) == ["data"]
+    assert delta["changed"]["data"].repr.startswith("[99, 0, 0")
+
+    del main_module.text
+    delta = backend.export_globals_delta()
+    assert delta["changed"] == {} and delta["removed"] == ["text"]
+
+
+def _get_page(backend, value, offset, limit=500):
+    return backend._cmd_get_object_elements(
+        InlineCommand("get_object_elements", object_id=id(value), offset=offset, limit=limit)
+    )
+
+
+def test_get_object_elements_pages():
+    backend = _create_backend()
+    items = list(range(1001))
+    backend.export_value(items)
+
+    page = _get_page(backend, items, 500)
+    assert page["elements_offset"] == 500 and page["elements_total"] == 1001
+    assert [info.repr for info in page["elements"]] == [str(i) for i in range(500, 1000)]
+    assert [info.repr for info in _get_page(backend, items, 1000)["elements"]] == ["1000"]
+    assert _get_page(backend, items, 1001)["elements"] == []
+
+    entries = {"k%d" % i: i for i in range(1001)}
+    backend.export_value(entries)
+    page = _get_page(backend, entries, 1000)
+    assert page["entries_offset"] == 1000 and page["entries_total"] == 1001
+    assert [(k.repr, v.repr) for k, v in page["entries"]] == [("'k1000'", "1000")]
+    assert _get_page(backend, entries, 1001)["entries"] == []
+
+    numbers = set(range(0, 2002, 2))
+    backend.export_value(numbers)
+    pages = [_get_page(backend, numbers, offset) for offset in range(0, 1001, 500)]
+    assert [len(page["elements"]) for page in pages] == [500, 500, 1]
+    assert {int(info.repr) for page in pages for info in page["elements"]} == numbers
+
+
+def test_get_object_elements_of_non_container():
+    backend = _create_backend()
+    value = 3.5
+    backend.export_value(value)
+    assert _get_page(backend, value, 0) == {"id": id(value), "error": "object has no elements"}
+    assert "error" in _get_page(backend, object(), 0)
+
+
+def test_exported_variables_show_in_place_mutation_in_next_step():
+    backend = _create_backend()
+    cache = ReprCache()
+    data = [0] * 5000
+    variables = {"data": data, "text": "tekst"}
+
+    cache.start_step()
+    first = backend.export_variables(variables, cache)
+    assert first["data"].repr.startswith("[0, 0")
+
+    data[0] = 99
+    cache.start_step()
+    second = backend.export_variables(variables, cache)
+    assert second["data"].repr.startswith("[99, 0")
+    assert second["text"] == first["text"]
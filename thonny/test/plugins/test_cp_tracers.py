@@ -0,0 +1,267 @@
+import ast
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from thonny.common import (
+    DebuggerCommand,
+    DebuggerResponse,
+    TextRange,
+    ToplevelCommand,
+    ValueInfo,
+)
+from thonny.plugins.cpython_backend.cp_tracers import (
+    StateHistory,
+    TempFrameInfo,
+    _load_instrumented_code,
+    _store_instrumented_code,
+)
+
+
+class _SystemFrame:
+    def __init__(self, module_name):
+        self.f_globals = {"__name__": module_name}
+
+
+def _make_stack(frame_variables, step):
+    stack = []
+    for system_frame, locals_ in frame_variables:
+        stack.append(
+            TempFrameInfo(
+                system_frame=system_frame,
+                locals=locals_,
+                globals={"counter": ValueInfo(1, str(step // 10))},
+                event="before_statement",
+                focus=TextRange(step, 0, step, 5),
+                node_tags=set(),
+                current_statement=None,
+                current_root_expression=None,
+                current_evaluations=[],
+            )
+        )
+    return stack
+
+
+def _make_state():
+    return {"stack": None, "active_frame_overrides": {}}
+
+
+def _run_loop(history, step_count):
+    main_frame = _SystemFrame("__main__")
+    fun_frame = _SystemFrame("__main__")
+    expected = []
+    for step in range(step_count):
+        frame_variables = [(main_frame, None)]
+        if step % 3:
+            frame_variables.append((fun_frame, {"i": ValueInfo(step, str(step))}))
+        stack = _make_stack(frame_variables, step)
+        history.append(_make_state(), stack)
+        expected.append(stack)
+
+        # state with same variables
+        state = _make_state()
+        state["stack"] = history[-1]["stack"]
+        history.append(state)
+        expected.append(stack)
+
+    return expected
+
+
+def test_state_history_restores_variables():
+    history = StateHistory()
+    history.checkpoint_interval = 7
+    expected = _run_loop(history, 50)
+
+    assert len(history) == 100
+    for index in range(len(history)):
+        restored = history.get_stack(index)
+        assert [(f.locals, f.globals, f.focus) for f in restored] == [
+            (f.locals, f.globals, f.focus) for f in expected[index]
+        ]
+        assert all(f.locals is None and f.globals is None for f in history[index]["stack"])
+
+    new_stack = _make_stack([(expected[-1][0].system_frame, None)], 1000)
+    history.replace_last_stack(new_stack)
+    assert history.get_stack(-1)[0].globals == {"counter": ValueInfo(1, "100")}
+    assert len(history.get_stack(-1)) == 1
+
+
+def test_state_history_drops_oldest_states_when_full():
+    history = StateHistory(max_bytes=20000)
+    history.checkpoint_interval = 10
+    expected = _run_loop(history, 500)
+
+    stats = history.get_stats()
+    assert stats["bytes"] <= 20000
+    assert stats["dropped_count"] == history.first_index > 0
+    assert stats["state_count"] == len(history) - history.first_index == 1000 - history.first_index
+    assert history.first_index % 10 == 0
+
+    assert [f.locals for f in history.get_stack(history.first_index)] == [
+        f.locals for f in expected[history.first_index]
+    ]
+
+
+def test_instrumented_code_survives_cache_roundtrip(tmp_path):
+    tree = ast.parse("x = 1 + 2\n")
+    statement = tree.body[0]
+    expression = statement.value
+    expression.parent_node = statement
+    expression.tags = {"BinOp", "has_children"}
+    statement.parent_node = tree
+    nodes = {10: statement, 11: expression}
+
+    path = str(tmp_path / "cache" / "key.pickle")
+    assert _load_instrumented_code(path) is None
+    _store_instrumented_code(path, compile(tree, "<test>", "exec"), nodes)
+
+    code, cached_nodes = _load_instrumented_code(path)
+    namespace = {}
+    exec(code, namespace)
+    assert namespace["x"] == 3
+
+    assert (cached_nodes[11].lineno, cached_nodes[11].end_col_offset) == (1, 9)
+    assert cached_nodes[11].tags == {"BinOp", "has_children"}
+    assert cached_nodes[11].parent_node is cached_nodes[10]
+
+
+class _FakeBackend:
+    """Feeds scripted debugger commands to a tracer and records what it reports"""
+
+    def __init__(self, command_names, breakpoints):
+        self.command_names = list(command_names)
+        self.breakpoints = breakpoints
+        self.reports = []
+        self._last_stack = None
+
+    def _fetch_next_incoming_message(self):
+        if self.command_names:
+            name = self.command_names.pop(0)
+            breakpoints = self.breakpoints
+        else:
+            name = "resume"
+            breakpoints = {}
+        return DebuggerCommand(
+            name,
+            state=None,
+            focus=None,
+            frame_id=self._last_stack[-1].id,
+            exception=None,
+            breakpoints=breakpoints,
+        )
+
+    def send_message(self, msg):
+        if isinstance(msg, DebuggerResponse):
+            self._last_stack = msg.stack
+            self.reports.append(
+                (
+                    [(frame.code_name, frame.lineno) for frame in msg.stack],
+                    msg.exception_info["type_name"],
+                )
+            )
+
+    def _export_stack(self, newest_frame, relevance_checker=None, repr_cache=None):
+        result = []
+        frame = newest_frame
+        while frame is not None:
+            if relevance_checker(frame):
+                result.insert(
+                    0,
+                    SimpleNamespace(
+                        id=id(frame), code_name=frame.f_code.co_name, lineno=frame.f_lineno
+                    ),
+                )
+            frame = frame.f_back
+        return result
+
+    def is_doing_io(self):
+        return False
+
+    def get_option(self, name, default=None):
+        return default
+
+    def _install_custom_import(self):
+        pass
+
+    def _prepare_user_exception(self):
+        return {"type_name": sys.exc_info()[0].__name__}
+
+
+DEBUGGED_PROGRAM = """def fact(n):
+    if n <= 1:
+        return 1
+    result = n * fact(n - 1)
+    return result
+
+
+def fail():
+    try:
+        {}["missing"]
+    except KeyError:
+        pass
+    return int("x")
+
+
+values = []
+for i in range(3):
+    values.append(fact(i + 2))
+try:
+    fail()
+except ValueError:
+    values.append(None)
+total = fact(3) + fact(2)
+print(values, total)
+
+
+def squares(n):
+    for i in range(n):
+        yield i * i
+
+
+print(sum(squares(3)))
+"""
+
+
+def _trace_program(tracer_class, tmp_path, command_names, breakpoint_lines=()):
+    path = str(tmp_path / "debugged.py")
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(DEBUGGED_PROGRAM)
+
+    breakpoints = {path: set(breakpoint_lines)} if breakpoint_lines else {}
+    backend = _FakeBackend(command_names, breakpoints)
+    tracer = tracer_class(
+        backend, ToplevelCommand("FastDebug", args=[path], breakpoints=breakpoints)
+    )
+    tracer._main_module_path = path
+    code = compile(DEBUGGED_PROGRAM, path, "exec")
+    result = tracer._execute_prepared_user_code(code, {"__name__": "__main__"})
+    assert "user_exception" not in result
+    return backend.reports
+
+
+@pytest.mark.skipif(sys.version_info < (3, 12), reason="sys.monitoring is new in 3.12")
+@pytest.mark.parametrize(
+    "command_names, breakpoint_lines",
+    [
+        (["step_into"] * 80, ()),
+        (["step_over"] * 30, ()),
+        (["step_into"] * 4 + ["step_out"] * 10, ()),
+        (["step_into", "step_into", "step_over", "step_into"] * 10, ()),
+        (["resume"] * 10, (3, 13, 23)),
+        (["step_out", "resume", "step_over", "step_into", "step_into", "step_into"], (4, 11)),
+        (["resume", "step_out"] * 5, (2, 4)),
+        (["resume", "step_into", "step_over", "step_into"], (10, 12)),
+        (["step_over", "step_out", "step_out", "resume", "step_out", "resume"], (11, 13)),
+        (["resume"] + ["step_over"] * 8 + ["step_out"] * 3, (29,)),
+    ],
+)
+def test_monitoring_fast_tracer_reports_same_states_as_fast_tracer(
+    tmp_path, command_names, breakpoint_lines
+):
+    from thonny.plugins.cpython_backend.cp_tracers import FastTracer, MonitoringFastTracer
+
+    expected = _trace_program(FastTracer, tmp_path, command_names, breakpoint_lines)
+    assert len(expected) > 1
+    actual = _trace_program(MonitoringFastTracer, tmp_path, command_names, breakpoint_lines)
+    assert actual == expected
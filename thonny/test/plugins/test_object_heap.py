@@ -0,0 +1,45 @@
+import gc
+
+from thonny.plugins.cpython_backend.cp_back import ObjectHeap
+
+
+class _Node:
+    pass
+
+
+def test_recent_generation_is_bounded():
+    heap = ObjectHeap()
+    heap.max_recent_count = 3
+    values = [[i] for i in range(5)]
+    for value in values:
+        heap.add(value)
+
+    # lists can't be referenced weakly, so evicted ones are gone
+    assert id(values[0]) not in heap
+    assert all(id(value) in heap for value in values[2:])
+    assert heap.get_stats()["evicted_count"] == 2
+
+
+def test_evicted_objects_stay_while_alive():
+    heap = ObjectHeap()
+    heap.max_recent_count = 1
+    alive = _Node()
+    key = heap.add(alive)
+    temporary_key = heap.add(_Node())  # evicts alive, stays weakly referenced
+    heap.add(_Node())
+    gc.collect()
+
+    assert heap[key] is alive
+    assert temporary_key not in heap
+
+
+def test_pinned_object_survives_pruning():
+    heap = ObjectHeap()
+    key = heap.add([1, 2, 3])
+    heap.pin("object_inspector", heap[key])
+    heap.add({"a": 1})
+    heap.prune()
+
+    assert heap.get_stats()["recent_count"] == 0
+    assert heap[key] == [1, 2, 3]
+    assert [k for k, _ in heap.items()] == [key]
@@ -0,0 +1,87 @@
+from thonny.common import ValueInfo
+from thonny.plugins import object_inspector
+from thonny.plugins.object_inspector import DictInspector, ElementsInspector
+
+
+class _FakeWorkbench:
+    def in_heap_mode(self):
+        return False
+
+
+class _FakeTree:
+    def __init__(self):
+        self.rows = {}
+
+    def configure(self, **kw):
+        pass
+
+    def get_children(self, item=""):
+        return list(self.rows)
+
+    def delete(self, *items):
+        for item in items:
+            del self.rows[item]
+
+    def insert(self, parent, index):
+        node_id = "row%d" % len(self.rows)
+        self.rows[node_id] = {}
+        return node_id
+
+    def set(self, node_id, column, value):
+        self.rows[node_id][column] = value
+
+
+class _FakeLabel:
+    def configure(self, text):
+        self.text = text
+
+
+def _create_inspector(cls, monkeypatch):
+    # only the parts needed for showing the pages, without Tk widgets
+    monkeypatch.setattr(object_inspector, "get_workbench", lambda: _FakeWorkbench())
+    inspector = cls.__new__(cls)
+    inspector.tree = _FakeTree()
+    inspector.len_label = _FakeLabel()
+    inspector.context_id = None
+    inspector._loaded_count = 0
+    inspector._total_count = 0
+    inspector._page_requested = False
+    return inspector
+
+
+def _values(start, end):
+    return [ValueInfo(i, repr(i)) for i in range(start, end)]
+
+
+def test_elements_inspector_shows_pages(monkeypatch):
+    inspector = _create_inspector(ElementsInspector, monkeypatch)
+    inspector.set_object_info(
+        {"id": 1, "type": repr(list), "elements": _values(0, 500), "elements_total": 501}
+    )
+    assert len(inspector.tree.rows) == 500
+    assert inspector.len_label.text == " len: 501 (500 shown)"
+
+    # responses for other objects or offsets are ignored
+    inspector._handle_page_response({"id": 2, "elements": _values(0, 1), "elements_offset": 500})
+    inspector._handle_page_response({"id": 1, "elements": _values(0, 1), "elements_offset": 0})
+    inspector._handle_page_response({"id": 1, "error": "object has no elements"})
+    assert len(inspector.tree.rows) == 500
+
+    inspector._handle_page_response(
+        {"id": 1, "elements": _values(500, 501), "elements_offset": 500}
+    )
+    assert inspector.tree.rows["row500"] == {"index": 500, "id": "0x1f4", "value": "500"}
+    assert inspector.len_label.text == " len: 501"
+
+
+def test_dict_inspector_shows_pages(monkeypatch):
+    inspector = _create_inspector(DictInspector, monkeypatch)
+    entries = list(zip(_values(0, 500), _values(1000, 1500)))
+    inspector.set_object_info({"id": 1, "entries": entries, "entries_total": 501})
+    assert len(inspector.tree.rows) == 500
+
+    inspector._handle_page_response(
+        {"id": 1, "entries": [(ValueInfo(7, "'k'"), ValueInfo(8, "8"))], "entries_offset": 500}
+    )
+    assert inspector.tree.rows["row500"]["key"] == "'k'"
+    assert inspector.len_label.text == " len: 501"
@@ -0,0 +1,97 @@
+import ast
+import os.path
+import sys
+
+import pytest
+
+from thonny import ast_utils
+
+STDLIB_MODULES = [
+    "_collections_abc.py",
+    "argparse.py",
+    "ast.py",
+    "asyncio/tasks.py",
+    "dataclasses.py",
+    "email/_header_value_parser.py",
+    "functools.py",
+    "json/decoder.py",
+    "logging/config.py",
+    "shlex.py",
+    "typing.py",
+]
+
+TEST_SOURCE = """# -*- coding: utf-8 -*-
+import os.path as pth; from typing import List
+
+@staticmethod
+@ functools.lru_cache(maxsize=None)
+def mõõt(a, b: "ühik" = "ää", *args, c=(1, 2), **kw) -> List[str]:
+    if a: b = "õun" + 'ä'; c = a ;
+    return [ä for ä in (a, b) if (ä and b)]
+
+class Õpilane(object): nimi = "Jüri"; vanus = 12;
+
+with open("ö") as fp, open("ä") as fp2: x = fp.read(); y = f"{x!r:>10}ü{fp2}"
+match mõõt(1, 2):
+    case [1, *rest] | {"õ": 2} as m if rest: pass
+    case Õpilane(nimi="ä"): pass
+"""
+
+
+def _get_ranges(tree):
+    ranges = []
+    f_string_parts = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.JoinedStr):
+            f_string_parts.update(map(id, ast.walk(node)))
+
+        if (
+            hasattr(node, "lineno")
+            # asttokens gives too short ranges to these
+            and not isinstance(node, ast.alias)
+            and not (sys.version_info >= (3, 10) and isinstance(node, ast.pattern))
+            # asttokens leaves these with byte offsets
+            and id(node) not in f_string_parts
+        ):
+            ranges.append(
+                (
+                    type(node).__name__,
+                    node.lineno,
+                    node.col_offset,
+                    node.end_lineno,
+                    node.end_col_offset,
+                )
+            )
+    return ranges
+
+
+def _assert_same_ranges_as_tokens(source):
+    native_tree = ast.parse(source)
+    ast_utils._mark_text_ranges_from_native_positions(native_tree, source)
+    token_tree = ast.parse(source)
+    ast_utils._mark_text_ranges_from_tokens(token_tree, source)
+    assert _get_ranges(native_tree) == _get_ranges(token_tree)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="test source uses match")
+def test_native_text_ranges_handle_special_cases():
+    _assert_same_ranges_as_tokens(TEST_SOURCE)
+
+    tree = ast.parse(TEST_SOURCE)
+    ast_utils.mark_text_ranges(tree, TEST_SOURCE.encode("utf-8"))
+    function = tree.body[2]
+    assert (function.lineno, function.col_offset, function.name) == (4, 0, "mõõt")
+    return_value = function.body[1].value
+    assert ast_utils.extract_text_range(TEST_SOURCE, return_value) == (
+        "[ä for ä in (a, b) if (ä and b)]"
+    )
+    assert return_value.generators[0].end_col_offset == return_value.end_col_offset - 2
+
+
+@pytest.mark.skipif(sys.version_info < (3, 9), reason="native ranges are used since 3.9")
+@pytest.mark.parametrize("module_path", STDLIB_MODULES)
+def test_native_text_ranges_match_token_ranges_for_stdlib(module_path):
+    path = os.path.join(os.path.dirname(ast.__file__), *module_path.split("/"))
+    with open(path, encoding="utf-8") as fp:
+        source = fp.read()
+    _assert_same_ranges_as_tokens(source)
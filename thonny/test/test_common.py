@@ -31,3 +31,86 @@ def test_path_startswith():
         assert path_startswith("c:\\foo\\bar.txt/kala\\pala", "C:\\")
 
         assert not path_startswith("C:\\kalapala\\pala", "C:\\kala")
+
+
+def _make_debugger_response():
+    from thonny.common import DebuggerResponse, FrameInfo, TextRange, ValueInfo
+
+    frame = FrameInfo(
+        id=140234,
+        filename="/home/õpilane/kala.py",
+        module_name="__main__",
+        code_name="<module>",
+        source="x = [1, 2]\nprint('tšau', x)\n",
+        lineno=2,
+        firstlineno=1,
+        in_library=False,
+        locals=None,
+        globals={"x": ValueInfo(1402, "[1, 2]"), "~": ValueInfo(1403, "'tilde'")},
+        freevars=(),
+        event="before_statement",
+        focus=TextRange(2, 0, 2, 17),
+        node_tags={"statement", "call_function"},
+        current_statement=TextRange(2, 0, 2, 17),
+        current_root_expression=None,
+        current_evaluations=[(TextRange(2, 6, 2, 12), ValueInfo(1404, "'tšau'"))],
+    )
+    return DebuggerResponse(
+        stack=[frame],
+        in_present=True,
+        io_symbol_count=None,
+        exception_info={"id": None, "msg": "\x00\r\n", "items": {1: b"\xff", (2, 3): float("nan")}},
+        loaded_modules=frozenset({"kala"}),
+        tracer_class="NiceTracer",
+    )
+
+
+def test_framed_message_round_trip():
+    from thonny.common import (
+        FRAME_MARKER,
+        FRAMED_WIRE_FORMAT,
+        parse_message,
+        read_one_incoming_message_str,
+        serialize_message,
+    )
+
+    msg = _make_debugger_response()
+    msg_str = serialize_message(msg, wire_format=FRAMED_WIRE_FORMAT)
+    assert msg_str.startswith(FRAME_MARKER)
+    assert "\n" not in msg_str and "tšau" in msg_str
+
+    # reader may give the frame in pieces
+    pieces = [msg_str[:50], msg_str[50:] + "\n"]
+    received = read_one_incoming_message_str(lambda: pieces.pop(0) if pieces else "")
+    parsed = parse_message(received)
+
+    assert type(parsed) is type(msg)
+    items = parsed.exception_info.pop("items")
+    assert items[1] == b"\xff" and items[(2, 3)] != items[(2, 3)]
+    msg.exception_info.pop("items")
+    assert parsed == msg
+    assert parsed.stack[0].node_tags == {"statement", "call_function"}
+
+
+def test_framed_message_falls_back_to_legacy_format():
+    from thonny.common import (
+        FRAMED_WIRE_FORMAT,
+        MESSAGE_MARKER,
+        FRAME_MARKER,
+        BackendEvent,
+        ToplevelResponse,
+        parse_message,
+        serialize_message,
+    )
+
+    # complex numbers are not part of the framed format
+    msg = ToplevelResponse(value=1j)
+    msg_str = serialize_message(msg, wire_format=FRAMED_WIRE_FORMAT)
+    assert msg_str.startswith(MESSAGE_MARKER) and not msg_str.startswith(FRAME_MARKER)
+    assert parse_message(msg_str) == msg
+
+    # lone surrogates can't be written to UTF-8 stdout
+    msg = BackendEvent("ProgramOutput", stream_name="stdout", data="a\udc80b")
+    msg_str = serialize_message(msg, wire_format=FRAMED_WIRE_FORMAT)
+    assert msg_str.startswith(MESSAGE_MARKER) and msg_str.isascii()
+    assert parse_message(msg_str) == msg
@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from thonny.gpt_gateway import QUOTA_EXCEEDED_CODE, create_server, start_in_background
+
+
+class _FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(request)
+        time.sleep(self.server.delay)
+        body = json.dumps(
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": 0,
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": "Antwort auf " + request["messages"][-1]["content"],
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_upstream():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeUpstreamHandler)
+    server.requests = []
+    server.delay = 0.3
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _post(url, student, question, stream=False):
+    data = json.dumps(
+        {
+            "model": "test-model",
+            "messages": [{"role": "user", "content": question}],
+            "stream": stream,
+        }
+    ).encode("utf-8")
+    request = urllib.request.Request(
+        url + "/chat/completions",
+        data=data,
+        headers={"Content-Type": "application/json", "Authorization": "Bearer " + student},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8")
+
+
+def _start_gateway(fake_upstream, tmp_path, **kw):
+    kw.setdefault("student_tokens", ["anna", "ben"] + ["student%d" % i for i in range(10)])
+    return start_in_background(
+        "secret",
+        host="127.0.0.1",
+        port=0,
+        upstream_url="http://127.0.0.1:%d/v1" % fake_upstream.server_address[1],
+        cache_dir=str(tmp_path),
+        **kw,
+    )
+
+
+def test_gateway_coalesces_and_caches(fake_upstream, tmp_path):
+    gateway_server = _start_gateway(fake_upstream, tmp_path)
+    url = gateway_server.get_url()
+    try:
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda i=i: results.append(_post(url, "student%d" % i, "Was ist x?"))
+            )
+            for i in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(fake_upstream.requests) == 1
+        assert fake_upstream.requests[0]["stream"] is False
+        for status, body in results:
+            assert status == 200
+            assert json.loads(body)["choices"][0]["message"]["content"] == "Antwort auf Was ist x?"
+
+        status, body = _post(url, "student9", "was ist  x?", stream=True)
+        assert status == 200
+        assert len(fake_upstream.requests) == 1
+        assert '"content": "Antwort auf Was ist x?"' in body
+        assert body.endswith("data: [DONE]\n\n")
+        assert gateway_server.gateway.stats["cache_hits"] == 1
+    finally:
+        gateway_server.shutdown()
+        gateway_server.server_close()
+
+
+def test_gateway_enforces_quota(fake_upstream, tmp_path):
+    fake_upstream.delay = 0
+    gateway_server = _start_gateway(fake_upstream, tmp_path, requests_per_hour=2)
+    url = gateway_server.get_url()
+    try:
+        assert _post(url, "anna", "Frage 1")[0] == 200
+        assert _post(url, "anna", "Frage 2")[0] == 200
+        status, body = _post(url, "anna", "Frage 3")
+        assert status == 429
+        assert json.loads(body)["error"]["code"] == QUOTA_EXCEEDED_CODE
+        # other students and cached answers are not affected
+        assert _post(url, "ben", "Frage 3")[0] == 200
+        assert _post(url, "anna", "Frage 1")[0] == 200
+        assert len(fake_upstream.requests) == 3
+    finally:
+        gateway_server.shutdown()
+        gateway_server.server_close()
+
+
+def test_gateway_rejects_unknown_tokens(fake_upstream, tmp_path):
+    fake_upstream.delay = 0
+    gateway_server = _start_gateway(fake_upstream, tmp_path, student_tokens=["anna"])
+    url = gateway_server.get_url()
+    try:
+        assert _post(url, "anna", "Frage 1")[0] == 200
+        assert _post(url, "mallory", "Frage 2")[0] == 401
+        assert _post(url, "", "Frage 3")[0] == 401
+        assert len(fake_upstream.requests) == 1
+    finally:
+        gateway_server.shutdown()
+        gateway_server.server_close()
+
+
+def test_gateway_without_tokens_counts_quota_per_address(fake_upstream, tmp_path):
+    fake_upstream.delay = 0
+    gateway_server = _start_gateway(
+        fake_upstream, tmp_path, student_tokens=None, requests_per_hour=1
+    )
+    url = gateway_server.get_url()
+    try:
+        assert _post(url, "anna", "Frage 1")[0] == 200
+        # changing the API key doesn't give a new quota
+        assert _post(url, "ben", "Frage 2")[0] == 429
+        assert len(fake_upstream.requests) == 1
+    finally:
+        gateway_server.shutdown()
+        gateway_server.server_close()
+
+
+def test_gateway_without_tokens_listens_only_locally():
+    with pytest.raises(ValueError):
+        create_server("secret", host="0.0.0.0", port=0)
+
+    server = create_server("secret", port=0)
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+    finally:
+        server.server_close()
+        server.gateway.upstream.close()
@@ -0,0 +1,216 @@
+import json
+import os
+
+import pytest
+
+from thonny import gpt_utils
+from thonny.gpt_utils import (
+    ChatHistoryLog,
+    ResponseCache,
+    build_chat_messages,
+    call_with_retries,
+    estimate_message_tokens,
+    estimate_tokens,
+    get_history_log_path,
+    parse_request_settings,
+    select_relevant_code,
+)
+
+
+def _record(i):
+    return {"id": str(i), "header": "Antwort:", "message": "Nachricht %d" % i}
+
+
+def test_history_log_appends_and_reads(tmp_path):
+    log = ChatHistoryLog(get_history_log_path(str(tmp_path), "aufgabe"))
+    for i in range(7):
+        log.append(_record(i))
+    log.close()
+
+    assert [r["message"] for r in log.read_records()] == ["Nachricht %d" % i for i in range(7)]
+
+    log.clear()
+    assert log.read_records() == []
+
+
+def test_history_log_survives_partial_line(tmp_path):
+    path = get_history_log_path(str(tmp_path), "aufgabe")
+    log = ChatHistoryLog(path)
+    log.append(_record(1))
+    log.close()
+    with open(path, "ab") as fp:
+        fp.write(b'{"id": "2", "mess')
+
+    log = ChatHistoryLog(path)
+    assert [r["id"] for r in log.read_records()] == ["1"]
+    log.append(_record(3))
+    log.close()
+    assert [r["id"] for r in log.read_records()] == ["1", "3"]
+
+
+def test_history_log_migrates_legacy_json(tmp_path):
+    path = get_history_log_path(str(tmp_path), "aufgabe")
+    legacy_path = os.path.splitext(path)[0] + ".json"
+    os.makedirs(os.path.dirname(path))
+    with open(legacy_path, "w", encoding="utf-8") as fp:
+        json.dump({"a": {"message": "alt"}, "b": {"message": "älter"}}, fp)
+
+    log = ChatHistoryLog(path)
+    assert not os.path.exists(legacy_path)
+    assert [(r["id"], r["message"]) for r in log.read_records()] == [("a", "alt"), ("b", "älter")]
+
+
+def test_build_chat_messages_keeps_everything_within_budget():
+    old_messages = [
+        {"role": "user", "content": "Was ist eine Schleife?"},
+        {"role": "assistant", "content": "Eine Schleife wiederholt Anweisungen."},
+    ]
+    messages, tokens = build_chat_messages(
+        "Du bist Lehrkraft.", "x = 1", "Warum?", old_messages, 1000
+    )
+
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[-1]["content"] == "```x = 1```\n\nFrage des Schülers: Warum?"
+    assert tokens == estimate_message_tokens(messages)
+
+
+def test_build_chat_messages_summarizes_old_turns():
+    old_messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": "Nachricht %d " % i * 20}
+        for i in range(20)
+    ]
+    messages, tokens = build_chat_messages(
+        "Du bist Lehrkraft.", "x = 1", "Warum?", old_messages, 400
+    )
+
+    assert tokens <= 400
+    assert messages[1]["role"] == "system"
+    assert messages[1]["content"].startswith("Bisheriger Gesprächsverlauf")
+    assert messages[-2] == old_messages[-1]
+
+
+def test_select_relevant_code_prefers_enclosing_function():
+    code = "\n".join(
+        ["def f%d():\n    return %d\n" % (i, i) for i in range(50)]
+        + ["def target():\n    x = 1\n    return x\n"]
+        + ["def g%d():\n    return %d\n" % (i, i) for i in range(50)]
+    )
+    focus_line = code.splitlines().index("def target():") + 2
+
+    selected = select_relevant_code(code, 40, focus_line)
+
+    assert "def target():\n    x = 1\n    return x" in selected
+    assert selected.startswith("# ...") and selected.endswith("# ...")
+    assert estimate_tokens(selected) <= 40 + 2 * estimate_tokens("# ...")
+
+
+def test_response_cache_normalizes_and_evicts(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=3600, max_bytes=10**6)
+    key = ResponseCache.make_key([{"role": "user", "content": "Was  ist\nfalsch?"}])
+    same_key = ResponseCache.make_key([{"role": "user", "content": "was ist falsch? "}])
+    assert key == same_key
+    assert cache.get(key) is None
+
+    cache.put(key, "Schau dir Zeile 3 an.", latency=2.5)
+    assert cache.get(same_key) == "Schau dir Zeile 3 an."
+    assert (cache.hits, cache.misses, cache.saved_seconds) == (1, 1, 2.5)
+
+    cache.max_bytes = 0
+    cache.prune()
+    assert cache.get(key) is None
+
+
+def test_response_cache_key_keeps_code_verbatim():
+    def make_key(code):
+        content = "```# Aufgabenstellung: Gib x aus\n%s```\nFrage des Schülers: Was ist falsch?"
+        return ResponseCache.make_key([{"role": "user", "content": content % code}])
+
+    key = make_key("if x:\n    print(x)\n")
+    assert make_key("if x:  \r\n    print(x)\r\n") == key
+    assert make_key("if x:\n    Print(x)\n") != key
+    assert make_key("if x:\nprint(x)\n") != key
+    assert make_key("if x: print(x)\n") != key
+
+
+def test_response_cache_treats_unreadable_entries_as_missing(tmp_path, monkeypatch):
+    directory = tmp_path / "jagatud" / "vahemälu"
+    cache = ResponseCache(str(directory), ttl_seconds=3600, max_bytes=10**6)
+    if os.name != "nt":
+        # not private to the user who happened to create it
+        assert (directory.stat().st_mode & 0o777) == (0o777 & ~_get_umask())
+
+    key = ResponseCache.make_key([{"role": "user", "content": "Hallo"}])
+    cache.put(key, "Hallo!")
+
+    def deny(*args, **kwargs):
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(gpt_utils, "open", deny, raising=False)
+    assert cache.get(key) is None
+    assert cache.misses == 1
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def test_call_with_retries_backs_off_on_transient_errors():
+    calls = []
+    delays = []
+
+    def action():
+        calls.append(None)
+        if len(calls) < 3:
+            raise ConnectionError("temporary")
+        return "ok"
+
+    result = call_with_retries(
+        action,
+        lambda e: isinstance(e, ConnectionError),
+        max_retries=3,
+        base_delay=1.0,
+        get_retry_after=lambda e: 0.5,
+        sleep=delays.append,
+    )
+
+    assert result == "ok"
+    assert len(calls) == 3
+    assert 0.5 <= delays[0] <= 1.0 and 0.5 <= delays[1] <= 2.0
+
+
+def test_call_with_retries_gives_up():
+    def action():
+        raise ValueError("permanent")
+
+    with pytest.raises(ValueError):
+        call_with_retries(action, lambda e: False, max_retries=5, sleep=lambda d: None)
+
+
+def test_parse_request_settings_validates_entered_numbers():
+    options = {
+        "assistanceGPT.base_url": "",
+        "assistanceGPT.model": "gpt-4o-mini",
+        "assistanceGPT.max_retries": 3,
+        "assistanceGPT.temperature": "0,5",
+        "assistanceGPT.max_tokens": " 150 ",
+        "assistanceGPT.top_p": 0.7,
+        "assistanceGPT.frequency_penalty": "0.6",
+    }
+    settings = parse_request_settings(options.get)
+    assert settings == {
+        "base_url": None,
+        "max_retries": 3,
+        "params": {
+            "model": "gpt-4o-mini",
+            "temperature": 0.5,
+            "max_tokens": 150,
+            "top_p": 0.7,
+            "frequency_penalty": 0.6,
+        },
+    }
+
+    for name, value in [("temperature", "heiß"), ("max_tokens", "1.5"), ("top_p", "2")]:
+        with pytest.raises(ValueError, match=name):
+            parse_request_settings(dict(options, **{"assistanceGPT." + name: value}).get)
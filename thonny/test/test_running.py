@@ -0,0 +1,235 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import tkinter
+
+import pytest
+
+from thonny.common import BackendEvent
+from thonny.running import (
+    FIREHOSE_TAIL_SIZE,
+    BackendMessageQueue,
+    BackendStandbyPool,
+    OutputFirehose,
+    UiWakeup,
+)
+
+
+class _TclWidget:
+    def __init__(self):
+        self.tk = tkinter.Tcl().tk
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Tk can't watch pipes on Windows")
+def test_ui_wakeup_calls_handler_once_per_batch_of_notifications():
+    calls = []
+    widget = _TclWidget()
+    wakeup = UiWakeup(widget, lambda: calls.append(threading.current_thread()))
+    assert wakeup.is_supported()
+
+    threads = [threading.Thread(target=wakeup.notify) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    deadline = time.time() + 2
+    while not calls and time.time() < deadline:
+        widget.tk.dooneevent(tkinter._tkinter.DONT_WAIT)
+    while widget.tk.dooneevent(tkinter._tkinter.DONT_WAIT):
+        pass
+
+    assert calls == [threading.main_thread()]
+
+    # next notification gets through again
+    wakeup.notify()
+    widget.tk.dooneevent(0)
+    assert len(calls) == 2
+    wakeup.close()
+
+
+def test_backend_message_queue_wakes_consumer_and_releases_reader():
+    wakeups = []
+    queue = BackendMessageQueue(lambda: wakeups.append(None))
+    for i in range(20):
+        queue.append(i)
+    assert len(wakeups) == 20
+
+    released = threading.Event()
+
+    def read():
+        queue.wait_for_length(0, timeout=5)
+        released.set()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    while len(queue) > 1:
+        queue.popleft()
+    assert not released.wait(0.05)
+
+    queue.popleft()
+    assert released.wait(2)
+    reader.join()
+
+
+def _output(data, stream_name="stdout"):
+    return BackendEvent("ProgramOutput", data=data, stream_name=stream_name)
+
+
+def test_backend_message_queue_coalesces_output():
+    queue = BackendMessageQueue()
+    queue.append_output(_output("a\n"))
+    queue.append_output(_output("b\n"))
+    queue.append_output(_output("c\n", "stderr"))
+    queue.append_output(_output("x" * 20), max_size=10)
+
+    assert [(msg["data"], msg["stream_name"]) for msg in queue] == [
+        ("a\nb\n", "stdout"),
+        ("c\n", "stderr"),
+        ("x" * 20, "stdout"),
+    ]
+
+
+class _FakeClock:
+    def __init__(self, step):
+        self.time = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.time += self.step
+        return self.time
+
+
+def test_output_firehose_spools_runaway_output(tmp_path):
+    queue = BackendMessageQueue()
+    # 40000 lines during 4 seconds
+    firehose = OutputFirehose(
+        queue, threshold=1000, spool_dir=str(tmp_path), clock=_FakeClock(0.0001)
+    )
+    lines = ["line %d\n" % i for i in range(40000)]
+    for line in lines:
+        msg = _output(line)
+        if not firehose.publish(msg):
+            queue.append_output(msg)
+    firehose.close()
+
+    skipped = [msg for msg in queue if msg.event_type == "ProgramOutputSkipped"]
+    assert skipped
+    forwarded = "".join(msg["data"] for msg in queue if msg.event_type == "ProgramOutput")
+    assert len(forwarded) < len("".join(lines)) / 2
+    assert forwarded.endswith(lines[-1])
+    assert sum(msg["size"] for msg in skipped) + len(forwarded) == len("".join(lines))
+
+    # the log contains also the beginning of the burst, which was shown before activation
+    with open(skipped[0]["path"], encoding="utf-8") as fp:
+        assert fp.read() == "".join(lines)
+
+
+def test_output_firehose_lets_single_big_output_through(tmp_path):
+    queue = BackendMessageQueue()
+    firehose = OutputFirehose(
+        queue, threshold=500_000, spool_dir=str(tmp_path), clock=_FakeClock(0.01)
+    )
+    big_output = str(list(range(100000)))
+    assert len(big_output) > 500_000
+    assert not firehose.publish(_output(big_output))
+    for i in range(100):
+        assert not firehose.publish(_output("%d\n" % i))
+    firehose.close()
+    assert not os.listdir(str(tmp_path))
+
+
+def test_output_firehose_forwards_tail_after_output_stops(tmp_path):
+    queue = BackendMessageQueue()
+    firehose = OutputFirehose(
+        queue, threshold=1000, spool_dir=str(tmp_path), clock=_FakeClock(0.0001)
+    )
+    for i in range(20000):
+        firehose.publish(_output("%d\n" % i))
+
+    deadline = time.time() + 2
+    while not (queue and queue[-1].get("data", "").endswith("19999\n")):
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+    # last tail may be merged with the previous one, if nothing was skipped in between
+    assert len(queue[-1]["data"]) <= 2 * FIREHOSE_TAIL_SIZE
+    firehose.close()
+
+
+class _ProcessFactory:
+    def __init__(self):
+        self.procs = []
+
+    def __call__(self):
+        proc = subprocess.Popen(
+            [sys.executable, "-c", "input()"], stdin=subprocess.PIPE, universal_newlines=True
+        )
+        self.procs.append(proc)
+        return proc
+
+
+class _FakeScheduler:
+    def __init__(self):
+        self.callbacks = {}
+
+    def after(self, ms, callback):
+        after_id = "after#%d" % len(self.callbacks)
+        self.callbacks[after_id] = callback
+        return after_id
+
+    def after_cancel(self, after_id):
+        del self.callbacks[after_id]
+
+    def run_pending(self):
+        callbacks = list(self.callbacks.values())
+        self.callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+
+def test_backend_standby_pool_gives_out_processes_only_for_same_key():
+    scheduler = _FakeScheduler()
+    pool = BackendStandbyPool(scheduler)
+    create_process = _ProcessFactory()
+    assert pool.take("a") is None
+
+    pool.schedule_refill("a", 2, create_process)
+    # refill happens later and only once
+    assert pool.take("a") is None
+    pool.schedule_refill("a", 2, create_process)
+    scheduler.run_pending()
+    assert len(create_process.procs) == 2
+
+    first = pool.take("a")
+    second = pool.take("a")
+    assert first.poll() is None and second.poll() is None and first is not second
+    assert pool.take("a") is None
+    for proc in [first, second]:
+        proc.kill()
+        proc.wait()
+
+    pool.schedule_refill("a", 1, create_process)
+    scheduler.run_pending()
+    standby = create_process.procs[-1]
+    pool.schedule_refill("a", 1, create_process)
+    # asking for another key kills the standby process and cancels the refill
+    assert pool.take("b") is None
+    assert standby.wait(timeout=5) is not None
+    assert not scheduler.callbacks and len(create_process.procs) == 3
+    assert pool.take("a") is None
+
+
+def test_backend_standby_pool_reaps_killed_processes():
+    scheduler = _FakeScheduler()
+    pool = BackendStandbyPool(scheduler)
+    create_process = _ProcessFactory()
+
+    pool.schedule_refill("a", 2, create_process)
+    scheduler.run_pending()
+    pool.clear()
+    assert len(create_process.procs) == 2
+    # returncode is set only when the process has been waited for
+    assert all(proc.returncode is not None for proc in create_process.procs)
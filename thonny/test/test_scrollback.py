@@ -0,0 +1,36 @@
+from thonny.scrollback import ScrollbackStore
+
+
+def test_scrollback_store_returns_line_ranges(tmp_path):
+    store = ScrollbackStore(str(tmp_path))
+    assert store.get_line_count() == 0
+    assert store.get_lines(0, 10) == []
+
+    store.append("esimene\nteine ")
+    store.append("rida\n")
+    assert store.get_line_count() == 2
+    store.append("kolmas õ\n\nviies")
+    assert store.get_line_count() == 5
+
+    assert store.get_lines(0, 2) == ["esimene", "teine rida"]
+    assert store.get_lines(2, 100) == ["kolmas õ", "", "viies"]
+    assert store.get_lines(4, 5) == ["viies"]
+    assert store.get_text() == "esimene\nteine rida\nkolmas õ\n\nviies"
+
+    store.append(" jätkub\n")
+    assert store.get_lines(4, 5) == ["viies jätkub"]
+    store.close()
+
+
+def test_scrollback_store_finds_lines(tmp_path):
+    store = ScrollbackStore(str(tmp_path))
+    for i in range(10000):
+        store.append("mõõtmine %d: %s\n" % (i, "OK" if i % 1000 else "Viga"))
+
+    assert store.find("viga") is None
+    assert store.find("Viga") == 0
+    assert store.find("Viga", 1) == 1000
+    assert store.find("viga", 1001, nocase=True) == 2000
+    assert store.find("mõõtmine 9999", 5000, nocase=True) == 9999
+    assert store.find("Viga", 9001) is None
+    store.close()
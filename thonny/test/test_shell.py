@@ -0,0 +1,19 @@
+from array import array
+
+from thonny.shell import _decimate_min_max, _get_line_starts_in_ranges
+
+
+def test_get_line_starts_in_ranges():
+    assert _get_line_starts_in_ranges([], 1, 10) == set()
+    assert _get_line_starts_in_ranges([("2.0", "5.0")], 1, 10) == {2, 3, 4}
+    assert _get_line_starts_in_ranges([("2.3", "5.1")], 1, 10) == {3, 4, 5}
+    assert _get_line_starts_in_ranges([("1.0", "20.0"), ("25.0", "26.4")], 5, 30) == set(
+        range(5, 20)
+    ) | {25, 26}
+
+
+def test_decimate_min_max_keeps_extremes_in_order():
+    values = array("d", [3, 1, 4, 1, 5, 9, 2, 6, 5, 3])
+    assert list(_decimate_min_max(values, 1)) == list(enumerate(values))
+    assert list(_decimate_min_max(values, 4)) == [(1, 1), (2, 4), (5, 9), (6, 2), (8, 5), (9, 3)]
+    assert list(_decimate_min_max(array("d", [7, 7]), 4)) == [(0, 7)]